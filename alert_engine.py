@@ -0,0 +1,87 @@
+import os
+import bisect
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tvDatafeed import TvDatafeed, Interval
+from metrics import EXECUTOR_QUEUE, queue_depth
+
+logger = logging.getLogger(__name__)
+
+# =====================
+# 🔔 ALERT ENGINE (เช็คราคาแจ้งเตือน)
+# =====================
+# จับกลุ่มแจ้งเตือนตาม (symbol, exchange) ➜ ดึงราคาครั้งเดียวต่อตัวต่อรอบ (พร้อมกันหลาย Thread)
+# แล้วหาแจ้งเตือนที่ถึงเป้าด้วย bisect บนราคาเป้าที่เรียงไว้ (ไม่ต้องวนเทียบทุกอัน)
+ALERT_WORKERS = int(os.getenv("ALERT_WORKERS", 8))
+
+_alert_pool = ThreadPoolExecutor(max_workers=ALERT_WORKERS, thread_name_prefix="alert-fetch")
+EXECUTOR_QUEUE.set_function(lambda: queue_depth(_alert_pool), pool="alert_fetch")
+_thread_local = threading.local()
+
+def _worker_tv():
+    """TvDatafeed 1 ตัวต่อ Thread (ใช้ซ้ำทุกรอบ ไม่ต้องสร้างใหม่ทุก 2 นาที)"""
+    tv = getattr(_thread_local, "tv", None)
+    if tv is None:
+        tv = _thread_local.tv = TvDatafeed()
+    return tv
+
+def fetch_last_price(symbol, exchange):
+    """ราคาล่าสุด (แท่ง 1 นาที) หรือ None ถ้าดึงไม่ได้"""
+    try:
+        df = _worker_tv().get_hist(symbol, exchange, Interval.in_1_minute, 1)
+        return None if df is None or len(df) == 0 else float(df.iloc[-1]["close"])
+    except Exception as e:
+        logger.warning(f"Alert price fetch failed {exchange}:{symbol}: {e}")
+        return None
+
+class AlertIndex:
+    """ดัชนีแจ้งเตือนต่อ (symbol, exchange): ราคาเป้าของ above / below เรียงจากน้อยไปมาก
+    - above ถึงเป้าเมื่อ ราคา >= เป้า ➜ ทุกอันทางซ้ายของ bisect_right(ราคา)
+    - below ถึงเป้าเมื่อ ราคา <= เป้า ➜ ทุกอันทางขวาของ bisect_left(ราคา)"""
+
+    def __init__(self, alerts=()):
+        self.groups = {}
+        for alert in alerts: self.add(alert)
+
+    def add(self, alert):
+        direction = alert.get("direction")
+        if direction not in ("above", "below"): return # ทิศทางอื่นไม่เคยเตือน (เหมือนเดิม)
+        group = self.groups.setdefault((alert["symbol"], alert["exchange"]), {"above": ([], []), "below": ([], [])})
+        prices, items = group[direction]
+        i = bisect.bisect_right(prices, alert["price"])
+        prices.insert(i, alert["price"]); items.insert(i, alert)
+
+    def remove(self, alert):
+        """เอาแจ้งเตือนออก (เทียบ id) คืนค่า True ถ้าเจอ"""
+        group = self.groups.get((alert["symbol"], alert["exchange"]))
+        if group is None or alert.get("direction") not in group: return False
+        prices, items = group[alert["direction"]]
+        i = bisect.bisect_left(prices, alert["price"])
+        while i < len(prices) and prices[i] == alert["price"]:
+            if items[i].get("id") == alert.get("id"):
+                del prices[i], items[i]
+                if not any(group[d][0] for d in group): del self.groups[(alert["symbol"], alert["exchange"])]
+                return True
+            i += 1
+        return False
+
+    def instruments(self):
+        return list(self.groups)
+
+    def triggered(self, key, price):
+        group = self.groups.get(key)
+        if group is None or price is None: return []
+        above_prices, above_items = group["above"]
+        below_prices, below_items = group["below"]
+        return above_items[:bisect.bisect_right(above_prices, price)] + below_items[bisect.bisect_left(below_prices, price):]
+
+    def __len__(self):
+        return sum(len(g["above"][0]) + len(g["below"][0]) for g in self.groups.values())
+
+def check_alerts(alerts, fetch_price=fetch_last_price):
+    """เช็คแจ้งเตือนทั้งหมด 1 รอบ คืนค่า list ของ (alert, ราคาปัจจุบัน) ที่ถึงเป้า"""
+    index = AlertIndex(alerts)
+    keys = index.instruments()
+    prices = list(_alert_pool.map(lambda key: fetch_price(*key), keys))
+    return [(alert, price) for key, price in zip(keys, prices) for alert in index.triggered(key, price)]
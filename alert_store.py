@@ -1,46 +1,65 @@
-import json
-import os
+import uuid
+from datetime import datetime
+from repository import get_repository
 
 
-MONGO_URI = os.getenv("MONGO_URI")
 FILE = "/tmp/data/alerts.json"
-db_collection = None
+LEGACY_DOC_ID = "active_alerts" # รูปแบบเก่า: ทุกแจ้งเตือนอยู่ใน list ของเอกสารเดียว
+FIELDS = ("chat_id", "symbol", "exchange", "direction", "price")
 
-if MONGO_URI:
-    try:
-        from pymongo import MongoClient
-        client = MongoClient(MONGO_URI)
-        db = client["TradingBotDB"]
-        db_collection = db["alerts"]
-    except Exception as e:
-        print(f"⚠️ MongoDB Connection Error in Alerts: {e}")
+def _from_doc(doc):
+    alert = {k: doc.get(k) for k in FIELDS}
+    alert["id"] = str(doc["_id"])
+    return alert
 
+def _migrate_legacy(repo):
+    """ย้ายข้อมูลจากเอกสารเดียวแบบเก่า (active_alerts.alerts_list) มาเป็นเอกสารแยก (ทำครั้งเดียว)
+    id ของแต่ละอัน = ลำดับใน list เดิม ➜ ถ้าพังก่อนลบเอกสารเก่า รอบหน้าเขียนทับอันเดิม ไม่เกิดแจ้งเตือนซ้ำ"""
+    legacy = repo.get(LEGACY_DOC_ID)
+    if not legacy: return
+    for i, a in enumerate(legacy.get("alerts_list", [])):
+        repo.set(f"{LEGACY_DOC_ID}-{i}", {**{k: a.get(k) for k in FIELDS}, "created_at": datetime.utcnow()})
+    repo.delete([LEGACY_DOC_ID])
+
+def _legacy_file(alerts):
+    """ไฟล์แบบเก่า: list ของแจ้งเตือน (บางอันมี id แล้ว) ➜ {id: แจ้งเตือน}"""
+    return {a.get("id") or uuid.uuid4().hex: {k: a.get(k) for k in FIELDS} for a in alerts}
+
+# 1 แจ้งเตือน = 1 เอกสาร (มี id ของตัวเอง) เพิ่ม/ลบทีละอัน ไม่ต้องเขียนทับทั้งก้อน
+repo = get_repository("alerts", FILE, legacy=_legacy_file,
+                      indexes=[("symbol", "exchange"), ("chat_id",)], setup=_migrate_legacy)
+
+# ----- API -----
 def load_alerts():
-    if db_collection is not None:
-        doc = db_collection.find_one({"_id": "active_alerts"})
-        return doc.get("alerts_list", []) if doc else []
-    else:
-        if not os.path.exists(FILE): return []
-        try:
-            with open(FILE, "r") as f: return json.load(f)
-        except: return []
-
-def save_alerts(alerts):
-    if db_collection is not None:
-        db_collection.update_one(
-            {"_id": "active_alerts"},
-            {"$set": {"alerts_list": alerts}},
-            upsert=True
-        )
-    else:
-        os.makedirs(os.path.dirname(FILE), exist_ok=True)
-        with open(FILE, "w") as f: json.dump(alerts, f)
+    """แจ้งเตือนทั้งหมด (dict มี id) ใช้กับรอบเช็คราคา"""
+    return [_from_doc(d) for d in repo.find(fields=FIELDS)]
+
+def add_alert(chat_id, symbol, exchange, direction, price):
+    """เพิ่ม 1 แจ้งเตือน คืนค่า id"""
+    alert = {"chat_id": chat_id, "symbol": symbol, "exchange": exchange, "direction": direction, "price": price}
+    return repo.insert({**alert, "created_at": datetime.utcnow()})
+
+def delete_alerts(alert_ids):
+    """ลบหลายอันตาม id คืนค่าจำนวนที่ลบได้"""
+    return repo.delete([i for i in alert_ids if i])
+
+def delete_alert(alert_id):
+    return delete_alerts([alert_id]) > 0
+
+def get_alerts_for(symbol, exchange):
+    """แจ้งเตือนของ (symbol, exchange) เดียว (ใช้ Index symbol+exchange)"""
+    return [_from_doc(d) for d in repo.find({"symbol": symbol, "exchange": exchange}, FIELDS)]
+
+def get_alerts_by_chat(chat_id):
+    """แจ้งเตือนทั้งหมดของแชทเดียว (ใช้ Index chat_id)"""
+    return [_from_doc(d) for d in repo.find({"chat_id": chat_id}, FIELDS)]
 
 def remove_alert(alert):
-    alerts = load_alerts()
-    if alert in alerts:
-        alerts.remove(alert)
-        save_alerts(alerts)
+    return delete_alert(alert.get("id"))
+
+def remove_alerts(fired):
+    """ลบแจ้งเตือนที่ส่งไปแล้ว (ตาม id แจ้งเตือนที่เพิ่งตั้งระหว่างรอบเช็คไม่หาย)"""
+    return delete_alerts([a.get("id") for a in fired])
 
 def format_alert_message(alert, current_price):
     symbol = alert.get('symbol', 'UNKNOWN')
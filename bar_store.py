@@ -0,0 +1,160 @@
+import os
+import math
+import time
+import threading
+import logging
+import numpy as np
+import pandas as pd
+from metrics import GET_HIST_SECONDS, GET_HIST_ERRORS, CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# =====================
+# 💾 LOCAL BAR STORE (OHLCV CACHE บนดิสก์)
+# =====================
+# เก็บแท่งเทียนที่เคยดึงแล้ว 1 ไฟล์ต่อ 1 หุ้น/Timeframe (.npy แบบ Columnar, เปิดแบบ memory-map ได้)
+# รอบถัดไปดึงจาก TradingView เฉพาะแท่งที่ใหม่กว่าแท่งล่าสุดในไฟล์
+BAR_STORE_DIR = os.getenv("BAR_STORE_DIR", "/tmp/data/bars")
+MAX_STORED_BARS = 5000 # เก็บย้อนหลังสูงสุดต่อไฟล์ กันไฟล์โตไม่หยุด
+OVERLAP_BARS = 2       # ดึงซ้อนแท่งเก่าไว้นิดหน่อย (แท่งล่าสุดยังไม่ปิด ราคาเปลี่ยนได้)
+
+COLUMNS = ("time", "open", "high", "low", "close", "volume")
+
+INTERVAL_SECONDS = {
+    "in_1_minute": 60, "in_3_minute": 180, "in_5_minute": 300, "in_15_minute": 900,
+    "in_30_minute": 1800, "in_45_minute": 2700, "in_1_hour": 3600, "in_2_hour": 7200,
+    "in_3_hour": 10800, "in_4_hour": 14400, "in_daily": 86400, "in_weekly": 604800,
+    "in_monthly": 2592000,
+}
+
+# Timeframe อื่นสร้างจากแท่ง 1H ในไฟล์ (Resample ในเครื่อง ไม่ต้องดึงจาก TradingView เพิ่ม)
+# ค่า = (กฎ resample ของ pandas, จำนวนแท่ง 1H สูงสุดต่อ 1 แท่ง ใช้ประมาณว่าต้องดึงแท่งฐานเท่าไหร่)
+TIMEFRAMES = {"1H": (None, 1), "4H": ("4h", 4), "1D": ("1D", 24)}
+OHLCV_AGG = {"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"}
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+def _lock_for(path):
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+def _path_for(symbol, exchange, interval):
+    name = f"{exchange}_{symbol}_{interval.name}.npy".replace("/", "_").replace(":", "_")
+    return os.path.join(BAR_STORE_DIR, name)
+
+def _load(path):
+    """โหลดไฟล์แบบ memory-map (แถว = คอลัมน์ตาม COLUMNS)"""
+    if not os.path.exists(path): return None
+    try:
+        return np.load(path, mmap_mode="r")
+    except Exception as e:
+        logger.warning(f"Bar store read failed ({path}): {e}")
+        return None
+
+def _save(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp.npy"
+    np.save(tmp, np.ascontiguousarray(data))
+    os.replace(tmp, path)
+
+def _to_columns(df):
+    times = df.index.values.astype("datetime64[s]").astype(np.int64).astype(float)
+    cols = [times] + [df[c].to_numpy(dtype=float) if c in df.columns else np.zeros(len(df)) for c in COLUMNS[1:]]
+    return np.vstack(cols)
+
+def _to_frame(data, symbol, exchange):
+    df = pd.DataFrame({c: np.array(data[i]) for i, c in enumerate(COLUMNS[1:], start=1)},
+                      index=pd.DatetimeIndex(np.array(data[0]).astype("datetime64[s]").astype("datetime64[ns]")))
+    df.index.name = "datetime"
+    df.insert(0, "symbol", f"{exchange}:{symbol}")
+    return df
+
+def _merge(stored, fresh):
+    """เอาแท่งใหม่ทับแท่งเก่าตั้งแต่เวลาแรกของแท่งใหม่เป็นต้นไป"""
+    if stored is None or stored.shape[1] == 0: return fresh
+    keep = np.asarray(stored[0]) < fresh[0, 0]
+    merged = np.hstack([np.asarray(stored)[:, keep], fresh])
+    return merged[:, -MAX_STORED_BARS:]
+
+def _tv_get_hist(tv, symbol, exchange, interval, n_bars):
+    """tv.get_hist() + เก็บเวลาที่ใช้/จำนวนครั้งที่พังลง metrics"""
+    t0 = time.perf_counter()
+    try:
+        df = tv.get_hist(symbol=symbol, exchange=exchange, interval=interval, n_bars=n_bars)
+    except Exception:
+        GET_HIST_ERRORS.inc(reason="exception")
+        raise
+    finally:
+        GET_HIST_SECONDS.observe(time.perf_counter() - t0)
+    if df is None or len(df) == 0: GET_HIST_ERRORS.inc(reason="empty")
+    return df
+
+def _fetch_or_none(tv, symbol, exchange, interval, n_bars):
+    """เหมือน _tv_get_hist แต่พังแล้วคืน None (ใช้ตอนมีแท่งในไฟล์ให้ใช้แทนได้)"""
+    try:
+        return _tv_get_hist(tv, symbol, exchange, interval, n_bars)
+    except Exception as e:
+        logger.debug(f"get_hist {exchange}:{symbol} failed, using stored bars: {e}")
+        return None
+
+def get_hist(tv, symbol, exchange, interval, n_bars):
+    """ใช้แทน tv.get_hist(): เช็คไฟล์ในเครื่องก่อน แล้วดึงเพิ่มเฉพาะส่วนที่ขาด
+    คืน DataFrame หน้าตาเดียวกับ TvDatafeed (index = datetime) หรือ None ถ้าดึงไม่ได้และไม่มีในไฟล์"""
+    path = _path_for(symbol, exchange, interval)
+    step = INTERVAL_SECONDS.get(interval.name)
+
+    with _lock_for(path):
+        stored = _load(path)
+        fetch_n = n_bars
+        if stored is not None and step and stored.shape[1] >= n_bars:
+            # คำนวณว่าผ่านไปกี่แท่งแล้วนับจากแท่งล่าสุดในไฟล์
+            # (เวลาในไฟล์เป็นเวลาท้องถิ่นแบบไม่มี tz เหมือน TvDatafeed จึงเทียบกับ now() แบบเดียวกัน)
+            elapsed = pd.Timestamp.now().timestamp() - float(stored[0, -1])
+            fetch_n = min(n_bars, max(0, math.ceil(elapsed / step)) + OVERLAP_BARS)
+
+        # hit = มีไฟล์อยู่แล้ว ดึงแค่แท่งที่ขาด, miss = ต้องดึงเต็มจำนวน
+        hit = fetch_n < n_bars
+        CACHE_REQUESTS.inc(cache="bar_store", result="hit" if hit else "miss")
+        df = _fetch_or_none(tv, symbol, exchange, interval, fetch_n) if hit else _tv_get_hist(tv, symbol, exchange, interval, fetch_n)
+        if df is None or len(df) == 0:
+            # ดึงส่วนที่ขาดไม่ได้ (TradingView พังชั่วคราว) ใช้แท่งที่มีในไฟล์ไปก่อน ไม่ให้หุ้นหลุดจากการสแกน
+            return _to_frame(stored[:, -n_bars:], symbol, exchange) if hit else None
+
+        fresh = _to_columns(df)
+        if hit:
+            # ข้อมูลไม่ต่อเนื่อง (แท่งใหม่ไม่ซ้อนกับแท่งเก่า) ให้เริ่มไฟล์ใหม่ด้วยการดึงเต็ม
+            if fresh[0, 0] > stored[0, -1]:
+                df = _fetch_or_none(tv, symbol, exchange, interval, n_bars)
+                if df is None or len(df) == 0: return _to_frame(stored[:, -n_bars:], symbol, exchange)
+                data = _to_columns(df)
+            else:
+                data = _merge(stored, fresh)
+        elif stored is not None and stored.shape[1] and fresh[0, 0] > stored[0, -1]:
+            # ดึงเต็มแล้วแต่ไม่ซ้อนกับไฟล์เก่า (ไฟล์เก่าเกินช่วงที่ดึง) ต่อกันจะมีรูกลางกราฟ ➜ ใช้แท่งใหม่แทนทั้งไฟล์
+            data = fresh
+        else:
+            data = _merge(stored, fresh)
+
+        try:
+            _save(path, data)
+        except Exception as e:
+            logger.warning(f"Bar store write failed ({path}): {e}")
+
+    return _to_frame(data[:, -n_bars:], symbol, exchange)
+
+def resample(df, timeframe):
+    """รวมแท่ง 1H เป็น Timeframe ที่ใหญ่กว่า (แท่งสุดท้ายอาจยังไม่ครบช่วง เหมือนแท่งที่ยังไม่ปิดของ TradingView)"""
+    rule = TIMEFRAMES[timeframe][0]
+    if rule is None: return df
+    agg = {c: f for c, f in OHLCV_AGG.items() if c in df.columns}
+    out = df.resample(rule).agg(agg).dropna(subset=["close"])
+    if "symbol" in df.columns: out.insert(0, "symbol", df["symbol"].iloc[0])
+    return out
+
+def get_hist_tf(tv, symbol, exchange, base_interval, timeframe, n_bars):
+    """เหมือน get_hist() แต่คืนค่าเป็น timeframe ("1H", "4H", "1D") ที่สร้างจากแท่ง base_interval (1H) ในไฟล์"""
+    base_bars = min(n_bars * TIMEFRAMES[timeframe][1], MAX_STORED_BARS)
+    df = get_hist(tv, symbol, exchange, base_interval, base_bars)
+    if df is None: return None
+    return resample(df, timeframe).iloc[-n_bars:]
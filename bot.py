@@ -7,7 +7,8 @@ import requests
 from datetime import time as dt_time, timezone, timedelta
 from http.server import BaseHTTPRequestHandler, HTTPServer
 import socket
-from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
@@ -38,8 +39,11 @@ if not BOT_TOKEN:
 # ✅ สร้าง Thread Pool สำหรับทำงานหนักคู่ขนานกัน (20 คนพร้อมกันสบายๆ)
 executor = ThreadPoolExecutor(max_workers=20)
 
-# ✅ Lock ป้องกัน Matplotlib พัง (ใช้เฉพาะตอนวาดกราฟ /signal)
-signal_lock = asyncio.Lock()
+# ✅ วาดกราฟ /signal ใน Process แยก (แต่ละ Process มี Matplotlib ของตัวเอง ไม่ต้องต่อคิวกันอีก)
+# ใช้ forkserver (process_context) ไม่ใช้ fork: ตอนสร้าง Pool มี Thread อื่นทำงานอยู่แล้ว fork จะติด Lock ค้างไปด้วย
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", max(1, min(4, os.cpu_count() or 1))))
+render_pool = None
+_render_pool_lock = threading.Lock()
 
 # ==========================================
 # 🧩 IMPORTS
@@ -51,28 +55,45 @@ try:
         def get_user_guide(): return "❌ ไม่พบไฟล์คู่มือ (guide.py)"
 
     from strategy import (
-        run_strategy,
+        run_strategy, optimize_strategy, run_portfolio_backtest, MARKET_REGIONS,
         scan_top_th_symbols, scan_top_cn_symbols, scan_top_hk_symbols, scan_top_us_stock_symbols, scan_top_crypto_symbols,
         scan_top_th_sell_symbols, scan_top_cn_sell_symbols, scan_top_hk_sell_symbols, scan_top_us_stock_sell_symbols, scan_top_crypto_sell_symbols,
         get_top_th_text, get_top_cn_text, get_top_hk_text, get_top_us_stock_text, get_top_crypto_text, get_global_top_text,
         get_top_th_sell_text, get_top_cn_sell_text, get_top_hk_sell_text, get_top_us_stock_sell_text, get_top_crypto_sell_text, get_global_sell_text,
-        run_scan_asia_market, run_scan_th_market, run_scan_us_market
+        run_scan_asia_market, run_scan_th_market, run_scan_us_market, start_cache_warmup, process_context
     )
     
-    from alert_store import load_alerts, save_alerts, remove_alert, format_alert_message
-    from user_store import is_new_user, mark_user_seen
-    from top_notify_store import add_top_notify_user, remove_top_notify_user, load_top_notify_users
-    from tvDatafeed import TvDatafeed, Interval
+    from signal_cache import SIGNAL_CACHE
+    from bar_store import TIMEFRAMES
+    from alert_store import load_alerts, add_alert, remove_alerts, format_alert_message
+    from alert_engine import check_alerts
+    from price_stream import AlertStream, make_default_feed
+    from user_store import is_new_user, mark_user_seen, USERS
+    from top_notify_store import add_top_notify_user, remove_top_notify_user, remove_top_notify_users, replace_top_notify_users, load_top_notify_users
+    from broadcast import broadcast_text
+    from metrics import render as render_metrics, EXECUTOR_QUEUE, ALERT_CYCLE_SECONDS, ALERTS_FIRED, queue_depth
 
 except ImportError as e:
     logger.critical(f"❌ IMPORT ERROR: {e}")
     exit(1)
 
+EXECUTOR_QUEUE.set_function(lambda: queue_depth(executor), pool="bot")
+EXECUTOR_QUEUE.set_function(lambda: queue_depth(render_pool), pool="render")
+
 # ======================
 # 🌐 DUMMY SERVER 
 # ======================
 class SimpleHandler(BaseHTTPRequestHandler):
     def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            # 📈 ให้ Prometheus มาดึง (เวลาสแกน, latency get_hist, คิว Executor, แจ้งเตือน, Broadcast, Cache)
+            body = render_metrics().encode()
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
         self.send_response(200)
         self.send_header('Content-type', 'text/plain')
         self.end_headers()
@@ -129,43 +150,59 @@ def make_progress_bar(percent, length=12):
 # ======================
 # 🛠 BACKGROUND TASKS (แก้ไขปัญหาค้าง 100%)
 # ======================
-async def _scan_bg_task(chat_id: int, bot, scan_func, get_text_func, market_name: str):
-    """ฟังก์ชันที่จะถูกโยนไปรันเบื้องหลัง ทำให้บอทไม่ค้าง"""
-    start_msg_text = f"📡 *INITIALIZING SCAN...*\n🔍 Target: *{market_name}*\n\n`[░░░░░░░░░░░░] 0%`"
-    
-    # ส่งข้อความไปก่อน แล้วเก็บ Message ID ไว้แก้ไขทีหลัง
-    status_msg = await bot.send_message(chat_id=chat_id, text=start_msg_text, parse_mode="Markdown")
-    
-    last_update_time = time.time()
-    loop = asyncio.get_running_loop()
+# ✅ Single-flight: ใครสั่งสแกนตลาด/โหมดเดียวกันระหว่างที่กำลังสแกนอยู่ จะรอผลจากรอบเดียวกัน
+# key = scan_func (1 ฟังก์ชัน = 1 ตลาด + 1 โหมด), value = {"future": ..., "subscribers": [...]}
+# งานตั้งเวลา (job_scan_*) ไม่ผ่านตารางนี้ แต่ _stateful_scan ล็อกทีละตลาดไว้แล้ว จึงไม่สแกนตลาดเดียวกันซ้อนกัน
+_scan_flights = {}
 
-    # Callback อัปเดต %
+def _make_progress_callback(flight, bot, market_name, loop):
+    """Callback อัปเดต % (ถูกเรียกจาก Thread สแกน) กระจายไปทุกแชทที่รอผลรอบนี้"""
     def progress_callback(current, total):
-        nonlocal last_update_time
         now = time.time()
-        
-        # อัปเดตระหว่างทาง (ทุก 3 วิ)
-        if now - last_update_time > 3.0 and current < total:
-            percent = int((current / total) * 100)
-            bar = make_progress_bar(percent, length=12) 
-            text = (
-                f"📡 *SCANNING MARKET...*\n"
-                f"🎯 Target: *{market_name}*\n"
-                f"🔎 Checked: {current}/{total}\n\n"
-                f"`[{bar}] {percent}%`\n"
-                f"⏳ _Please wait..._"
-            )
+        if current >= total: return
+        percent = int((current / total) * 100)
+        bar = make_progress_bar(percent, length=12) 
+        text = (
+            f"📡 *SCANNING MARKET...*\n"
+            f"🎯 Target: *{market_name}*\n"
+            f"🔎 Checked: {current}/{total}\n\n"
+            f"`[{bar}] {percent}%`\n"
+            f"⏳ _Please wait..._"
+        )
+        for sub in list(flight["subscribers"]):
+            # อัปเดตระหว่างทาง (ทุก 3 วิ ต่อแชท)
+            if now - sub["last_update"] <= 3.0: continue
+            sub["last_update"] = now
             try:
                 asyncio.run_coroutine_threadsafe(
-                    bot.edit_message_text(text=text, chat_id=chat_id, message_id=status_msg.message_id, parse_mode="Markdown"), 
+                    bot.edit_message_text(text=text, chat_id=sub["chat_id"], message_id=sub["message_id"], parse_mode="Markdown"), 
                     loop
                 )
             except Exception: pass
-            last_update_time = time.time()
+    return progress_callback
+
+async def _scan_bg_task(chat_id: int, bot, scan_func, get_text_func, market_name: str):
+    """ฟังก์ชันที่จะถูกโยนไปรันเบื้องหลัง ทำให้บอทไม่ค้าง"""
+    start_msg_text = f"📡 *INITIALIZING SCAN...*\n🔍 Target: *{market_name}*\n\n`[░░░░░░░░░░░░] 0%`"
+    
+    # ส่งข้อความไปก่อน แล้วเก็บ Message ID ไว้แก้ไขทีหลัง
+    status_msg = await bot.send_message(chat_id=chat_id, text=start_msg_text, parse_mode="Markdown")
+    loop = asyncio.get_running_loop()
+
+    # 🚀 1. มีคนสแกนตลาดนี้อยู่แล้ว ➜ ขอรอผลด้วย / ยังไม่มี ➜ เริ่มสแกนรอบใหม่
+    flight = _scan_flights.get(scan_func)
+    if flight is None:
+        flight = _scan_flights[scan_func] = {"future": None, "subscribers": []}
+        progress_callback = _make_progress_callback(flight, bot, market_name, loop)
+        flight["future"] = loop.run_in_executor(executor, lambda: scan_func(callback=progress_callback))
+        flight["future"].add_done_callback(lambda _: _scan_flights.pop(scan_func, None))
+    else:
+        logger.info(f"🔗 Joined in-flight scan ({market_name}), waiting: {len(flight['subscribers']) + 1}")
+    flight["subscribers"].append({"chat_id": chat_id, "message_id": status_msg.message_id, "last_update": time.time()})
 
     try:
-        # 🚀 1. สั่งรันสแกนเบื้องหลังให้เสร็จสมบูรณ์
-        await loop.run_in_executor(executor, lambda: scan_func(callback=progress_callback))
+        # shield: ถ้าคนใดคนหนึ่งยกเลิก รอบสแกนของคนอื่นต้องไม่ถูกยกเลิกไปด้วย
+        await asyncio.shield(flight["future"])
         
         # 🚀 2. เมื่อหลุดจากบรรทัดบนแปลว่า "เสร็จแล้ว 100%" แน่นอน
         # ให้ดึงข้อความผลลัพธ์มา Edit ทับทันที (ไม่ต้องสน Callback ตอน 100% แล้ว)
@@ -189,27 +226,82 @@ async def _scan_bg_task(chat_id: int, bot, scan_func, get_text_func, market_name
             )
         except: pass
 
-async def _signal_bg_task(chat_id: int, bot, symbol: str, exchange: str):
+def _init_render_worker():
+    # import matplotlib ใน Process วาดกราฟเท่านั้น (Process หลักไม่ต้องโหลดเลย)
+    from chart_renderer import init_render_worker
+    init_render_worker()
+
+def _render_chart(**chart_job):
+    from chart_renderer import render_signal_chart
+    return render_signal_chart(**chart_job)
+
+def get_render_pool():
+    """Process วาดกราฟ (forkserver: สร้างตอนไหนก็ได้ ไม่ติด Lock ของ Thread ที่รันอยู่)"""
+    global render_pool
+    if render_pool is None:
+        with _render_pool_lock:
+            if render_pool is None:
+                render_pool = ProcessPoolExecutor(
+                    max_workers=RENDER_WORKERS,
+                    mp_context=process_context(),
+                    initializer=_init_render_worker
+                )
+    return render_pool
+
+def warm_render_pool():
+    """เปิด forkserver + Worker วาดกราฟตัวแรกไว้ก่อน (รันใน Thread: การเปิด Process ครั้งแรกรอ import หลายวินาที
+    ถ้าปล่อยให้ /signal แรกเป็นคนเปิด จะไปค้าง Event Loop ตอน submit) matplotlib โหลดใน Worker ไม่ใช่ Process หลัก"""
+    try: get_render_pool().submit(os.getpid).result()
+    except Exception as e: logger.warning(f"⚠️ Render pool warmup failed: {e}")
+
+async def _signal_bg_task(chat_id: int, bot, symbol: str, exchange: str, timeframe: str = "1H"):
     """ฟังก์ชันวาดกราฟเบื้องหลัง"""
     msg = await bot.send_message(chat_id=chat_id, text="⏳ Analyzing Data & Generating Chart...")
     try:
         loop = asyncio.get_running_loop()
         
-        # คิวการสร้างกราฟ (วาดทีละรูป ป้องกัน Matplotlib พัง)
-        async with signal_lock:
-            res = await loop.run_in_executor(executor, run_strategy, symbol, exchange)
+        # ดึงข้อมูล + Backtest (Thread) แล้วค่อยส่งไปวาดกราฟ (Process Pool) รันพร้อมกันได้หลายคน
+        # รูปกลับมาเป็น bytes ในหน่วยความจำ ส่งเข้า Telegram ตรง ๆ (ไม่มีไฟล์ชั่วคราว ชื่อไม่ชนกันเวลาขอตัวเดียวกันพร้อมกัน)
+        res = await loop.run_in_executor(executor, partial(run_strategy, symbol, exchange, render=False, in_memory=True, timeframe=timeframe))
+        cached = res.get("cached")
+        if res.get("chart_job"):
+            chart_bytes = await loop.run_in_executor(get_render_pool(), partial(_render_chart, **res["chart_job"]))
+            cached = SIGNAL_CACHE.put(res["cache_key"], res["text"], chart_bytes, res.get("stats"))
         
         await bot.delete_message(chat_id=chat_id, message_id=msg.message_id)
         await bot.send_message(chat_id=chat_id, text=res["text"], parse_mode="Markdown")
         
-        if res["chart"] and os.path.exists(res["chart"]):
-            with open(res["chart"], "rb") as p: 
-                await bot.send_photo(chat_id=chat_id, photo=p)
-            os.remove(res["chart"])
+        if cached and (cached["file_id"] or cached["chart_bytes"]):
+            # เคยส่งรูปนี้แล้ว ใช้ file_id เดิมของ Telegram ไม่ต้องอัปโหลดซ้ำ
+            sent = await bot.send_photo(chat_id=chat_id, photo=cached["file_id"] or cached["chart_bytes"])
+            if not cached["file_id"] and sent.photo:
+                SIGNAL_CACHE.set_file_id(res["cache_key"], sent.photo[-1].file_id)
             
     except Exception as e: 
         await bot.edit_message_text(text=f"❌ Error: {e}", chat_id=chat_id, message_id=msg.message_id)
 
+async def _optimize_bg_task(chat_id: int, bot, symbol: str, exchange: str):
+    """Sweep พารามิเตอร์เบื้องหลัง (ดึงกราฟใน Thread แล้วกระจาย Backtest ไปที่ Process Pool)"""
+    msg = await bot.send_message(chat_id=chat_id, text="⏳ Optimizing Strategy Parameters...")
+    try:
+        loop = asyncio.get_running_loop()
+        res = await loop.run_in_executor(executor, optimize_strategy, symbol, exchange)
+        await bot.edit_message_text(text=res["text"], chat_id=chat_id, message_id=msg.message_id, parse_mode="Markdown")
+    except Exception as e:
+        await bot.edit_message_text(text=f"❌ Error: {e}", chat_id=chat_id, message_id=msg.message_id)
+
+async def _portfolio_bg_task(chat_id: int, bot, market: str, limit: int):
+    """Backtest ทั้งตลาดเบื้องหลัง (แสดง % ระหว่างดึงกราฟแบบเดียวกับการสแกน)"""
+    msg = await bot.send_message(chat_id=chat_id, text=f"⏳ Backtesting {market} portfolio...")
+    try:
+        loop = asyncio.get_running_loop()
+        flight = {"subscribers": [{"chat_id": chat_id, "message_id": msg.message_id, "last_update": 0}]}
+        callback = _make_progress_callback(flight, bot, f"PORTFOLIO {market}", loop)
+        res = await loop.run_in_executor(executor, partial(run_portfolio_backtest, market, limit, callback=callback))
+        await bot.edit_message_text(text=res["text"], chat_id=chat_id, message_id=msg.message_id, parse_mode="Markdown")
+    except Exception as e:
+        await bot.edit_message_text(text=f"❌ Error: {e}", chat_id=chat_id, message_id=msg.message_id)
+
 # ======================
 # 🎮 COMMAND HANDLERS (✅ เปลี่ยนให้ลื่นไหล 100%)
 # ======================
@@ -218,9 +310,22 @@ async def execute_scan_command(update: Update, context: ContextTypes.DEFAULT_TYP
     asyncio.create_task(_scan_bg_task(update.effective_chat.id, context.bot, scan_func, get_text_func, market_name))
 
 async def signal(u: Update, c: ContextTypes.DEFAULT_TYPE):
-    if not c.args or len(c.args)<2: return await u.message.reply_text("Usage: /signal BTCUSDT BINANCE")
+    timeframe = c.args[2].upper() if c.args and len(c.args) > 2 else "1H"
+    if not c.args or len(c.args)<2 or timeframe not in TIMEFRAMES:
+        return await u.message.reply_text(f"Usage: /signal BTCUSDT BINANCE [{'/'.join(TIMEFRAMES)}]")
     # 🎯 ใช้ create_task วาดกราฟเบื้องหลัง 
-    asyncio.create_task(_signal_bg_task(u.effective_chat.id, c.bot, c.args[0].upper(), c.args[1].upper()))
+    asyncio.create_task(_signal_bg_task(u.effective_chat.id, c.bot, c.args[0].upper(), c.args[1].upper(), timeframe))
+
+async def optimize(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    if not c.args or len(c.args)<2: return await u.message.reply_text("Usage: /optimize BTCUSDT BINANCE")
+    asyncio.create_task(_optimize_bg_task(u.effective_chat.id, c.bot, c.args[0].upper(), c.args[1].upper()))
+
+async def portfolio(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    markets = ["CRYPTO", *MARKET_REGIONS]
+    if not c.args or c.args[0].upper() not in markets or (len(c.args) > 1 and not c.args[1].isdigit()):
+        return await u.message.reply_text(f"Usage: /portfolio CRYPTO 100 (markets: {', '.join(markets)})")
+    limit = min(int(c.args[1]), 500) if len(c.args) > 1 else 100
+    asyncio.create_task(_portfolio_bg_task(u.effective_chat.id, c.bot, c.args[0].upper(), limit))
 
 async def start(u: Update, c: ContextTypes.DEFAULT_TYPE):
     chat_id = u.effective_chat.id
@@ -261,9 +366,9 @@ async def alert(u, c):
     if not c.args or len(c.args)!=4: return await u.message.reply_text("Ex: /alert BTCUSDT BINANCE above 50000")
     try:
         p = float(c.args[3])
-        al = load_alerts()
-        al.append({"chat_id":u.effective_chat.id, "symbol":c.args[0].upper(), "exchange":c.args[1].upper(), "direction":c.args[2], "price":p})
-        save_alerts(al)
+        a = {"chat_id":u.effective_chat.id, "symbol":c.args[0].upper(), "exchange":c.args[1].upper(), "direction":c.args[2], "price":p}
+        a["id"] = add_alert(**a)
+        if alert_stream: await alert_stream.add(a)
         await u.message.reply_text("✅ Alert Saved!")
     except: await u.message.reply_text("❌ Error saving alert")
 
@@ -313,28 +418,82 @@ async def job_notify(ctx):
     # ดึงข้อความมาเตรียมไว้รอบเดียว จะได้ไม่ดึงซ้ำๆ ให้หนักเครื่อง
     msg = f"🌅 *DAILY GLOBAL UPDATE*\n\n{get_global_top_text()}\n\n{get_global_sell_text()}"
     
-    success_count = 0
-    for chat_id in users:
-        try:
-            # ใช้วิธีส่งแบบปกติ ไม่ต้องครอบด้วย run_in_executor เพราะมันเป็น Async อยู่แล้ว
-            await ctx.bot.send_message(chat_id=chat_id, text=msg, parse_mode="Markdown")
-            success_count += 1
-            await asyncio.sleep(0.5) # พักเบรกนิดหน่อย กันโดน Telegram มองว่าเราสแปมข้อความ
-        except Exception as e:
-            logger.error(f"❌ ส่งแจ้งเตือนให้ {chat_id} ไม่สำเร็จ: {e}")
+    # ส่งพร้อมกันแบบคุมความเร็ว (Token Bucket ตามลิมิต Telegram) + รอตาม RetryAfter อัตโนมัติ
+    res = await broadcast_text(ctx.bot, users, msg, parse_mode="Markdown")
+    if res["blocked"]:
+        # คนที่บล็อกบอทไปแล้ว ไม่ต้องส่งอีก
+        await asyncio.get_running_loop().run_in_executor(executor, remove_top_notify_users, res["blocked"])
+    if res["migrated"]:
+        # กลุ่มที่ย้ายเป็น Supergroup: เก็บ chat_id ใหม่แทน
+        await asyncio.get_running_loop().run_in_executor(executor, replace_top_notify_users, res["migrated"])
             
-    logger.info(f"✅ ส่ง Daily Notification สำเร็จ {success_count}/{len(users)} คน")
+    logger.info(f"✅ ส่ง Daily Notification สำเร็จ {res['sent']}/{len(users)} คน "
+                f"(blocked {len(res['blocked'])}, failed {res['failed']}, {res['rate']:.1f} msg/s, {res['elapsed']:.1f}s)")
 
 async def job_check_alerts(ctx):
-    tv=TvDatafeed(); al=load_alerts(); rem=al.copy()
-    for a in al:
+    with ALERT_CYCLE_SECONDS.time():
+        await _check_alerts_cycle(ctx)
+
+async def _check_alerts_cycle(ctx):
+    # อ่านฐานข้อมูลใน Thread (ทั้ง collection) ไม่ให้ Event Loop ค้างทุก 2 นาที
+    al = await asyncio.get_running_loop().run_in_executor(executor, load_alerts)
+    if alert_stream:
+        # อัปเดตดัชนีของ Stream ทุกรอบ แล้ว Polling เฉพาะตัวที่ Stream ไม่ได้ดูแล (หรือตอน Stream หลุด)
+        await alert_stream.sync(al)
+        al = [a for a in al if not alert_stream.covers(a)]
+    if not al: return
+    # ดึงราคาครั้งเดียวต่อ (symbol, exchange) พร้อมกันใน Thread แล้วหาตัวที่ถึงเป้าด้วย bisect
+    fired = await asyncio.get_running_loop().run_in_executor(executor, check_alerts, al)
+    sent = []
+    for a, c in fired:
         try:
-            df=tv.get_hist(a["symbol"], a["exchange"], Interval.in_1_minute, 1)
-            if df is not None:
-                c=df.iloc[-1]["close"]; h=(a["direction"]=="above" and c>=a["price"]) or (a["direction"]=="below" and c<=a["price"])
-                if h: await ctx.bot.send_message(a["chat_id"], format_alert_message(a, c), parse_mode="Markdown"); rem.remove(a)
+            await ctx.bot.send_message(a["chat_id"], format_alert_message(a, c), parse_mode="Markdown"); sent.append(a)
         except: pass
-    if len(rem)!=len(al): save_alerts(rem)
+    if sent:
+        ALERTS_FIRED.inc(len(sent), source="poll")
+        await asyncio.get_running_loop().run_in_executor(executor, remove_alerts, sent)
+
+# ======================
+# ⚡ ALERT STREAM (เตือนทันทีที่ราคาถึง ไม่ต้องรอรอบ 2 นาที)
+# ======================
+alert_stream = None
+
+async def _on_stream_alert(bot, a, price):
+    try:
+        await bot.send_message(a["chat_id"], format_alert_message(a, price), parse_mode="Markdown")
+    except Exception as e:
+        logger.warning(f"Stream alert send failed: {e}")
+        return alert_stream.restore(a)
+    ALERTS_FIRED.inc(source="stream")
+    await asyncio.get_running_loop().run_in_executor(executor, remove_alerts, [a])
+
+async def start_alert_stream(app):
+    global alert_stream
+    feed = make_default_feed()
+    if feed is None:
+        logger.info("⚡ Alert stream disabled (polling every 120s)")
+        return
+    alert_stream = AlertStream(feed, partial(_on_stream_alert, app.bot))
+    await alert_stream.sync(await asyncio.get_running_loop().run_in_executor(executor, load_alerts))
+    alert_stream.start()
+
+_startup_tasks = set() # เก็บ reference ไว้ (Task ที่ไม่มีใครถือจะโดนเก็บกวาดกลางทาง)
+
+def _startup_done(task):
+    _startup_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"⚠️ Startup task failed: {task.exception()}")
+
+async def post_init(app):
+    # งานโหลดข้อมูลตอนเปิดบอททำเบื้องหลังทั้งหมด บอทเริ่มรับคำสั่งได้ทันที
+    # - ผลสแกน Top เก่า: โหลดทีเดียว ระหว่างนั้น /top ตอบจากเท่าที่มี
+    # - รายชื่อผู้ใช้: ถ้ามีคนทักมาก่อนโหลดเสร็จ USERS ตอบจากคนที่เพิ่งเห็นไปก่อน (ไม่รออ่านฐานข้อมูล)
+    # - Process วาดกราฟ: เปิดรอไว้ /signal แรกจะได้ไม่ต้องรอ import matplotlib
+    start_cache_warmup()
+    asyncio.get_running_loop().run_in_executor(executor, USERS.load)
+    asyncio.get_running_loop().run_in_executor(executor, warm_render_pool)
+    task = asyncio.create_task(start_alert_stream(app))
+    _startup_tasks.add(task); task.add_done_callback(_startup_done)
 
 # ======================
 # MAIN
@@ -342,11 +501,13 @@ async def job_check_alerts(ctx):
 def main():
 
     # เปิดใช้งานการรับคำสั่งคู่ขนานแบบเต็มสูบ
-    app = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(True).build()
+    app = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(True).post_init(post_init).build()
     
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("signal", signal))
+    app.add_handler(CommandHandler("optimize", optimize))
+    app.add_handler(CommandHandler("portfolio", portfolio))
     app.add_handler(CommandHandler("alert", alert))
     
     app.add_handler(CommandHandler("top", top_crypto)); app.add_handler(CommandHandler("top_th", top_th))
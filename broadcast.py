@@ -0,0 +1,126 @@
+import os
+import time
+import asyncio
+import logging
+from telegram.error import RetryAfter, Forbidden, ChatMigrated, TimedOut, NetworkError
+from metrics import BROADCAST_MESSAGES, BROADCAST_THROUGHPUT
+
+logger = logging.getLogger(__name__)
+
+# =====================
+# 📣 BROADCAST PIPELINE (ส่งข้อความจำนวนมาก)
+# =====================
+# ส่งพร้อมกันหลาย Worker แต่คุมความเร็วด้วย Token Bucket ตามลิมิตของ Telegram
+# - รวมทั้งบอท ~30 ข้อความ/วินาที (ตั้งต่ำกว่านิดหน่อยเผื่อไว้)
+# - ต่อ 1 แชท ~1 ข้อความ/วินาที
+# โดน RetryAfter = หยุดทั้งท่อตามเวลาที่ Telegram บอก แล้วส่งอันเดิมใหม่ (ไม่เกิน BROADCAST_FLOOD_RETRIES ครั้งต่อข้อความ)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+BROADCAST_CHAT_INTERVAL = float(os.getenv("BROADCAST_CHAT_INTERVAL", 1.0))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 20))
+BROADCAST_RETRIES = 3
+BROADCAST_FLOOD_RETRIES = int(os.getenv("BROADCAST_FLOOD_RETRIES", 5))
+
+class TokenBucket:
+    """Token Bucket แบบ async: เติม rate โทเคน/วินาที เก็บได้สูงสุด capacity
+    (ค่าเริ่มต้นเก็บได้ 1 = ส่งเรียบๆ ไม่มีช่วงพุ่ง จะได้ไม่เกินลิมิตในกรอบ 1 วินาทีใดๆ)"""
+
+    def __init__(self, rate, capacity=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """หยุดแจกโทเคน (ใช้ตอนโดน RetryAfter) แล้วเริ่มใหม่จากถังว่าง"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    self.updated = time.monotonic()
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def _seconds(retry_after):
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+async def broadcast(bot, messages, rate=BROADCAST_RATE, chat_interval=BROADCAST_CHAT_INTERVAL,
+                    workers=BROADCAST_WORKERS, retries=BROADCAST_RETRIES, flood_retries=BROADCAST_FLOOD_RETRIES, **send_kwargs):
+    """ส่ง messages = [(chat_id, text), ...] ผ่าน bot.send_message (send_kwargs เช่น parse_mode)
+    คืนค่า dict: sent, failed, blocked (chat_id ที่บล็อกบอท/ปิดบัญชี), migrated, elapsed, rate (ข้อความ/วินาที)"""
+    bucket = TokenBucket(rate)
+    queue = asyncio.Queue()
+    # (chat_id, text, ครั้งที่ลองใหม่เพราะเน็ต, ครั้งที่ลองใหม่เพราะ RetryAfter)
+    for chat_id, text in messages: queue.put_nowait((chat_id, text, 0, 0))
+    total = queue.qsize()
+    next_send = {} # chat_id ➜ เวลาที่ส่งข้อความถัดไปให้แชทนี้ได้
+    stats = {"total": total, "sent": 0, "failed": 0, "blocked": [], "migrated": {}}
+    t0 = time.monotonic()
+
+    async def send_one(chat_id, text, attempt, floods):
+        # จองช่องเวลาของแชทนี้ก่อนรอ (หลาย Worker ได้แชทเดียวกันจะเรียงคิวกันถูก)
+        now = time.monotonic()
+        slot = max(now, next_send.get(chat_id, now))
+        next_send[chat_id] = slot + chat_interval
+        if slot > now: await asyncio.sleep(slot - now)
+        await bucket.acquire()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, **send_kwargs)
+            stats["sent"] += 1
+        except RetryAfter as e:
+            # Flood control เป็นของทั้งบอท ➜ หยุดทุก Worker
+            bucket.pause(_seconds(e.retry_after))
+            if floods + 1 < flood_retries:
+                queue.put_nowait((chat_id, text, attempt, floods + 1))
+            else:
+                stats["failed"] += 1
+                logger.error(f"❌ Broadcast to {chat_id} failed: flood control {flood_retries} times")
+        except Forbidden:
+            stats["blocked"].append(chat_id)
+        except ChatMigrated as e:
+            stats["migrated"][chat_id] = e.new_chat_id
+            queue.put_nowait((e.new_chat_id, text, attempt + 1, floods))
+        except (TimedOut, NetworkError) as e:
+            if attempt + 1 < retries:
+                await asyncio.sleep(2 ** attempt)
+                queue.put_nowait((chat_id, text, attempt + 1, floods))
+            else:
+                stats["failed"] += 1
+                logger.error(f"❌ Broadcast to {chat_id} failed: {e}")
+        except Exception as e:
+            stats["failed"] += 1
+            logger.error(f"❌ Broadcast to {chat_id} failed: {e}")
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            try: await send_one(*item)
+            finally: queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(max(1, min(workers, total)))]
+    try:
+        await queue.join()
+    finally:
+        for task in tasks: task.cancel()
+
+    stats["elapsed"] = time.monotonic() - t0
+    stats["rate"] = stats["sent"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+    for result in ("sent", "failed"): BROADCAST_MESSAGES.inc(stats[result], result=result)
+    BROADCAST_MESSAGES.inc(len(stats["blocked"]), result="blocked")
+    BROADCAST_THROUGHPUT.set(stats["rate"])
+    return stats
+
+async def broadcast_text(bot, chat_ids, text, **kwargs):
+    """ส่งข้อความเดียวกันให้ทุกแชท"""
+    return await broadcast(bot, [(chat_id, text) for chat_id in chat_ids], **kwargs)
@@ -0,0 +1,188 @@
+import io
+import os
+import threading
+import matplotlib
+import matplotlib.pyplot as plt
+import matplotlib.lines as mlines
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.ticker import FuncFormatter, MaxNLocator
+import numpy as np
+matplotlib.use('Agg')
+
+# =========================================
+# 🕯️ PLOT CANDLESTICK CHART (PRO CHART + LEGEND)
+# =========================================
+# แยกออกมาจาก strategy.py เพื่อให้รันใน Process แยกได้ (matplotlib ไม่ Thread-safe)
+# (import matplotlib หนัก ➜ bot/strategy import โมดูลนี้ตอนวาดกราฟครั้งแรกเท่านั้น)
+
+# ตั้งค่ารูปที่ส่งเข้า Telegram (ลดขนาดไฟล์ = อัปโหลดเร็วขึ้น)
+# CHART_COMPRESSION: png = compress_level 0-9, jpeg = quality 1-95 (ว่าง = ค่าเดิมของ matplotlib)
+CHART_FORMAT = os.getenv("CHART_FORMAT", "png")
+CHART_DPI = float(os.getenv("CHART_DPI")) if os.getenv("CHART_DPI") else None
+CHART_COMPRESSION = int(os.getenv("CHART_COMPRESSION")) if os.getenv("CHART_COMPRESSION") else None
+
+UP_COLOR, DOWN_COLOR = to_rgba_array(['green', 'red'])
+BODY_WIDTH = 0.35   # ครึ่งความกว้างแท่งเทียน (หน่วย = 1 แท่ง)
+BAR_WIDTH = 0.35    # ครึ่งความกว้างแท่ง Volume / MACD Histogram
+
+def _save_kwargs(fmt, dpi, compression):
+    kwargs = {"format": fmt}
+    if dpi: kwargs["dpi"] = dpi
+    if compression is not None:
+        if fmt in ("jpg", "jpeg"): kwargs["pil_kwargs"] = {"quality": compression, "optimize": True}
+        elif fmt == "png": kwargs["pil_kwargs"] = {"compress_level": compression, "optimize": True}
+    return kwargs
+
+def _bar_verts(x, bottom, top, half_width):
+    """สี่เหลี่ยมแท่ง (N, 4, 2) จากตำแหน่ง x และขอบบน/ล่าง (คำนวณทีเดียวทั้งก้อน)"""
+    left, right = x - half_width, x + half_width
+    return np.stack([
+        np.column_stack([left, bottom]), np.column_stack([left, top]),
+        np.column_stack([right, top]), np.column_stack([right, bottom]),
+    ], axis=1)
+
+def _points(x, y):
+    mask = ~np.isnan(y)
+    return np.column_stack([x[mask], y[mask]]) if mask.any() else np.empty((0, 2))
+
+def _limits(*arrays, pad=0.05, floor=None):
+    values = np.concatenate([np.asarray(a, dtype=float).ravel() for a in arrays])
+    values = values[~np.isnan(values)]
+    if len(values) == 0: return (0, 1)
+    lo, hi = values.min(), values.max()
+    if floor is not None: lo = floor
+    span = (hi - lo) or abs(hi) or 1
+    return (lo if floor is not None else lo - span * pad, hi + span * pad)
+
+class ChartTemplate:
+    """Figure /signal ที่สร้างไว้ครั้งเดียวต่อ Process (สไตล์, 3 Panel, Legend)
+    แต่ละ Request แค่เปลี่ยนข้อมูลของแท่งเทียน/เส้น/จุดสัญญาณ แล้วเซฟรูป"""
+
+    def __init__(self):
+        with plt.rc_context({'font.size': 12, 'axes.titlesize': 14, 'axes.labelsize': 10}):
+            fig = plt.figure(figsize=(14, 10), facecolor='white')
+            gs = fig.add_gridspec(10, 1, hspace=0, left=0.06, right=0.93, top=0.95, bottom=0.1)
+            ax_price = fig.add_subplot(gs[:6])
+            ax_macd = fig.add_subplot(gs[6:8], sharex=ax_price)
+            ax_vol = fig.add_subplot(gs[8:], sharex=ax_price)
+
+            for ax in (ax_price, ax_macd, ax_vol):
+                ax.set_facecolor('white')
+                ax.yaxis.tick_right()
+                ax.yaxis.set_label_position('right')
+                ax.grid(linestyle=':')
+                ax.set_axisbelow(True)
+            ax_price.tick_params(labelbottom=False)
+            ax_macd.tick_params(labelbottom=False)
+            ax_macd.set_ylabel('MACD')
+            ax_vol.set_ylabel('Volume')
+
+            # 1. Candles (ไส้เทียน + ตัวเทียน)
+            self.wicks = LineCollection([], linewidths=1, zorder=2)
+            self.bodies = PolyCollection([], linewidths=0.5, zorder=3)
+            ax_price.add_collection(self.wicks)
+            ax_price.add_collection(self.bodies)
+
+            # 2. EMA + Buy/Sell Signals
+            self.ema200, = ax_price.plot([], [], color='purple', linewidth=1.5, zorder=4)
+            self.ema50, = ax_price.plot([], [], color='cyan', linewidth=1, zorder=4)
+            self.buys = ax_price.scatter([], [], s=120, marker='^', color='lime', zorder=5)
+            self.sells = ax_price.scatter([], [], s=120, marker='v', color='red', zorder=5)
+            self.title = ax_price.set_title("")
+
+            # 3. MACD Histogram + Lines
+            self.hist = PolyCollection([], alpha=0.6, linewidths=0, zorder=2)
+            ax_macd.add_collection(self.hist)
+            self.macd, = ax_macd.plot([], [], color='blue', linewidth=1, zorder=3)
+            self.signal_line, = ax_macd.plot([], [], color='orange', linewidth=1, zorder=3)
+
+            # 4. Volume
+            self.volume = PolyCollection([], linewidths=0, zorder=2)
+            ax_vol.add_collection(self.volume)
+
+            # 5. Legends (สร้างครั้งเดียว)
+            ema200_line = mlines.Line2D([], [], color='purple', linewidth=1.5, label='EMA 200 (Major Trend)')
+            ema50_line = mlines.Line2D([], [], color='cyan', linewidth=1, label='EMA 50 (Mid Trend)')
+            buy_marker = mlines.Line2D([], [], color='none', marker='^', markerfacecolor='lime', markeredgecolor='lime', markersize=10, label='BUY Signal')
+            sell_marker = mlines.Line2D([], [], color='none', marker='v', markerfacecolor='red', markeredgecolor='red', markersize=10, label='SELL Signal')
+            ax_price.legend(handles=[ema200_line, ema50_line, buy_marker, sell_marker], loc='upper left', fontsize=10, framealpha=0.9)
+
+            macd_line = mlines.Line2D([], [], color='blue', linewidth=1, label='MACD Line')
+            sig_line = mlines.Line2D([], [], color='orange', linewidth=1, label='Signal Line')
+            ax_macd.legend(handles=[macd_line, sig_line], loc='upper left', fontsize=10, framealpha=0.9)
+
+            # 6. แกนเวลา: x = ลำดับแท่ง (ไม่มีช่องว่างช่วงตลาดปิด) แสดงผลเป็นวันที่
+            self._labels = []
+            ax_vol.xaxis.set_major_locator(MaxNLocator(nbins=8, integer=True))
+            ax_vol.xaxis.set_major_formatter(FuncFormatter(self._format_x))
+            ax_vol.tick_params(axis='x', labelrotation=45)
+
+        self.fig, self.ax_price, self.ax_macd, self.ax_vol = fig, ax_price, ax_macd, ax_vol
+
+    def _format_x(self, x, pos=None):
+        i = int(round(x))
+        return self._labels[i] if 0 <= i < len(self._labels) else ""
+
+    def update(self, df_plot, SYMBOL, winrate):
+        o, h, l, c, v = (df_plot[k].to_numpy(dtype=float) for k in ("open", "high", "low", "close", "volume"))
+        n = len(df_plot); x = np.arange(n, dtype=float)
+        up = c >= o
+        colors = np.where(up[:, None], UP_COLOR, DOWN_COLOR)
+
+        self.wicks.set_segments(np.stack([np.column_stack([x, l]), np.column_stack([x, h])], axis=1))
+        self.wicks.set_colors(colors)
+        self.bodies.set_verts(_bar_verts(x, np.minimum(o, c), np.maximum(o, c), BODY_WIDTH))
+        self.bodies.set_facecolors(colors); self.bodies.set_edgecolors(colors)
+
+        ema_200 = df_plot['ema_200'].to_numpy(dtype=float); ema_50 = df_plot['ema_50'].to_numpy(dtype=float)
+        self.ema200.set_data(x, ema_200); self.ema50.set_data(x, ema_50)
+        signal = df_plot['signal'].to_numpy(); signal_price = df_plot['signal_price'].to_numpy(dtype=float)
+        self.buys.set_offsets(_points(x, np.where(signal == 1, signal_price, np.nan)))
+        self.sells.set_offsets(_points(x, np.where(signal == -1, signal_price, np.nan)))
+        self.title.set_text(f"{SYMBOL} PRO Analysis (WinRate: {winrate:.1f}%)")
+
+        hist = np.nan_to_num(df_plot['hist'].to_numpy(dtype=float))
+        macd = df_plot['macd'].to_numpy(dtype=float); signal_line = df_plot['signal_line'].to_numpy(dtype=float)
+        self.hist.set_verts(_bar_verts(x, np.zeros(n), hist, BAR_WIDTH))
+        self.hist.set_facecolors(np.where((hist >= 0)[:, None], UP_COLOR, DOWN_COLOR))
+        self.macd.set_data(x, macd); self.signal_line.set_data(x, signal_line)
+
+        self.volume.set_verts(_bar_verts(x, np.zeros(n), np.nan_to_num(v), BAR_WIDTH))
+        self.volume.set_facecolors(colors)
+
+        self._labels = [t.strftime('%b %d, %H:%M') for t in df_plot.index]
+        self.ax_price.set_xlim(-1, n)
+        self.ax_price.set_ylim(*_limits(l, h, ema_200, ema_50, signal_price))
+        self.ax_macd.set_ylim(*_limits(hist, macd, signal_line))
+        self.ax_vol.set_ylim(*_limits(v, floor=0))
+        return self.fig
+
+_template = None
+_template_lock = threading.Lock()
+
+def get_chart_template():
+    global _template
+    if _template is None: _template = ChartTemplate()
+    return _template
+
+def init_render_worker():
+    """รันครั้งแรกใน Process วาดกราฟแต่ละตัว: สร้าง Figure ต้นแบบรอไว้เลย"""
+    matplotlib.use('Agg')
+    get_chart_template()
+
+def render_signal_chart(df_plot, SYMBOL, winrate, chart_path=None, fmt=CHART_FORMAT, dpi=CHART_DPI, compression=CHART_COMPRESSION):
+    """วาดกราฟ /signal (200 แท่งล่าสุด)
+    chart_path=None: คืนค่าเป็น bytes ของรูป (ไม่แตะดิสก์), ถ้าระบุ path จะเซฟลงไฟล์แล้วคืนค่า path"""
+    save_kwargs = _save_kwargs(fmt, dpi, compression)
+    # Figure ต้นแบบมีอันเดียวต่อ Process ถ้าเรียกจากหลาย Thread ต้องต่อคิวกัน
+    with _template_lock:
+        fig = get_chart_template().update(df_plot, SYMBOL, winrate)
+        if chart_path is None:
+            buf = io.BytesIO()
+            fig.savefig(buf, **save_kwargs)
+            return buf.getvalue()
+
+        os.makedirs(os.path.dirname(chart_path), exist_ok=True)
+        fig.savefig(chart_path, **save_kwargs)
+    return chart_path
@@ -13,6 +13,13 @@ _รองรับ: Crypto, หุ้นไทย, จีน, ฮ่องก
 `/signal PTT SET` (หุ้นไทย)
 `/signal AAPL NASDAQ` (หุ้นเมกา)
 `/signal 9988 HKEX` (หุ้นฮ่องกง)
+`/signal BTCUSDT BINANCE 4H` (เลือก Timeframe: 1H / 4H / 1D)
+
+🧪 หาค่า EMA/MACD/RSI ที่ดีที่สุดของตัวนั้น (Backtest หลายพันชุด)
+👉 พิมพ์: `/optimize [ชื่อ] [ตลาด]`
+
+💼 Backtest ทั้งตลาดแบบพอร์ต (กลยุทธ์นี้ทำกำไรจริงไหม)
+👉 พิมพ์: `/portfolio [CRYPTO/TH/US/CN/HK] [จำนวนตัว]`
 
 ━━━━━━━━━━━━━━━━━━
 🚀 *2. สแกนหาตัว "น่าซื้อ" (ขาขึ้น)*
@@ -0,0 +1,238 @@
+import functools
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# =====================
+# ⚡ VECTORIZED INDICATORS (NUMPY)
+# =====================
+# ทุกฟังก์ชันรับ Array 2 มิติ: แกน 0 = หุ้นแต่ละตัว, แกน 1 = แท่งเทียน (เก่า ➜ ใหม่)
+# สูตรตรงกับ calculate_indicators() ใน strategy.py (pandas ewm adjust=False / rolling)
+
+def ema(x, span):
+    """EMA แบบ adjust=False (เหมือน pandas ewm) คำนวณทุกหุ้นพร้อมกันทีละแท่ง
+    span เป็น Array ได้ (1 ค่าต่อแถว) ➜ คำนวณหลายความยาว EMA ในรอบเดียว"""
+    alpha = 2.0 / (np.asarray(span, dtype=float) + 1.0)
+    old_wt = 1.0 - alpha
+    out = np.empty_like(x)
+    out[:, 0] = x[:, 0]
+    for t in range(1, x.shape[1]):
+        out[:, t] = (old_wt * out[:, t - 1] + alpha * x[:, t]) / (old_wt + alpha)
+    return out
+
+def rolling_mean(x, window):
+    """ค่าเฉลี่ยเคลื่อนที่ (ช่วงที่ข้อมูลไม่ครบ window = NaN)
+    หน้าต่างที่มี NaN ได้ NaN เฉพาะหน้าต่างนั้นเหมือน pandas (ไม่ลามไปทุกแท่งหลังจากนั้นแบบ cumsum ตรง ๆ)"""
+    out = np.full(x.shape, np.nan)
+    missing = np.isnan(x)
+    cs = np.cumsum(np.where(missing, 0.0, x), axis=1)
+    cn = np.cumsum(missing, axis=1)
+    out[:, window - 1] = cs[:, window - 1]
+    out[:, window:] = cs[:, window:] - cs[:, :-window]
+    out[:, window - 1:] /= window
+    gaps = cn[:, window - 1:].copy()
+    gaps[:, 1:] -= cn[:, :-window]
+    out[:, window - 1:][gaps > 0] = np.nan
+    return out
+
+def rolling_std(x, window):
+    """ส่วนเบี่ยงเบนมาตรฐานเคลื่อนที่ (ddof=1 เหมือน pandas)"""
+    # เลื่อนข้อมูลให้อยู่ใกล้ 0 ก่อน กันตัวเลขเพี้ยนตอนราคาสูงๆ (ค่า std ไม่เปลี่ยน)
+    xc = x - x[:, -1:]
+    mean = rolling_mean(xc, window)
+    mean_sq = rolling_mean(xc * xc, window)
+    var = (mean_sq - mean * mean) * (window / (window - 1.0))
+    return np.sqrt(np.maximum(var, 0.0))
+
+def stack_ohlcv(dfs):
+    """รวม DataFrame หลายตัว (ความยาวเท่ากัน) เป็น Array 2 มิติ"""
+    block = {col: np.vstack([df[col].to_numpy(dtype=float) for df in dfs]) for col in ("open", "high", "low", "close")}
+    block["volume"] = np.vstack([
+        df["volume"].to_numpy(dtype=float) if "volume" in df.columns else np.zeros(len(df))
+        for df in dfs
+    ])
+    return block
+
+def calculate_indicators_batch(block):
+    """คำนวณอินดิเคเตอร์ชุดเดียวกับ calculate_indicators() ให้ทั้งก้อน (หุ้น x แท่ง)"""
+    close, high, low = block["close"], block["high"], block["low"]
+    out = dict(block)
+
+    # 1. Trend Indicators
+    out["ema_fast"] = ema(close, 9)
+    out["ema_slow"] = ema(close, 21)
+    out["ema_50"] = ema(close, 50)
+    out["ema_200"] = ema(close, 200)
+
+    # 2. Momentum Indicators
+    delta = np.zeros_like(close)
+    delta[:, 1:] = np.diff(close, axis=1)
+    gain = rolling_mean(np.where(delta > 0, delta, 0.0), 14)
+    loss = rolling_mean(np.where(delta < 0, -delta, 0.0), 14)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["rsi"] = 100 - (100 / (1 + gain / loss))
+
+    out["macd"] = ema(close, 12) - ema(close, 26)
+    out["signal_line"] = ema(out["macd"], 9)
+    out["hist"] = out["macd"] - out["signal_line"]
+
+    # 3. Volatility & Support/Resistance
+    out["bb_mid"] = rolling_mean(close, 20)
+    out["bb_std"] = rolling_std(close, 20)
+    out["bb_upper"] = out["bb_mid"] + (2 * out["bb_std"])
+    out["bb_lower"] = out["bb_mid"] - (2 * out["bb_std"])
+
+    ranges = high - low
+    ranges[:, 1:] = np.maximum(ranges[:, 1:], np.abs(high[:, 1:] - close[:, :-1]))
+    ranges[:, 1:] = np.maximum(ranges[:, 1:], np.abs(low[:, 1:] - close[:, :-1]))
+    out["atr"] = rolling_mean(ranges, 14)
+
+    # 4. Volume Analysis
+    out["vol_sma"] = rolling_mean(block["volume"], 20)
+    return out
+
+def frame_times(df):
+    """เวลาของแต่ละแท่ง (index ของ TvDatafeed) เป็นวินาที"""
+    return df.index.values.astype("datetime64[s]").astype(np.int64)
+
+def bar_at(block, row, pos):
+    """ดึงค่าทุกอินดิเคเตอร์ของหุ้นแถว row ที่แท่ง pos ออกมาเป็น dict (ใช้กับกฎให้คะแนนได้เหมือนแถวของ DataFrame)"""
+    return {k: v[row, pos] for k, v in block.items()}
+
+# =====================
+# 🏎️ LAST-BAR FAST PATH (คำนวณเฉพาะ 2 แท่งสุดท้าย)
+# =====================
+# การให้คะแนนใช้แค่แท่งล่าสุดกับแท่งก่อนหน้า ไม่ต้องคำนวณทั้งคอลัมน์
+# EMA/MACD เป็นสมการเชิงเส้นของราคาปิด ➜ ค่าที่ 2 แท่งสุดท้าย = ราคาปิด x น้ำหนักที่คำนวณไว้ล่วงหน้า
+EMA_KEYS = ("ema_fast", "ema_slow", "ema_50", "ema_200", "macd", "signal_line")
+
+@functools.lru_cache(maxsize=8)
+def _last_bar_weights(n_bars):
+    """เมทริกซ์น้ำหนัก (n_bars, 12): ผลตอบสนองของแต่ละ EMA ต่อราคาแต่ละแท่ง (ป้อน Identity เข้า ema())
+    คอลัมน์เรียงตาม EMA_KEYS ทีละคู่ [แท่งก่อนหน้า, แท่งล่าสุด]"""
+    eye = np.eye(n_bars)
+    macd = ema(eye, 12) - ema(eye, 26)
+    cols = (ema(eye, 9), ema(eye, 21), ema(eye, 50), ema(eye, 200), macd, ema(macd, 9))
+    return np.hstack([c[:, -2:] for c in cols])
+
+def _tail_windows(x, window):
+    """หน้าต่าง rolling 2 อันสุดท้าย ➜ shape (หุ้น, 2, window)"""
+    return sliding_window_view(x[:, -(window + 1):], window, axis=1)
+
+def calculate_last_bars(block):
+    """คำนวณอินดิเคเตอร์ชุดเดียวกับ calculate_indicators_batch แต่เฉพาะ 2 แท่งสุดท้าย
+    คืนค่า dict ของ Array shape (หุ้น, 2) ใช้กับ bar_at(out, row, -1 / -2) ได้เหมือนเดิม"""
+    close, high, low = block["close"], block["high"], block["low"]
+    out = {k: v[:, -2:] for k, v in block.items()}
+
+    # 1. Trend + MACD: คูณเมทริกซ์ครั้งเดียวได้ครบทุกเส้น
+    ema_vals = close @ _last_bar_weights(close.shape[1])
+    for i, key in enumerate(EMA_KEYS):
+        out[key] = ema_vals[:, 2 * i:2 * i + 2]
+    out["hist"] = out["macd"] - out["signal_line"]
+
+    # 2. RSI (ใช้ 15 ส่วนต่างราคาสุดท้าย)
+    delta = np.diff(close[:, -16:], axis=1)
+    gain = _tail_windows(np.where(delta > 0, delta, 0.0), 14).mean(axis=-1)
+    loss = _tail_windows(np.where(delta < 0, -delta, 0.0), 14).mean(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["rsi"] = 100 - (100 / (1 + gain / loss))
+
+    # 3. Bollinger
+    bb = _tail_windows(close, 20)
+    out["bb_mid"] = bb.mean(axis=-1)
+    out["bb_std"] = bb.std(axis=-1, ddof=1)
+    out["bb_upper"] = out["bb_mid"] + (2 * out["bb_std"])
+    out["bb_lower"] = out["bb_mid"] - (2 * out["bb_std"])
+
+    # ATR (True Range 15 แท่งสุดท้าย)
+    prev_close = close[:, -16:-1]
+    h, l = high[:, -15:], low[:, -15:]
+    ranges = np.maximum(h - l, np.maximum(np.abs(h - prev_close), np.abs(l - prev_close)))
+    out["atr"] = _tail_windows(ranges, 14).mean(axis=-1)
+
+    # 4. Volume
+    out["vol_sma"] = _tail_windows(block["volume"], 20).mean(axis=-1)
+    return out
+
+# =====================
+# 🔁 STREAMING STATE (เก็บหน้าต่างแท่งล่าสุด เพิ่มทีละแท่ง ไม่ต้องดึง/คำนวณใหม่ทั้งก้อน)
+# =====================
+OHLCV = ("open", "high", "low", "close", "volume")
+
+class IndicatorState:
+    """สถานะอินดิเคเตอร์ของหุ้น 1 ตัว: OHLCV ล่าสุด window แท่ง (เท่ากับจำนวนแท่งที่สแกนใช้) + เวลาแท่งล่าสุด
+    เพิ่มแท่งใหม่ = ต่อท้าย/ตัดหัวหน้าต่าง ค่าแท่งล่าสุด/ก่อนหน้าคำนวณด้วย calculate_last_bars ตอนถูกอ่าน
+    EMA จึงเริ่มนับใหม่ที่แท่งแรกของหน้าต่างเหมือน analyze_chart ➜ คะแนนตอน recheck ตรงกับการสแกนใหม่ทุกแท่ง
+    แปลงเป็น dict เก็บลง Cache/Database ได้ (ไม่มีค่าที่คำนวณแล้วปนไปด้วย)"""
+
+    def __init__(self, data=None, window=250):
+        self.data = data or {"window": window, "time": None, **{c: [] for c in OHLCV}}
+        self._last = None # (curr, prev) ที่คำนวณไว้ ล้างทุกครั้งที่มีแท่งใหม่
+
+    # ---------- สร้าง / แปลงข้อมูล ----------
+    @classmethod
+    def from_dict(cls, data):
+        # copy หน้าต่าง: เดินหน้าแล้วไม่แก้ dict ที่อยู่ใน Cache เดิม
+        return cls({**data, **{c: list(data[c]) for c in OHLCV if c in data}})
+
+    def to_dict(self):
+        return self.data
+
+    @classmethod
+    def from_frame(cls, df, window=250):
+        """สร้าง State จาก window แท่งสุดท้ายของ DataFrame ของ TvDatafeed"""
+        state = cls(window=window)
+        state.advance_frame(df.iloc[-window:])
+        return state
+
+    @property
+    def time(self):
+        return self.data["time"]
+
+    @property
+    def n(self):
+        return len(self.data.get("close", ()))
+
+    @property
+    def ready(self):
+        """ข้อมูลพอให้คะแนนเหมือน analyze_chart (อย่างน้อย 200 แท่ง)"""
+        return self.n >= 200
+
+    @property
+    def curr(self):
+        return self._last_bars()[0]
+
+    @property
+    def prev(self):
+        return self._last_bars()[1]
+
+    def _last_bars(self):
+        if self._last is None:
+            out = calculate_last_bars({c: np.asarray(self.data[c], dtype=float)[None, :] for c in OHLCV})
+            self._last = (bar_at(out, 0, -1), bar_at(out, 0, -2))
+        return self._last
+
+    # ---------- เดินหน้า ----------
+    def advance_frame(self, df):
+        """ป้อนแท่งจาก DataFrame เฉพาะแท่งที่ไม่เก่ากว่าแท่งล่าสุดใน State"""
+        times = frame_times(df)
+        cols = [df[c].to_numpy(dtype=float) for c in ("open", "high", "low", "close")]
+        volume = df["volume"].to_numpy(dtype=float) if "volume" in df.columns else np.zeros(len(df))
+        for i in range(len(df)):
+            self.update(float(times[i]), cols[0][i], cols[1][i], cols[2][i], cols[3][i], volume[i])
+        return self
+
+    def update(self, time, open_, high, low, close, volume=0.0):
+        """เพิ่ม 1 แท่ง ถ้าเวลาเท่ากับแท่งล่าสุด = แท่งเดิมที่ยังไม่ปิด (เขียนทับแท่งสุดท้าย)"""
+        d = self.data
+        if d["time"] is not None and time < d["time"]: return
+        bar = (float(open_), float(high), float(low), float(close), float(volume))
+        replace = d["time"] is not None and time == d["time"]
+        for col, value in zip(OHLCV, bar):
+            values = d[col]
+            if replace: values[-1] = value
+            else:
+                values.append(value)
+                if len(values) > d["window"]: del values[0]
+        d["time"] = time
+        self._last = None
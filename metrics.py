@@ -0,0 +1,144 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+# =====================
+# 📈 METRICS (Prometheus text format ที่ /metrics)
+# =====================
+# Counter / Gauge / Histogram แบบเล็ก ๆ ไม่ต้องลง prometheus_client เพิ่ม ใช้ข้าม Thread ได้
+# ทุกตัวที่สร้างจะลงทะเบียนใน REGISTRY แล้ว render() รวมเป็นข้อความให้ Prometheus มาดึง
+PREFIX = "tradingbot_"
+REGISTRY = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs: return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _number(value):
+    if value == math.inf: return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name = PREFIX + name
+        self.doc = doc
+        self.labelnames = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, key), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {_number(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """ค่าสะสมที่เพิ่มอย่างเดียว (จำนวนครั้ง/จำนวนข้อความ/จำนวน Error)"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock: self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """ค่าปัจจุบัน ตั้งเองด้วย set() หรือผูกฟังก์ชันที่อ่านค่าตอนถูกดึงด้วย set_function()"""
+    kind = "gauge"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock: self._values[key] = value
+
+    def set_function(self, fn, **labels):
+        key = self._key(labels)
+        with self._lock: self._functions[key] = fn
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, fn in functions.items():
+            try: values[key] = fn()
+            except Exception: values.pop(key, None)
+        return [(self.name, _labels(self.labelnames, key), value) for key, value in sorted(values.items())]
+
+class Histogram(_Metric):
+    """การกระจายของเวลา (แบ่งถังตาม buckets) + ผลรวม + จำนวนครั้ง"""
+    kind = "histogram"
+
+    def __init__(self, name, doc, buckets, labels=()):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try: yield
+        finally: self.observe(time.perf_counter() - t0, **labels)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    out.append((f"{self.name}_bucket", _labels(self.labelnames, key, [("le", _number(bound))]), count))
+                out.append((f"{self.name}_sum", _labels(self.labelnames, key), total))
+                out.append((f"{self.name}_count", _labels(self.labelnames, key), counts[-1]))
+        return out
+
+def render():
+    """ข้อความทั้งหมดสำหรับ GET /metrics"""
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+def queue_depth(pool):
+    """จำนวนงานที่รอคิวใน Executor (Thread Pool: งานยังไม่เริ่ม, Process Pool: งานที่ยังไม่เสร็จ)"""
+    if pool is None: return 0
+    work_queue = getattr(pool, "_work_queue", None)
+    if work_queue is not None: return work_queue.qsize()
+    return len(getattr(pool, "_pending_work_items", ()))
+
+# ----- Metrics ของบอท (รวมไว้ที่เดียว ดูได้ว่ามีอะไรบ้าง) -----
+SCAN_SECONDS = Histogram("scan_duration_seconds", "Duration of a market scan", (10, 30, 60, 120, 300, 600, 1200, 1800, 2400, 3600, 7200), labels=("market", "mode"))
+SCAN_SYMBOLS = Counter("scan_symbols_total", "Symbols fetched and scored by market scans", labels=("market",))
+SCAN_RATE = Gauge("scan_symbols_per_second", "Symbols per second of the last scan", labels=("market",))
+SCAN_STAGE_SECONDS = Histogram("scan_stage_seconds", "Duration of each scan stage (per batch or per symbol)", (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300), labels=("market", "stage"))
+SCAN_ERRORS = Counter("scan_errors_total", "Symbols skipped because fetching bars failed", labels=("market",))
+
+GET_HIST_SECONDS = Histogram("get_hist_seconds", "Latency of TradingView get_hist calls", (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+GET_HIST_ERRORS = Counter("get_hist_errors_total", "Failed TradingView get_hist calls", labels=("reason",))
+
+EXECUTOR_QUEUE = Gauge("executor_queue_depth", "Tasks waiting in each executor", labels=("pool",))
+
+ALERT_CYCLE_SECONDS = Histogram("alert_cycle_seconds", "Duration of one polling alert check cycle", (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120))
+ALERTS_FIRED = Counter("alerts_fired_total", "Price alerts sent", labels=("source",))
+
+BROADCAST_MESSAGES = Counter("broadcast_messages_total", "Broadcast messages by outcome", labels=("result",))
+BROADCAST_THROUGHPUT = Gauge("broadcast_messages_per_second", "Throughput of the last broadcast")
+
+SIGNAL_CACHE_BYTES = Gauge("signal_cache_bytes", "Bytes held by the /signal result cache")
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by cache and outcome", labels=("cache", "result"))
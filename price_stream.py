@@ -0,0 +1,197 @@
+import os
+import abc
+import json
+import asyncio
+import logging
+from collections import namedtuple
+from alert_engine import AlertIndex
+
+logger = logging.getLogger(__name__)
+
+try:
+    import websockets
+except ImportError: # ไม่มี websockets ➜ ไม่มี Stream จริง ใช้การเช็คทุก 2 นาทีแบบเดิม
+    websockets = None
+
+# =====================
+# ⚡ PRICE STREAM (แจ้งเตือนราคาแบบ Push)
+# =====================
+# Feed ส่งราคามาทุก Tick ➜ เช็คกับ AlertIndex ทันที (ไม่ต้องรอรอบ 120 วินาที)
+# Exchange ที่ Feed ไม่รองรับ (หรือตอนหลุดการเชื่อมต่อ) ยังใช้ job_check_alerts แบบเดิม
+ALERT_STREAM = os.getenv("ALERT_STREAM", "1") != "0"
+BINANCE_WS_URL = os.getenv("BINANCE_WS_URL", "wss://stream.binance.com:9443/stream")
+RECONNECT_DELAY = (1, 60) # วินาที (เริ่ม, สูงสุด) ต่อใหม่แบบทวีคูณ
+
+Tick = namedtuple("Tick", "symbol exchange price")
+
+class PriceFeed(abc.ABC):
+    """อินเทอร์เฟซแหล่งราคาแบบ Push
+    - exchanges: Exchange ที่ Feed นี้ส่งราคาให้ได้
+    - connected: ตอนนี้ส่งราคาได้จริงไหม (False = ให้ระบบ Polling เช็คแทน)
+    - subscribe(instruments): ตั้งรายการ (symbol, exchange) ที่ต้องการ (แทนที่ของเดิม)
+    - ticks(): async iterator ของ Tick"""
+    exchanges = ()
+    connected = False
+
+    @abc.abstractmethod
+    async def subscribe(self, instruments): ...
+
+    @abc.abstractmethod
+    def ticks(self): ...
+
+    async def close(self):
+        pass
+
+class FakeFeed(PriceFeed):
+    """Feed ปลอมสำหรับทดสอบ: ยิงราคาเองด้วย push()"""
+
+    def __init__(self, exchanges=("BINANCE",)):
+        self.exchanges = tuple(exchanges)
+        self.connected = True
+        self.instruments = set()
+        self._queue = asyncio.Queue()
+
+    async def subscribe(self, instruments):
+        self.instruments = set(instruments)
+
+    def push(self, symbol, exchange, price):
+        self._queue.put_nowait(Tick(symbol, exchange, price))
+
+    async def ticks(self):
+        while True:
+            tick = await self._queue.get()
+            if tick is None: return
+            yield tick
+
+    async def close(self):
+        self._queue.put_nowait(None)
+
+class BinanceFeed(PriceFeed):
+    """ราคาซื้อขายจริงจาก Binance (aggTrade ผ่าน WebSocket) ต่อใหม่อัตโนมัติเมื่อหลุด"""
+    exchanges = ("BINANCE",)
+
+    def __init__(self, url=BINANCE_WS_URL):
+        self.url = url
+        self.instruments = set()
+        self._ws = None
+        self._msg_id = 0
+        self._closed = False
+
+    @property
+    def connected(self):
+        return self._ws is not None
+
+    @staticmethod
+    def _stream(symbol):
+        return f"{symbol.lower()}@aggTrade"
+
+    async def _send(self, method, symbols):
+        if self._ws is None or not symbols: return
+        self._msg_id += 1
+        await self._ws.send(json.dumps({"method": method, "params": [self._stream(s) for s in symbols], "id": self._msg_id}))
+
+    async def subscribe(self, instruments):
+        wanted = {s for s, ex in instruments if ex in self.exchanges}
+        current = {s for s, _ in self.instruments}
+        self.instruments = {(s, "BINANCE") for s in wanted}
+        try:
+            await self._send("UNSUBSCRIBE", sorted(current - wanted))
+            await self._send("SUBSCRIBE", sorted(wanted - current))
+        except Exception as e:
+            logger.warning(f"Binance stream subscribe failed: {e}")
+
+    async def ticks(self):
+        delay = RECONNECT_DELAY[0]
+        last = {}
+        while not self._closed:
+            try:
+                async with websockets.connect(self.url, ping_interval=20) as ws:
+                    self._ws = ws; delay = RECONNECT_DELAY[0]
+                    await self._send("SUBSCRIBE", sorted(s for s, _ in self.instruments))
+                    logger.info(f"⚡ Binance stream connected ({len(self.instruments)} symbols)")
+                    async for raw in ws:
+                        data = json.loads(raw).get("data")
+                        if not data or "p" not in data: continue
+                        symbol, price = data["s"], float(data["p"])
+                        # ราคาเดิมซ้ำ ไม่ต้องเช็คใหม่
+                        if last.get(symbol) == price: continue
+                        last[symbol] = price
+                        yield Tick(symbol, "BINANCE", price)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Binance stream disconnected: {e} (retry in {delay}s)")
+            finally:
+                self._ws = None
+            if self._closed: return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_DELAY[1])
+
+    async def close(self):
+        self._closed = True
+        if self._ws is not None: await self._ws.close()
+
+def make_default_feed():
+    """Feed ที่ใช้ในบอท (None = ปิด Stream หรือไม่มี websockets)"""
+    if not ALERT_STREAM or websockets is None: return None
+    return BinanceFeed()
+
+class AlertStream:
+    """เช็คแจ้งเตือนทุก Tick จาก Feed
+    on_trigger(alert, price) เป็น coroutine (ส่งข้อความ/ลบแจ้งเตือน) ถ้าส่งไม่สำเร็จเรียก restore(alert)"""
+
+    def __init__(self, feed, on_trigger):
+        self.feed = feed
+        self.on_trigger = on_trigger
+        self.index = AlertIndex()
+        self._fired = set() # id ที่ยิงไปแล้ว (กันยิงซ้ำตอน sync ก่อนลบออกจากฐานข้อมูลเสร็จ)
+        self._live = set() # (symbol, exchange) ที่ Stream ส่ง Tick มาแล้วจริง
+        self._tasks = set()
+        self.task = None
+
+    def streams(self, alert):
+        return alert.get("exchange") in self.feed.exchanges
+
+    def covers(self, alert):
+        """แจ้งเตือนนี้ Stream ดูแลอยู่ (Polling ข้ามได้)
+        ต้องเคยได้ Tick ของตัวนี้แล้ว: ชื่อที่ไม่มี Stream (Futures, เลิกเทรด, พิมพ์ผิด) จะยังใช้ Polling"""
+        return self.feed.connected and (alert.get("symbol"), alert.get("exchange")) in self._live
+
+    async def sync(self, alerts):
+        """สร้างดัชนีใหม่จากแจ้งเตือนทั้งหมด (เรียกตอนเริ่มและทุกรอบ Polling) แล้วอัปเดตรายการที่ Subscribe"""
+        alerts = list(alerts)
+        # id ที่ยิงแล้วแต่ไม่อยู่ในรายการนี้ = remove_alerts ลบจากฐานข้อมูลสำเร็จแล้ว ไม่ต้องจำต่อ
+        self._fired &= {a.get("id") for a in alerts}
+        self.index = AlertIndex(a for a in alerts if self.streams(a) and a.get("id") not in self._fired)
+        self._live &= set(self.index.instruments())
+        await self.feed.subscribe(self.index.instruments())
+
+    async def add(self, alert):
+        if not self.streams(alert): return
+        before = len(self.index.groups)
+        self.index.add(alert)
+        if len(self.index.groups) != before: await self.feed.subscribe(self.index.instruments())
+
+    def restore(self, alert):
+        """ยิงไม่สำเร็จ ใส่กลับเข้าไปรอ Tick ถัดไป"""
+        self._fired.discard(alert.get("id"))
+        self.index.add(alert)
+
+    def on_tick(self, tick):
+        self._live.add((tick.symbol, tick.exchange))
+        hits = self.index.triggered((tick.symbol, tick.exchange), tick.price)
+        for alert in hits:
+            self.index.remove(alert)
+            self._fired.add(alert.get("id"))
+            task = asyncio.create_task(self.on_trigger(alert, tick.price))
+            self._tasks.add(task); task.add_done_callback(self._tasks.discard)
+        return hits
+
+    async def run(self):
+        async for tick in self.feed.ticks():
+            try: self.on_tick(tick)
+            except Exception as e: logger.error(f"Alert stream tick error: {e}")
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        return self.task
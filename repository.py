@@ -0,0 +1,211 @@
+import os
+import copy
+import json
+import uuid
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# =====================
+# 🗄️ DATABASE (MongoDB ตัวเดียวใช้ร่วมกันทุกโมดูล)
+# =====================
+# เดิมแต่ละไฟล์สร้าง MongoClient ของตัวเองตอน import (4 Connection Pool + ping ตอนเปิดบอท)
+# ตอนนี้มี Client เดียว สร้างตอนใช้งานครั้งแรก ไม่มีการรอเน็ตตอน import
+# ไม่มี MONGO_URI ➜ ใช้ไฟล์ JSON ในเครื่อง (หรือในหน่วยความจำ) ผ่านหน้าตาเดียวกัน
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB = os.getenv("MONGO_DB", "TradingBotDB")
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", 20))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", 5000))
+
+logger.info(f"🔍 เช็คสถานะ MONGO_URI: {'✅ มีข้อมูล' if MONGO_URI else '❌ ว่างเปล่า ➜ ใช้ไฟล์ /tmp (ข้อมูลจะหายเมื่ออัปเดตโค้ด)'}")
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """MongoClient ตัวเดียวของทั้งบอท (สร้างตอนเรียกครั้งแรก)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from pymongo import MongoClient
+                _client = MongoClient(
+                    MONGO_URI,
+                    maxPoolSize=MONGO_POOL_SIZE,
+                    serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+                    connectTimeoutMS=MONGO_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_TIMEOUT_MS * 3,
+                    maxIdleTimeMS=60000,
+                    retryWrites=True,
+                )
+    return _client
+
+class MongoRepository:
+    """เก็บเอกสารใน Collection ของ MongoDB (ต่อฐานข้อมูลตอนใช้งานครั้งแรก)
+    indexes: list ของ field ที่ต้องมี Index, setup(repo): รันครั้งเดียวก่อนใช้งาน (เช่น ย้ายข้อมูลรูปแบบเก่า)"""
+
+    def __init__(self, name, indexes=(), setup=None):
+        self.name = name
+        self.indexes = indexes
+        self.setup = setup
+        self._collection = None
+        self._opening = None # Collection ระหว่างรัน setup (ให้เฉพาะ Thread ที่ถือ _lock ใช้ได้)
+        self._lock = threading.RLock()
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            with self._lock:
+                # setup เรียก get/set ของ repo นี้เอง (Thread เดียวกัน เข้า RLock ซ้ำได้) ➜ ใช้ Collection ที่กำลังเปิด
+                if self._opening is not None: return self._opening
+                if self._collection is None:
+                    from pymongo import ASCENDING
+                    collection = get_client()[MONGO_DB][self.name]
+                    for fields in self.indexes:
+                        collection.create_index([(f, ASCENDING) for f in fields])
+                    # รัน setup ให้เสร็จก่อนค่อยเปิดให้ Thread อื่นใช้ (ระหว่างนั้น Thread อื่นรอที่ _lock)
+                    self._opening = collection
+                    try:
+                        if self.setup is not None: self.setup(self)
+                    except Exception as e:
+                        logger.error(f"⚠️ Setup {self.name} error: {e}")
+                    finally:
+                        self._opening = None
+                    self._collection = collection
+        return self._collection
+
+    @staticmethod
+    def _doc(doc):
+        if doc is not None and "_id" in doc: doc["_id"] = str(doc["_id"])
+        return doc
+
+    @staticmethod
+    def _key(doc_id):
+        from bson import ObjectId
+        return ObjectId(doc_id) if ObjectId.is_valid(doc_id) else doc_id
+
+    def get(self, doc_id):
+        return self._doc(self.collection.find_one({"_id": doc_id}))
+
+    def get_many(self, doc_ids):
+        """หลายเอกสารในการค้นครั้งเดียว คืนค่า {id: doc}"""
+        return {d["_id"]: d for d in map(self._doc, self.collection.find({"_id": {"$in": list(doc_ids)}}))}
+
+    def find(self, query=None, fields=None):
+        projection = {f: 1 for f in fields} if fields else None
+        return [self._doc(d) for d in self.collection.find(query or {}, projection)]
+
+    def set(self, doc_id, values):
+        self.collection.update_one({"_id": doc_id}, {"$set": values}, upsert=True)
+
+    def add_to_set(self, doc_id, field, items):
+        self.collection.update_one({"_id": doc_id}, {"$addToSet": {field: {"$each": list(items)}}}, upsert=True)
+
+    def insert(self, doc):
+        return str(self.collection.insert_one(dict(doc)).inserted_id)
+
+    def insert_many(self, docs):
+        return [str(i) for i in self.collection.insert_many([dict(d) for d in docs]).inserted_ids]
+
+    def delete(self, doc_ids):
+        ids = [self._key(i) for i in doc_ids]
+        if not ids: return 0
+        return self.collection.delete_many({"_id": {"$in": ids}}).deleted_count
+
+class FileRepository:
+    """หน้าตาเดียวกับ MongoRepository แต่เก็บเป็นไฟล์ JSON ({id: doc}) หรือในหน่วยความจำ (path=None)
+    legacy(data): แปลงไฟล์รูปแบบเก่า (ที่ไม่ใช่ dict) ให้เป็น {id: doc}"""
+
+    def __init__(self, name, path=None, legacy=None, setup=None):
+        self.name = name
+        self.path = path
+        self.legacy = legacy
+        self.setup = setup
+        self._docs = None
+        self._lock = threading.RLock()
+
+    def _load(self):
+        if self._docs is not None: return self._docs
+        docs = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f: data = json.load(f)
+                docs = data if isinstance(data, dict) else (self.legacy(data) if self.legacy else {})
+            except Exception as e:
+                logger.error(f"❌ Load {self.path} error: {e}")
+        self._docs = docs
+        if self.setup is not None: self.setup(self)
+        return docs
+
+    def _save(self):
+        if not self.path: return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f: json.dump(self._docs, f, default=str)
+        os.replace(tmp, self.path) # เขียนเสร็จค่อยสลับไฟล์ (ไม่เหลือไฟล์ครึ่งๆ กลางๆ)
+
+    def get(self, doc_id):
+        with self._lock:
+            doc = self._load().get(doc_id)
+            return None if doc is None else {**copy.deepcopy(doc), "_id": doc_id}
+
+    def get_many(self, doc_ids):
+        with self._lock:
+            docs = {i: self.get(i) for i in doc_ids}
+            return {i: d for i, d in docs.items() if d is not None}
+
+    def find(self, query=None, fields=None):
+        with self._lock:
+            out = []
+            for doc_id, doc in self._load().items():
+                if query and any(doc.get(k) != v for k, v in query.items()): continue
+                doc = {k: doc[k] for k in fields if k in doc} if fields else doc
+                out.append({**copy.deepcopy(doc), "_id": doc_id})
+            return out
+
+    def set(self, doc_id, values):
+        with self._lock:
+            self._load().setdefault(doc_id, {}).update(copy.deepcopy(values))
+            self._save()
+
+    def add_to_set(self, doc_id, field, items):
+        with self._lock:
+            current = self._load().setdefault(doc_id, {}).setdefault(field, [])
+            seen = set(current)
+            current.extend(x for x in items if x not in seen and not seen.add(x))
+            self._save()
+
+    def insert(self, doc):
+        return self.insert_many([doc])[0]
+
+    def insert_many(self, docs):
+        with self._lock:
+            store = self._load()
+            ids = []
+            for doc in docs:
+                doc = copy.deepcopy(dict(doc))
+                doc_id = str(doc.pop("_id", None) or uuid.uuid4().hex)
+                store[doc_id] = doc; ids.append(doc_id)
+            self._save()
+            return ids
+
+    def delete(self, doc_ids):
+        with self._lock:
+            store = self._load()
+            removed = sum(store.pop(i, None) is not None for i in set(doc_ids))
+            if removed: self._save()
+            return removed
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+def get_repository(name, file=None, legacy=None, indexes=(), setup=None):
+    """Repository ของ Collection ชื่อ name: MongoDB ถ้ามี MONGO_URI ไม่งั้นใช้ไฟล์ file (None = ในหน่วยความจำ)"""
+    with _repositories_lock:
+        repo = _repositories.get(name)
+        if repo is None:
+            if MONGO_URI: repo = MongoRepository(name, indexes=indexes, setup=setup)
+            else: repo = FileRepository(name, file, legacy=legacy, setup=setup)
+            _repositories[name] = repo
+        return repo
@@ -0,0 +1,164 @@
+import os
+import io
+import json
+import time
+import heapq
+import random
+import logging
+import cProfile
+import pstats
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from metrics import SCAN_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# =====================
+# 🔬 SCAN TRACE (จับเวลาแต่ละขั้นของการสแกน)
+# =====================
+# ทุกการสแกนมี ScanTrace 1 ตัว: จับเวลาแต่ละ Stage (ทั้งภาพรวมและรายตัว) นับตัวที่ดึงไม่ได้/ข้อมูลไม่พอ
+# จบแล้ว log สรุปเป็น JSON บรรทัดเดียว บอกว่ารอบนี้ติดที่เน็ต (network) หรือ CPU
+# Stage ที่ใช้ในสแกนเนอร์:
+#   recheck    เช็ค Top 5 ตัวเดิม          targets  ดึงรายชื่อจาก Scanner + Pre-screen
+#   fetch      ดึงกราฟ 1 ตัว (ใน Worker)   fetch_wait  Thread สแกนรอให้ดึงครบทั้งก้อน
+#   analyze    คำนวณอินดิเคเตอร์ + ให้คะแนน  confirm  ดึงแท่งยาวยืนยันเทรนด์ใหญ่ (ตัวที่ผ่าน 8 คะแนน)
+#   select     คัดตัวเข้า Top               persist  เซฟผล
+SCAN_PROFILE_RATE = float(os.getenv("SCAN_PROFILE_RATE", 0)) # สัดส่วนรอบที่เปิด cProfile (0 = ปิด, 1 = ทุกรอบ)
+SCAN_PROFILE_DIR = os.getenv("SCAN_PROFILE_DIR", "/tmp/data/profiles")
+NETWORK_STAGES = ("recheck", "targets", "fetch_wait", "confirm") # recheck = ดึงแท่งใหม่ของ Top 5 เดิมเป็นหลัก
+CPU_STAGES = ("analyze", "select")
+
+class ScanHook:
+    """Hook ของการสแกน override เฉพาะเมธอดที่ต้องใช้ (ถูกเรียกจากหลาย Thread ได้)"""
+
+    def scan_start(self, trace): pass
+    def span_start(self, trace, stage, symbol): pass
+    def span_end(self, trace, stage, symbol, seconds, error): pass
+    def scan_end(self, trace, summary): pass
+
+SCAN_HOOKS = []
+
+def add_scan_hook(hook):
+    SCAN_HOOKS.append(hook)
+    return hook
+
+def remove_scan_hook(hook):
+    if hook in SCAN_HOOKS: SCAN_HOOKS.remove(hook)
+
+class MetricsHook(ScanHook):
+    """ส่งเวลาแต่ละ Stage เข้า /metrics (scan_stage_seconds)"""
+
+    def span_end(self, trace, stage, symbol, seconds, error):
+        SCAN_STAGE_SECONDS.observe(seconds, market=trace.market, stage=stage)
+
+add_scan_hook(MetricsHook())
+
+class ScanTrace:
+    """ใช้แบบ with ScanTrace(market, modes) as trace: ... แล้วครอบแต่ละขั้นด้วย trace.span(stage, symbol)
+    profile=None สุ่มตาม SCAN_PROFILE_RATE, True/False บังคับเปิด/ปิด cProfile (จับเฉพาะ Thread ที่สแกน)"""
+
+    def __init__(self, market, modes=(), hooks=None, profile=None):
+        self.market = market
+        self.modes = tuple(modes)
+        self.hooks = list(SCAN_HOOKS if hooks is None else hooks)
+        self.profile = (random.random() < SCAN_PROFILE_RATE) if profile is None else profile
+        self.targets = 0
+        self.scanned = 0
+        self.failed = 0
+        self.skipped = 0
+        self.errors = {}
+        self.stages = {}
+        self.symbol_seconds = []
+        self.summary = None
+        self._profiler = None
+        self._lock = threading.Lock()
+
+    def _call(self, name, *args):
+        for hook in self.hooks:
+            try: getattr(hook, name)(self, *args)
+            except Exception as e: logger.warning(f"Scan hook {type(hook).__name__}.{name} failed: {e}")
+
+    def __enter__(self):
+        self.started_at = datetime.now()
+        self._t0 = time.perf_counter()
+        self._call("scan_start")
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._profiler is not None: self._profiler.disable()
+        self.summary = self.build_summary(error=exc)
+        if self._profiler is not None: self.summary["profile"] = self._dump_profile()
+        logger.info(f"📊 Scan summary {json.dumps(self.summary, ensure_ascii=False, default=str)}")
+        self._call("scan_end", self.summary)
+        return False
+
+    @contextmanager
+    def span(self, stage, symbol=None, record_fail=True):
+        """จับเวลา 1 ช่วง ถ้าข้างในพังจะนับเป็น failed (ของ symbol นั้น) แล้วโยน Exception ต่อ
+        record_fail=False: ไม่นับ failed ให้ (คนเรียกนับเองตอนรู้ผลสุดท้าย เช่น ยังมีรอบดึงใหม่)"""
+        self._call("span_start", stage, symbol)
+        t0 = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            if record_fail: self.fail(symbol, type(e).__name__)
+            raise
+        finally:
+            seconds = time.perf_counter() - t0
+            with self._lock:
+                count, total, longest = self.stages.get(stage, (0, 0.0, 0.0))
+                self.stages[stage] = (count + 1, total + seconds, max(longest, seconds))
+                if symbol is not None: self.symbol_seconds.append((seconds, stage, symbol))
+            self._call("span_end", stage, symbol, seconds, error)
+
+    def fail(self, symbol, reason):
+        """ดึงกราฟไม่ได้/พัง (reason = ชื่อ Exception หรือเหตุผลสั้น ๆ)"""
+        with self._lock:
+            self.failed += 1
+            self.errors[reason] = self.errors.get(reason, 0) + 1
+
+    def skip(self, count=1):
+        """ดึงได้แต่ข้อมูลไม่พอให้คะแนน (แท่งน้อยกว่า 200)"""
+        with self._lock: self.skipped += count
+
+    def add_scanned(self, count):
+        with self._lock: self.scanned += count
+
+    def build_summary(self, error=None):
+        elapsed = time.perf_counter() - self._t0
+        with self._lock:
+            stages = {s: {"count": c, "seconds": round(t, 3), "max": round(m, 3)} for s, (c, t, m) in self.stages.items()}
+            slowest = heapq.nlargest(5, self.symbol_seconds)
+        network = sum(stages.get(s, {}).get("seconds", 0) for s in NETWORK_STAGES)
+        cpu = sum(stages.get(s, {}).get("seconds", 0) for s in CPU_STAGES)
+        return {
+            "market": self.market, "modes": list(self.modes), "started_at": self.started_at.isoformat(timespec="seconds"),
+            "elapsed": round(elapsed, 3), "targets": self.targets, "scanned": self.scanned,
+            "failed": self.failed, "skipped": self.skipped, "errors": dict(self.errors),
+            "symbols_per_sec": round(self.scanned / elapsed, 2) if elapsed > 0 else 0.0,
+            "bound": "network" if network >= cpu else "cpu",
+            "network_seconds": round(network, 3), "cpu_seconds": round(cpu, 3),
+            "stages": stages,
+            "slowest": [{"symbol": sym, "stage": st, "seconds": round(sec, 3)} for sec, st, sym in slowest],
+            "error": None if error is None else f"{type(error).__name__}: {error}",
+        }
+
+    def _dump_profile(self):
+        """เซฟไฟล์ .prof (เปิดด้วย snakeviz/pstats ได้) + log 15 ฟังก์ชันที่กินเวลาสะสมมากสุด"""
+        try:
+            os.makedirs(SCAN_PROFILE_DIR, exist_ok=True)
+            path = os.path.join(SCAN_PROFILE_DIR, f"scan_{self.market}_{self.started_at:%Y%m%d_%H%M%S}.prof")
+            self._profiler.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(15)
+            logger.info(f"🔬 Scan profile {self.market} ({path})\n{out.getvalue()}")
+            return path
+        except Exception as e:
+            logger.warning(f"Scan profile dump failed: {e}")
+            return None
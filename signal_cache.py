@@ -0,0 +1,66 @@
+import os
+import threading
+from collections import OrderedDict
+from metrics import CACHE_REQUESTS, SIGNAL_CACHE_BYTES
+
+# =====================
+# 🗂️ SIGNAL RESULT CACHE (/signal)
+# =====================
+# เก็บผล /signal (ข้อความ + รูปกราฟ + ผล Backtest) ต่อ (symbol, exchange, interval, เวลาแท่งล่าสุด)
+# ใครขอตัวเดิมในแท่งเดียวกัน ไม่ต้อง Backtest/วาดกราฟใหม่ และถ้าเคยส่งแล้วใช้ file_id ของ Telegram ได้เลย
+SIGNAL_CACHE_MAX_BYTES = int(os.getenv("SIGNAL_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+SIGNAL_CACHE_MAX_ENTRIES = int(os.getenv("SIGNAL_CACHE_MAX_ENTRIES", 500))
+
+class SignalCache:
+    """LRU Cache จำกัดทั้งจำนวนและขนาดรวม (ไบต์ของรูป + ข้อความ) ใช้ข้าม Thread ได้"""
+
+    def __init__(self, max_bytes=SIGNAL_CACHE_MAX_BYTES, max_entries=SIGNAL_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(symbol, exchange, interval, last_bar_time):
+        return (symbol, exchange, interval, str(last_bar_time))
+
+    @staticmethod
+    def _size(entry):
+        return len(entry.get("chart_bytes") or b"") + len(entry.get("text", "").encode())
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None: self._entries.move_to_end(key)
+        CACHE_REQUESTS.inc(cache="signal", result="miss" if entry is None else "hit")
+        return entry
+
+    def put(self, key, text, chart_bytes=None, stats=None):
+        entry = {"text": text, "chart_bytes": chart_bytes, "stats": stats, "file_id": None}
+        with self._lock:
+            # แท่งใหม่มาแล้ว ผลของแท่งเก่าของตัวเดียวกันใช้ไม่ได้อีก ลบทิ้งเลย
+            for old_key in [k for k in self._entries if k[:3] == key[:3] and k != key]:
+                self._drop(old_key)
+            if key in self._entries: self._drop(key)
+            self._entries[key] = entry
+            self.total_bytes += self._size(entry)
+            while self._entries and (self.total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                self._drop(next(iter(self._entries)))
+        return entry
+
+    def set_file_id(self, key, file_id):
+        """จำ file_id ของรูปที่ส่งไปแล้ว (ส่งซ้ำไม่ต้องอัปโหลดใหม่)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None: entry["file_id"] = file_id
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.total_bytes -= self._size(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+SIGNAL_CACHE = SignalCache()
+SIGNAL_CACHE_BYTES.set_function(lambda: SIGNAL_CACHE.total_bytes)
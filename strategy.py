@@ -1,34 +1,33 @@
 from tvDatafeed import TvDatafeed, Interval
 import pandas as pd
-import mplfinance as mpf 
+import io
 import os
 import requests 
 from datetime import datetime
 import time
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.lines as mlines 
 import numpy as np
 import json
 import logging
-matplotlib.use('Agg')
+import threading
+import bisect
+import itertools
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from indicators import ema, rolling_mean, calculate_indicators_batch, calculate_last_bars, stack_ohlcv, bar_at, frame_times, IndicatorState
+import bar_store
+from signal_cache import SIGNAL_CACHE
+from repository import get_repository
+from scan_trace import ScanTrace
+from metrics import SCAN_SECONDS, SCAN_SYMBOLS, SCAN_RATE, SCAN_ERRORS, EXECUTOR_QUEUE, queue_depth
 
 logger = logging.getLogger(__name__)
 
 # =====================
 # 💾 DATABASE STORAGE (MONGODB)
 # =====================
-MONGO_URI = os.getenv("MONGO_URI")
-db_collection = None
-
-if MONGO_URI:
-    try:
-        from pymongo import MongoClient
-        client = MongoClient(MONGO_URI)
-        db = client["TradingBotDB"]
-        db_collection = db["global_market_data"] # ตารางใหม่สำหรับเก็บหุ้น Top
-    except Exception as e:
-        logger.error(f"⚠️ MongoDB Connection Error in Strategy: {e}")
+# ตารางเก็บหุ้น Top (ไม่มี MONGO_URI ➜ เก็บเป็นไฟล์ในเครื่อง)
+market_repo = get_repository("global_market_data", "/tmp/data/global_market_data.json")
 
 # =====================
 # 💾 CACHE SYSTEM
@@ -41,70 +40,77 @@ GLOBAL_LAST_UPDATE = {"time": None}
 
 def save_cache_to_db(market_key, data, is_sell=False):
     """เซฟผลการสแกนลง Database อัตโนมัติ"""
-    if db_collection is not None:
-        doc_id = f"sell_{market_key}" if is_sell else f"buy_{market_key}"
-        try:
-            db_collection.update_one(
-                {"_id": doc_id},
-                {"$set": {
-                    "results": data.get("results", []),
-                    "updated_at": datetime.now().isoformat()
-                }},
-                upsert=True
-            )
-        except Exception as e:
-            logger.error(f"Failed to save {doc_id} to DB: {e}")
+    doc_id = f"sell_{market_key}" if is_sell else f"buy_{market_key}"
+    try:
+        market_repo.set(doc_id, {
+            "results": data.get("results", []),
+            "updated_at": datetime.now().isoformat()
+        })
+    except Exception as e:
+        logger.error(f"Failed to save {doc_id} to DB: {e}")
 
 def load_cache_from_db(market_key, is_sell=False):
     """โหลดผลการสแกนจาก Database ขึ้นมาใช้ตอนเปิดบอท"""
-    if db_collection is not None:
-        doc_id = f"sell_{market_key}" if is_sell else f"buy_{market_key}"
-        try:
-            doc = db_collection.find_one({"_id": doc_id})
-            if doc:
-                return {
-                    "results": doc.get("results", []),
-                    "updated_at": datetime.fromisoformat(doc["updated_at"]) if doc.get("updated_at") else None
-                }
-        except Exception as e:
-            logger.error(f"Failed to load {doc_id} from DB: {e}")
+    doc_id = f"sell_{market_key}" if is_sell else f"buy_{market_key}"
+    try:
+        doc = market_repo.get(doc_id)
+        if doc:
+            return {
+                "results": doc.get("results", []),
+                "updated_at": datetime.fromisoformat(doc["updated_at"]) if doc.get("updated_at") else None
+            }
+    except Exception as e:
+        logger.error(f"Failed to load {doc_id} from DB: {e}")
     return { "updated_at": None, "results": [] }
 
-# โหลดข้อมูลเก่ามาใส่ Cache ทันทีที่เปิดบอท
-TOP_CACHE_TH = load_cache_from_db("TH")
-TOP_CACHE_CN = load_cache_from_db("CN")
-TOP_CACHE_HK = load_cache_from_db("HK")
-TOP_CACHE_US_STOCK = load_cache_from_db("US")
-TOP_CACHE_CRYPTO = load_cache_from_db("CRYPTO")
-
-TOP_SELL_CACHE_TH = load_cache_from_db("TH", is_sell=True)
-TOP_SELL_CACHE_CN = load_cache_from_db("CN", is_sell=True)
-TOP_SELL_CACHE_HK = load_cache_from_db("HK", is_sell=True)
-TOP_SELL_CACHE_US_STOCK = load_cache_from_db("US", is_sell=True)
-TOP_SELL_CACHE_CRYPTO = load_cache_from_db("CRYPTO", is_sell=True)
-
-# อัปเดต GLOBAL STORE เพื่อให้คำสั่ง /top_all ใช้ได้ทันที
-GLOBAL_DATA_STORE["TH"] = TOP_CACHE_TH["results"]
-GLOBAL_DATA_STORE["CN"] = TOP_CACHE_CN["results"]
-GLOBAL_DATA_STORE["HK"] = TOP_CACHE_HK["results"]
-GLOBAL_DATA_STORE["US"] = TOP_CACHE_US_STOCK["results"]
-GLOBAL_DATA_STORE["CRYPTO"] = TOP_CACHE_CRYPTO["results"]
-
-GLOBAL_DATA_SELL_STORE["TH"] = TOP_SELL_CACHE_TH["results"]
-GLOBAL_DATA_SELL_STORE["CN"] = TOP_SELL_CACHE_CN["results"]
-GLOBAL_DATA_SELL_STORE["HK"] = TOP_SELL_CACHE_HK["results"]
-GLOBAL_DATA_SELL_STORE["US"] = TOP_SELL_CACHE_US_STOCK["results"]
-GLOBAL_DATA_SELL_STORE["CRYPTO"] = TOP_SELL_CACHE_CRYPTO["results"]
-
-# หาเวลาอัปเดตล่าสุด
-all_times = [c["updated_at"] for c in [TOP_CACHE_TH, TOP_CACHE_CN, TOP_CACHE_HK, TOP_CACHE_US_STOCK, TOP_CACHE_CRYPTO] if c["updated_at"]]
-if all_times:
-    GLOBAL_LAST_UPDATE["time"] = max(all_times)
+# เริ่มจาก Cache ว่าง (import ไม่ต้องรอฐานข้อมูล) แล้วค่อยโหลดผลสแกนเก่าเบื้องหลังด้วย warm_caches()
+MARKET_KEYS = ("TH", "CN", "HK", "US", "CRYPTO")
+TOP_CACHE_TH, TOP_CACHE_CN, TOP_CACHE_HK, TOP_CACHE_US_STOCK, TOP_CACHE_CRYPTO = ({"updated_at": None, "results": []} for _ in MARKET_KEYS)
+TOP_SELL_CACHE_TH, TOP_SELL_CACHE_CN, TOP_SELL_CACHE_HK, TOP_SELL_CACHE_US_STOCK, TOP_SELL_CACHE_CRYPTO = ({"updated_at": None, "results": []} for _ in MARKET_KEYS)
+BUY_CACHES = dict(zip(MARKET_KEYS, (TOP_CACHE_TH, TOP_CACHE_CN, TOP_CACHE_HK, TOP_CACHE_US_STOCK, TOP_CACHE_CRYPTO)))
+SELL_CACHES = dict(zip(MARKET_KEYS, (TOP_SELL_CACHE_TH, TOP_SELL_CACHE_CN, TOP_SELL_CACHE_HK, TOP_SELL_CACHE_US_STOCK, TOP_SELL_CACHE_CRYPTO)))
+
+def warm_caches():
+    """โหลดผลสแกนเก่าทั้ง buy_* / sell_* จาก Database ในการค้นครั้งเดียว (แทนการโหลดทีละตัว 10 รอบ)
+    ตลาดไหนสแกนใหม่เสร็จไปก่อนแล้ว ไม่เอาของเก่ามาทับ คืนค่าจำนวนเอกสารที่โหลดได้"""
+    ids = [f"{side}_{key}" for side in ("buy", "sell") for key in MARKET_KEYS]
+    try:
+        docs = market_repo.get_many(ids)
+    except Exception as e:
+        logger.error(f"Failed to warm market cache from DB: {e}")
+        return 0
+
+    for side, caches, store in (("buy", BUY_CACHES, GLOBAL_DATA_STORE), ("sell", SELL_CACHES, GLOBAL_DATA_SELL_STORE)):
+        for key, cache in caches.items():
+            doc = docs.get(f"{side}_{key}")
+            if not doc or cache["updated_at"] is not None: continue
+            cache["results"] = doc.get("results", [])
+            cache["updated_at"] = datetime.fromisoformat(doc["updated_at"]) if doc.get("updated_at") else None
+            # อัปเดต GLOBAL STORE เพื่อให้คำสั่ง /top_all ใช้ได้ทันที
+            store[key] = cache["results"]
+
+    # หาเวลาอัปเดตล่าสุด
+    all_times = [c["updated_at"] for c in BUY_CACHES.values() if c["updated_at"]]
+    if all_times and GLOBAL_LAST_UPDATE["time"] is None:
+        GLOBAL_LAST_UPDATE["time"] = max(all_times)
+    logger.info(f"💾 Market cache warmed ({len(docs)}/{len(ids)} docs)")
+    return len(docs)
+
+_warmup_thread = None
+
+def start_cache_warmup():
+    """เริ่ม warm_caches() ใน Thread เบื้องหลัง (ครั้งเดียว) ระหว่างนั้นคำสั่ง /top ตอบจากเท่าที่มี"""
+    global _warmup_thread
+    if _warmup_thread is None:
+        _warmup_thread = threading.Thread(target=warm_caches, name="cache-warmup", daemon=True)
+        _warmup_thread.start()
+    return _warmup_thread
 
 # =====================
 # 🛠 UTILS
 # =====================
-def get_stock_symbols_scanner(region="thailand", limit=5000):
+def get_stock_symbols_scanner(region="thailand", limit=5000, extra_columns=()):
+    """รายชื่อหุ้นเรียงตาม Volume คืนค่า (name, exchange) หรือ (name, exchange, *extra_columns)"""
     url = f"https://scanner.tradingview.com/{region}/scan"
     payload = {
         "filter": [
@@ -115,14 +121,14 @@ def get_stock_symbols_scanner(region="thailand", limit=5000):
         ],
         "options": {"lang": "en"},
         "symbols": {"query": {"types": []}},
-        "columns": ["name", "close", "volume", "change", "exchange"],
+        "columns": ["name", "close", "volume", "change", "exchange", *extra_columns],
         "sort": {"sortBy": "volume", "sortOrder": "desc"},
         "range": [0, limit]
     }
     try:
         response = requests.post(url, json=payload, timeout=20)
         data = response.json()
-        return [(d["d"][0], d["d"][4]) for d in data["data"]]
+        return [(d["d"][0], d["d"][4], *d["d"][5:]) for d in data["data"]]
     except: return []
 
 def get_top_usdt_symbols_by_volume(limit=100):
@@ -134,6 +140,113 @@ def get_top_usdt_symbols_by_volume(limit=100):
         return [d["symbol"] for d in usdt_pairs[:limit]]
     except: return []
 
+def process_context():
+    """Context ของ Process Pool: forkserver (ไม่มีให้ใช้ spawn) ห้ามใช้ fork
+    บอทมีหลาย Thread ทำงานอยู่ตลอด (Web Server, Executor, MongoClient, Worker ดึงกราฟ) fork ตอนนั้น
+    Process ลูกจะได้ Lock ที่ Thread อื่นถือค้างไว้ติดไปด้วย (logging, pymongo, socket) แล้วค้างตลอดไป
+    forkserver เปิด Server เปล่า ๆ (Thread เดียว) import โมดูลหลักครั้งเดียว แล้ว fork Worker จากตัวนั้นแทน"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+# =====================
+# 🔎 PRE-SCREEN (ตัดตัวที่ไม่มีทางถึง 8 คะแนน ก่อนดึงกราฟ)
+# =====================
+# สวนเทรนด์โดน -10 ทันที คะแนนที่เหลือบวกได้อีกไม่ถึง 18 ➜ ใช้ค่า EMA 1H จาก Scanner คัดทิ้งได้เลย
+SCAN_PRESCREEN = os.getenv("SCAN_PRESCREEN", "1") != "0"
+PRESCREEN_COLUMNS = ("close", "EMA50|60", "EMA200|60")
+SCAN_BARS = 250 # จำนวนแท่ง 1H ที่สแกนเนอร์ใช้ให้คะแนน
+# ค่าเผื่อ: EMA200 ของ Scanner คิดจากประวัติทั้งหมด ของเราเริ่มนับจากแท่งแรกใน 250 แท่ง (adjust=False)
+#   EMA ของเรา = EMA ประวัติยาว + w x (ราคาแท่งแรก - EMA ประวัติยาว ณ แท่งแรก),  w = (1 - 2/201)^249 ≈ 8.3%
+# ส่วนในวงเล็บไม่รู้ก่อนดึงกราฟ จึงกำหนดเพดาน PRESCREEN_MAX_GAP (ห่างได้ไม่เกินกี่ % ของ EMA200 ปัจจุบัน)
+# แล้วค่าเผื่อ = w x เพดาน (ค่าเริ่มต้น 50% ➜ ~4.2%) ตรวจของจริงได้ด้วย audit_prescreen()
+# (EMA50 น้ำหนักแท่งแรกเหลือ (49/51)^249 ≈ 0.005% ไม่ต้องเผื่อ)
+EMA200_SEED_WEIGHT = (1 - 2 / 201) ** (SCAN_BARS - 1)
+PRESCREEN_MAX_GAP = float(os.getenv("PRESCREEN_MAX_GAP", 0.5))
+PRESCREEN_TOLERANCE = EMA200_SEED_WEIGHT * PRESCREEN_MAX_GAP
+
+def trend_possible(close, ema_50, ema_200, mode="BUY"):
+    """เช็คว่ายังมีโอกาสผ่านกฎเทรนด์ (Rule 1) ไหม ถ้าข้อมูลไม่ครบให้ผ่านไว้ก่อน"""
+    if close is None or ema_50 is None or ema_200 is None: return True
+    if mode == "BUY":
+        floor = ema_200 * (1 - PRESCREEN_TOLERANCE)
+        return close > floor and ema_50 > floor
+    ceiling = ema_200 * (1 + PRESCREEN_TOLERANCE)
+    return close < ceiling and ema_50 < ceiling
+
+def _split_by_mode(rows, modes):
+    """rows = [(symbol, exchange, close, ema_50, ema_200)] ➜ (targets, only)
+    targets = ตัวที่ผ่านอย่างน้อย 1 โหมด (เรียงตามเดิม), only = {mode: set ของ symbol ที่ผ่านโหมดนั้น}"""
+    only = {mode: set() for mode in modes}
+    targets = []
+    for symbol, exchange, *values in rows:
+        passed = [mode for mode in modes if trend_possible(*values, mode=mode)]
+        for mode in passed: only[mode].add(symbol)
+        if passed: targets.append((symbol, exchange))
+    return targets, only
+
+def get_scanner_trend_values(region, tickers):
+    """ดึง close / EMA50 / EMA200 (1H) ของรายชื่อ tickers (เช่น BINANCE:BTCUSDT) จาก Scanner"""
+    url = f"https://scanner.tradingview.com/{region}/scan"
+    payload = {"symbols": {"tickers": list(tickers), "query": {"types": []}}, "columns": list(PRESCREEN_COLUMNS)}
+    try:
+        data = requests.post(url, json=payload, timeout=20).json()
+        return {d["s"]: tuple(d["d"]) for d in data["data"]}
+    except: return {}
+
+def prescreen_stock_symbols(region, limit, modes=("BUY",)):
+    """รายชื่อหุ้นจาก Scanner พร้อมคัดตัวสวนเทรนด์ทิ้ง คืนค่า (targets, only)"""
+    if not SCAN_PRESCREEN: return get_stock_symbols_scanner(region, limit=limit), None
+    rows = get_stock_symbols_scanner(region, limit=limit, extra_columns=PRESCREEN_COLUMNS)
+    return _split_by_mode(rows, modes)
+
+def _crypto_rows(symbols):
+    """[(symbol, "BINANCE", close, ema_50, ema_200)] จาก Scanner ฝั่ง crypto (ดึงไม่ได้ = None)"""
+    values = get_scanner_trend_values("crypto", [f"BINANCE:{s}" for s in symbols])
+    if not values: return None
+    return [(s, "BINANCE", *values.get(f"BINANCE:{s}", (None, None, None))) for s in symbols]
+
+def prescreen_crypto_symbols(symbols, modes=("BUY",)):
+    """คัดเหรียญสวนเทรนด์ทิ้ง (ใช้ Scanner ฝั่ง crypto ดึงค่า EMA ของ BINANCE) คืนค่า (targets, only)"""
+    targets = [(s, "BINANCE") for s in symbols]
+    if not SCAN_PRESCREEN or not symbols: return targets, None
+    rows = _crypto_rows(symbols)
+    if not rows: return targets, None
+    return _split_by_mode(rows, modes)
+
+def audit_prescreen(market="CRYPTO", limit=300, modes=("BUY", "SELL")):
+    """ตรวจว่า Pre-screen ไม่ได้ตัดตัวที่ควรติด Top: ดึงกราฟทุกตัว (ไม่ Pre-screen) แล้วเทียบ
+    - gap: |EMA200 ของเรา / EMA200 ของ Scanner - 1| ที่วัดได้จริง (max, p99) เทียบกับ PRESCREEN_TOLERANCE
+    - tops: Top 5 แต่ละโหมด ทั้งแบบสแกนเต็มและแบบ Pre-screen (คะแนน 1H ไม่รวม SCAN_CONFIRM)
+    - false_drops: ตัวที่ได้ 8 คะแนนขึ้นไปแต่โดน Pre-screen ตัดทิ้ง"""
+    market = market.upper()
+    if market == "CRYPTO": rows = _crypto_rows(get_top_usdt_symbols_by_volume(limit=limit)) or []
+    elif market in MARKET_REGIONS: rows = get_stock_symbols_scanner(MARKET_REGIONS[market], limit=limit, extra_columns=PRESCREEN_COLUMNS)
+    else: return None
+    targets, only = _split_by_mode(rows, modes)
+
+    dfs = [f.result() for f in [_fetch_pool.submit(_fetch_bars, symbol, exchange) for symbol, exchange, *_ in rows]]
+    scored = analyze_charts_multi(dfs, modes)
+
+    gaps = []
+    for (symbol, exchange, close, ema_50, ema_200), df in zip(rows, dfs):
+        if df is None or len(df) < 200 or not ema_200: continue
+        ours = calculate_last_bars(stack_ohlcv([df]))["ema_200"][0, -1]
+        gaps.append(abs(ours / ema_200 - 1))
+
+    def top5(mode, allowed):
+        return [symbol for (symbol, *_), (score, _, _) in zip(rows, scored[mode]) if score >= 8 and symbol in allowed][:5]
+
+    everyone = {symbol for symbol, *_ in rows}
+    tops = {mode: {"full": top5(mode, everyone), "prescreened": top5(mode, only[mode])} for mode in modes}
+    false_drops = {mode: [symbol for (symbol, *_), (score, _, _) in zip(rows, scored[mode]) if score >= 8 and symbol not in only[mode]] for mode in modes}
+    res = {
+        "market": market, "symbols": len(rows), "kept": len(targets), "tolerance": PRESCREEN_TOLERANCE,
+        "gap_max": float(np.max(gaps)) if gaps else None, "gap_p99": float(np.percentile(gaps, 99)) if gaps else None,
+        "tops": tops, "false_drops": false_drops, "same": all(t["full"] == t["prescreened"] for t in tops.values()),
+    }
+    logger.info(f"🔎 Prescreen audit {res}")
+    return res
+
 # =====================
 # 🧠 CORE ANALYSIS (PRO TRADER EDITION 🎯)
 # =====================
@@ -178,13 +291,9 @@ def calculate_indicators(df):
     
     return df
 
-def analyze_chart(df, mode="BUY"):
-    if df is None or len(df) < 200: return 0, [], 0
-    
-    df = calculate_indicators(df)
-    curr = df.iloc[-1]
-    prev = df.iloc[-2]
-    
+def score_setup(curr, prev, mode="BUY"):
+    """ให้คะแนนจากค่าอินดิเคเตอร์แท่งล่าสุด (curr) และแท่งก่อนหน้า (prev)
+    curr/prev เป็นได้ทั้งแถวของ DataFrame หรือ dict ที่มี key เดียวกัน"""
     score = 0
     reasons = []
     
@@ -291,83 +400,287 @@ def analyze_chart(df, mode="BUY"):
 
     return score, reasons, curr['close']
 
+# ยืนยันเทรนด์ด้วย Timeframe ใหญ่ (Resample จากไฟล์ 1H ใน Bar Store ไม่ดึงจาก TradingView เพิ่ม)
+# EMA200 ของ 1D ต้องมี 200 วัน = แท่ง 1H เกือบ 5000 แท่ง ข้อมูล 250 แท่งที่ใช้สแกนจึงไม่พอ ต้องดึงแท่งฐานยาวแยก
+# SCAN_CONFIRM = Timeframe ที่ตัวเข้า Top ต้องเห็นด้วย (ว่าง = ไม่ยืนยัน)
+SCAN_CONFIRM = tuple(tf for tf in (t.strip() for t in os.getenv("SCAN_CONFIRM", "4H,1D").split(",")) if tf in bar_store.TIMEFRAMES and tf != "1H")
+CONFIRM_MARGIN = 10 # แท่งเผื่อ (แท่งแรก/สุดท้ายที่ไม่ครบช่วง)
+
+def confirm_bars(confirm):
+    """จำนวนแท่ง 1H ที่ต้องดึงให้ทุก Timeframe ใน confirm มีอย่างน้อย 200 แท่ง (ไม่เกินที่ Bar Store เก็บได้)
+    (คิดแบบตลาดเปิด 24 ชม. หุ้นที่เปิดวันละไม่กี่ชั่วโมงจะได้แท่งใหญ่มากกว่านี้อีก)"""
+    need = [(200 + CONFIRM_MARGIN) * bar_store.TIMEFRAMES[tf][1] for tf in confirm]
+    return min(bar_store.MAX_STORED_BARS, max([250, *need]))
+
+def higher_timeframes(timeframe):
+    """Timeframe ที่ใหญ่กว่า timeframe (ใช้ยืนยันเทรนด์)"""
+    size = bar_store.TIMEFRAMES[timeframe][1]
+    return tuple(tf for tf, (_, n) in bar_store.TIMEFRAMES.items() if n > size)
+
+def timeframe_trend(df, timeframe, mode="BUY"):
+    """เทรนด์ของ Timeframe ใหญ่ (Resample จากแท่ง 1H ใน df ต้องยาวพอ ดู confirm_bars) ไปทางเดียวกับ mode ไหม
+    คืนค่า True / False หรือ None ถ้าแท่งไม่พอคำนวณ EMA200"""
+    htf = bar_store.resample(df, timeframe)
+    if len(htf) < 200: return None
+    close = htf["close"]
+    ema_50 = close.ewm(span=50, adjust=False).mean().iloc[-1]
+    ema_200 = close.ewm(span=200, adjust=False).mean().iloc[-1]
+    if mode == "BUY": return close.iloc[-1] > ema_200 and ema_50 > ema_200
+    return close.iloc[-1] < ema_200 and ema_50 < ema_200
+
+def _confirm_timeframes(df, mode, confirm, result):
+    """บังคับให้ Timeframe ใหญ่ (confirm เช่น ("4H", "1D")) เห็นด้วย ถ้าสวนเทรนด์หัก 10 คะแนนแบบ Counter Trend"""
+    score, reasons, price = result
+    for tf in confirm:
+        agrees = timeframe_trend(df, tf, mode)
+        if agrees is None:
+            reasons.append(f"⚠️ {tf}: ข้อมูลไม่พอยืนยันเทรนด์")
+        elif agrees:
+            reasons.append(f"🧭 {tf} Trend Agrees (เทรนด์ใหญ่ไปทางเดียวกัน)")
+        else:
+            score -= 10
+            reasons.append(f"❌ {tf} Counter Trend")
+    return score, reasons, price
+
+def analyze_chart(df, mode="BUY", confirm=(), base=None):
+    """ให้คะแนนกราฟ 1H, confirm = Timeframe ใหญ่ที่ต้องเห็นด้วย (เช่น ("4H", "1D"))
+    base = แท่ง 1H ยาว ๆ (confirm_bars) ไว้ Resample ยืนยันเทรนด์ ถ้าไม่ส่งมาใช้ df"""
+    if df is None or len(df) < 200: return 0, [], 0
+    
+    df = calculate_indicators(df)
+    return _confirm_timeframes(df if base is None else base, mode, confirm, score_setup(df.iloc[-1], df.iloc[-2], mode))
+
+def analyze_chart_fast(df, mode="BUY", confirm=(), base=None):
+    """analyze_chart แบบเร็ว: คำนวณอินดิเคเตอร์เฉพาะ 2 แท่งสุดท้ายด้วย NumPy (ไม่แตะ DataFrame)
+    คืนค่า (score, reasons, price) เหมือน analyze_chart"""
+    if df is None or len(df) < 200: return 0, [], 0
+    vals = calculate_last_bars(stack_ohlcv([df]))
+    return _confirm_timeframes(df if base is None else base, mode, confirm, score_setup(bar_at(vals, 0, -1), bar_at(vals, 0, -2), mode))
+
+def analyze_charts_batch(dfs, mode="BUY"):
+    """วิเคราะห์หลายหุ้นพร้อมกัน (คำนวณอินดิเคเตอร์เป็นก้อน หุ้น x แท่ง ด้วย NumPy)
+    คืนค่า list ของ (score, reasons, price) เรียงตามลำดับ dfs เหมือนเรียก analyze_chart ทีละตัว"""
+    return analyze_charts_multi(dfs, (mode,))[mode]
+
+def _ohlcv_arrays(df):
+    """แปลง DataFrame เป็น Array float ของ OHLCV สำหรับรวมก้อน
+    คืน None ถ้าคอลัมน์ขาด/แปลงเป็นตัวเลขไม่ได้/มี NaN หรือ inf (ให้ไปคิดทีละตัวแบบ pandas แทน)"""
+    try:
+        arrays = {c: df[c].to_numpy(dtype=float) for c in ("open", "high", "low", "close")}
+        arrays["volume"] = df["volume"].to_numpy(dtype=float) if "volume" in df.columns else np.zeros(len(df))
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not all(np.isfinite(a).all() for a in arrays.values()): return None
+    return arrays
+
+def _analyze_one(df, modes):
+    """ให้คะแนนทีละตัวด้วย analyze_chart (pandas) ตัวที่พังได้ (0, [], 0) ไม่ล้มทั้งก้อน"""
+    out = {}
+    for mode in modes:
+        try: out[mode] = analyze_chart(df.copy(), mode)
+        except Exception as e:
+            logger.warning(f"Analyze failed ({df['symbol'].iloc[-1] if 'symbol' in df.columns else '?'}): {e}")
+            out[mode] = (0, [], 0)
+    return out
+
+def analyze_charts_multi(dfs, modes=("BUY", "SELL")):
+    """เหมือน analyze_charts_batch แต่คำนวณอินดิเคเตอร์ครั้งเดียวแล้วให้คะแนนทุกโหมด
+    คืนค่า dict: mode ➜ list ของ (score, reasons, price)
+    ตัวที่ข้อมูลเสีย (คอลัมน์ขาด/ไม่ใช่ตัวเลข/มี NaN) หรือก้อนที่คำนวณพัง ให้คะแนนทีละตัวแทน"""
+    results = {mode: [(0, [], 0)] * len(dfs) for mode in modes}
+
+    # จับกลุ่มตามจำนวนแท่ง (EMA เริ่มนับจากแท่งแรก จึงต้องยาวเท่ากันถึงจะได้ค่าเท่าเดิม)
+    groups, singles, arrays = {}, [], {}
+    for i, df in enumerate(dfs):
+        if df is None or len(df) < 200: continue
+        arrays[i] = _ohlcv_arrays(df)
+        if arrays[i] is None: singles.append(i)
+        else: groups.setdefault(len(df), []).append(i)
+
+    for idxs in groups.values():
+        try:
+            block = calculate_last_bars({c: np.vstack([arrays[i][c] for i in idxs]) for c in arrays[idxs[0]]})
+            scored = {mode: [] for mode in modes}
+            for row in range(len(idxs)):
+                curr, prev = bar_at(block, row, -1), bar_at(block, row, -2)
+                for mode in modes: scored[mode].append(score_setup(curr, prev, mode))
+        except Exception as e:
+            logger.warning(f"Batch analyze failed ({len(idxs)} symbols), scoring one by one: {e}")
+            singles.extend(idxs)
+            continue
+        for mode in modes:
+            for i, result in zip(idxs, scored[mode]): results[mode][i] = result
+
+    for i in singles:
+        for mode, result in _analyze_one(dfs[i], modes).items(): results[mode][i] = result
+    return results
+
 # =====================
 # 🚀 SCANNER ENGINE
 # =====================
-def update_and_fill_market(region_name, scanner_region, cache_dict, mode="BUY", limit=500, callback=None):
-    """
-    ระบบสแกนแบบฉลาด: เช็ค Top 5 ตัวเดิมก่อน ถ้ายังสวยเก็บไว้ 
-    ถ้าไม่สวยค่อยสแกนหาตัวใหม่มาเติมให้เต็ม 5 ตัว
-    """
-    tv = TvDatafeed()
-    current_top = []
-    
-    # --- STEP 1: ตรวจสอบ Top 5 ตัวเดิม (ถ้ามี) ---
-    old_results = cache_dict.get("results", [])
-    if old_results:
-        # print(f"Checking existing Top {len(old_results)} for {region_name}...")
-        for s in old_results:
-            try:
-                df = tv.get_hist(symbol=s['symbol'], exchange=s['exchange'], interval=Interval.in_1_hour, n_bars=250)
-                score, reasons, price = analyze_chart(df, mode=mode)
-                
-                # ถ้าคะแนนยังผ่านเกณฑ์ 8 คะแนน (Pro Setup) ให้เก็บไว้
-                if score >= 8:
-                    current_top.append({
-                        "symbol": s['symbol'], "exchange": s['exchange'], 
-                        "price": price, "score": score, "reasons": reasons, "region": region_name
-                    })
-                time.sleep(0.01)
-            except: continue
-
-    # ถ้าระบบเดิมยังแข็งแกร่งครบ 5 ตัว ไม่ต้องสแกนใหม่ให้เสียเวลา
-    if len(current_top) >= 5:
-        # เรียงตามคะแนน
-        current_top = sorted(current_top, key=lambda x: x["score"], reverse=True)[:5]
-        cache_dict["updated_at"] = datetime.now()
-        cache_dict["results"] = current_top
-        if callback: callback(1, 1) # บอกบอทว่าเสร็จ 100%
-        return current_top
-
-    # --- STEP 2: สแกนหาตัวใหม่มาเติมให้เต็ม 5 ---
-    targets = get_stock_symbols_scanner(scanner_region, limit=limit)
-    
-    # กรองตัวที่อยู่ใน Top ปัจจุบันออกไปแล้ว จะได้ไม่สแกนซ้ำ
-    existing_symbols = [x['symbol'] for x in current_top]
-    targets = [t for t in targets if t[0] not in existing_symbols]
-    
+SCAN_BATCH_SIZE = 25 # จำนวนหุ้นที่ดึงมาวิเคราะห์พร้อมกันต่อ 1 ก้อน
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", 8)) # จำนวน Thread ที่ดึงกราฟพร้อมกัน (1 = ดึงทีละตัวแบบเดิม)
+
+# ✅ Pool กลางสำหรับดึงกราฟ (แชร์ทุกการสแกน จะได้ไม่ยิง TradingView เกินจำนวนนี้ แม้สแกนหลายตลาดพร้อมกัน)
+_fetch_pool = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="scan-fetch")
+EXECUTOR_QUEUE.set_function(lambda: queue_depth(_fetch_pool), pool="scan_fetch")
+_worker_local = threading.local()
+
+def _worker_tv():
+    """TvDatafeed ของแต่ละ Worker (1 Thread = 1 Connection)"""
+    if getattr(_worker_local, "tv", None) is None:
+        _worker_local.tv = TvDatafeed()
+    return _worker_local.tv
+
+def _fetch_bars(symbol, exchange, n_bars=SCAN_BARS, trace=None, final=True):
+    """ดึงกราฟ 1H ถ้าดึงไม่ได้คืน None (ถูกข้ามตอนให้คะแนน)
+    trace (ScanTrace): จับเวลาดึงรายตัว และนับตัวที่ดึงไม่ได้พร้อมสาเหตุ
+    final=False: ดึงไม่ได้ยังมีรอบดึงต่อ (เช่น delta ของ recheck) ไม่นับเป็น failed"""
+    reason = None
+    try:
+        with (trace.span("fetch", symbol, record_fail=False) if trace is not None else nullcontext()):
+            df = bar_store.get_hist(_worker_tv(), symbol, exchange, Interval.in_1_hour, n_bars)
+        if df is None: reason = "no_data"
+        return df
+    except Exception as e:
+        reason = type(e).__name__
+        return None
+    finally:
+        if reason and final and trace is not None: trace.fail(symbol, reason)
+        time.sleep(0.01)
+
+def _count_scanned(trace, results):
+    """นับจำนวนตัวที่สแกน / ดึงกราฟไม่ได้ ลง metrics และ ScanTrace"""
+    SCAN_SYMBOLS.inc(len(results), market=trace.market)
+    failed = sum(r is None for r in results)
+    if failed: SCAN_ERRORS.inc(failed, market=trace.market)
+    trace.add_scanned(len(results))
+
+def _scan_targets(targets, region_name, tops, callback=None, only=None, batch_size=SCAN_BATCH_SIZE, trace=None):
+    """ดึงกราฟทีละก้อนแบบขนาน (ผ่าน _fetch_pool) แล้ววิเคราะห์ทั้งก้อนด้วย analyze_charts_multi
+    tops = {mode: list} เติมแต่ละโหมดตามลำดับ targets จนครบ 5 ตัว หยุดเมื่อครบทุกโหมด
+    only = {mode: set ของ symbol} จำกัดว่าโหมดไหนรับได้เฉพาะตัวไหน (ผลจาก Pre-screen)"""
+    if trace is None: trace = ScanTrace(region_name.split()[-1], tops, hooks=()) # เรียกตรง ๆ (ไม่ผ่าน _stateful_scan)
     total = len(targets)
-    needed = 5 - len(current_top)
-    
-    for i, (symbol, exchange) in enumerate(targets):
-        if callback: callback(i, total)
-        
-        # ถ้าได้ครบ 5 ตัวแล้ว หยุดสแกนทันที! (ประหยัดเวลามาก)
-        if len(current_top) >= 5:
-            break
-            
-        try:
-            if exchange == "SZSE": exchange = "SZSE"
-            df = tv.get_hist(symbol=symbol, exchange=exchange, interval=Interval.in_1_hour, n_bars=250)
-            score, reasons, price = analyze_chart(df, mode=mode)
-            
+    for start in range(0, total, batch_size):
+        open_modes = [mode for mode, top in tops.items() if len(top) < 5]
+        if not open_modes: break
+        chunk = targets[start:start + batch_size]
+
+        futures = [_fetch_pool.submit(_fetch_bars, symbol, exchange, trace=trace) for symbol, exchange in chunk]
+        dfs = []
+        with trace.span("fetch_wait"):
+            for j, future in enumerate(futures):
+                dfs.append(future.result())
+                if callback: callback(start + j + 1, total)
+        _count_scanned(trace, dfs)
+        trace.skip(sum(df is not None and len(df) < 200 for df in dfs)) # ข้อมูลไม่พอให้คะแนน
+
+        with trace.span("analyze"):
+            scored = analyze_charts_multi(dfs, open_modes)
+        with trace.span("confirm"):
+            bases = _fetch_confirm_bases(_confirm_candidates(chunk, scored, open_modes, only), trace=trace)
+        with trace.span("select"):
+            _select_tops(chunk, dfs, scored, open_modes, tops, only, region_name, bases)
+    return tops
+
+def _fetch_confirm_bases(keys, confirm=SCAN_CONFIRM, trace=None):
+    """ดึงแท่ง 1H ยาว (confirm_bars) ของตัวที่ต้องยืนยันเทรนด์พร้อมกันผ่าน _fetch_pool
+    ครั้งแรกดึงเต็ม รอบถัดไป Bar Store ดึงแค่ส่วนที่ขาด คืนค่า {(symbol, exchange): df หรือ None}"""
+    keys = list(dict.fromkeys(keys))
+    if not confirm or not keys: return {}
+    futures = [_fetch_pool.submit(_fetch_bars, symbol, exchange, confirm_bars(confirm), trace) for symbol, exchange in keys]
+    return dict(zip(keys, [f.result() for f in futures]))
+
+def _confirm_setup(result, mode, base, confirm=SCAN_CONFIRM):
+    """ยืนยันตัวที่ผ่าน 8 คะแนนด้วย Timeframe ใหญ่ (base = แท่ง 1H ยาวจาก _fetch_confirm_bases)
+    ดึงไม่ได้ = ยืนยันไม่ได้ (เหมือนข้อมูลไม่พอ ไม่หักคะแนน) คืนค่า (score, reasons, price)"""
+    score, reasons, price = result
+    if not confirm or score < 8: return result
+    if base is None: return score, reasons + ["⚠️ ดึงกราฟยืนยันเทรนด์ไม่ได้"], price
+    return _confirm_timeframes(base, mode, confirm, (score, list(reasons), price))
+
+def _select_tops(chunk, dfs, scored, open_modes, tops, only, region_name, bases=None):
+    """เติมตัวที่ผ่านเกณฑ์ของก้อนนี้เข้า Top แต่ละโหมด (ตัวที่ผ่าน 8 คะแนนต้องผ่าน SCAN_CONFIRM ด้วย)"""
+    bases = bases or {}
+    for mode in open_modes:
+        top = tops[mode]
+        taken = {x['symbol'] for x in top}
+        for (symbol, exchange), df, result in zip(chunk, dfs, scored[mode]):
+            if len(top) >= 5: break
+            if symbol in taken or (only is not None and symbol not in only[mode]): continue
+            # ผ่านเกณฑ์ 8 คะแนน (Pro Setup) ทั้ง 1H และหลังยืนยันเทรนด์ใหญ่
+            score, reasons, price = _confirm_setup(result, mode, bases.get((symbol, exchange)))
             if score >= 8:
-                current_top.append({
-                    "symbol": symbol, "exchange": exchange, 
-                    "price": price, "score": score, "reasons": reasons, "region": region_name
-                })
-            time.sleep(0.01)
-        except: continue
-
-    # เรียงลำดับตัวท็อป 5 ตัว (เก่า+ใหม่ผสมกัน) ให้คนได้คะแนนสูงสุดขึ้นก่อน
-    current_top = sorted(current_top, key=lambda x: x["score"], reverse=True)[:5]
-    
+                top.append(_top_entry(symbol, exchange, score, reasons, price, region_name, IndicatorState.from_frame(df, SCAN_BARS)))
+                taken.add(symbol)
+
+def _confirm_candidates(chunk, scored, open_modes, only):
+    """ตัวในก้อนที่ผ่าน 8 คะแนนอย่างน้อย 1 โหมด (ต้องดึงแท่งยาวมายืนยันเทรนด์)"""
+    return [(symbol, exchange) for mode in open_modes
+            for (symbol, exchange), (score, _, _) in zip(chunk, scored[mode])
+            if score >= 8 and (only is None or symbol in only[mode])]
+
+def _top_entry(symbol, exchange, score, reasons, price, region_name, state):
+    return {
+        "symbol": symbol, "exchange": exchange, 
+        "price": price, "score": score, "reasons": reasons, "region": region_name,
+        "state": state.to_dict() # เก็บ State ไว้ให้รอบเช็คถัดไปอัปเดตต่อได้ทันที
+    }
+
+RECHECK_BARS = 24 # จำนวนแท่งล่าสุดที่ดึงมาต่อ State เดิม (ขาดช่วงเกินนี้ = ดึงใหม่ 250 แท่ง)
+
+def _refresh_state(symbol, exchange, state, trace=None):
+    """เดิน State เดิมไปข้างหน้าด้วยแท่งใหม่ (หน้าต่าง SCAN_BARS แท่งเดียวกับที่สแกนใช้ คะแนนจึงตรงกัน)
+    ถ้าไม่มี State หรือข้อมูลขาดช่วง ให้สร้างใหม่จาก 250 แท่ง"""
+    if state:
+        st = IndicatorState.from_dict(state)
+        df = _fetch_bars(symbol, exchange, n_bars=RECHECK_BARS, trace=trace, final=False)
+        if st.ready and df is not None and len(df) and frame_times(df)[0] <= st.time:
+            return st.advance_frame(df)
+    df = _fetch_bars(symbol, exchange, trace=trace)
+    if df is None: return None
+    if len(df) < 200:
+        if trace is not None: trace.skip()
+        return None
+    return IndicatorState.from_frame(df, SCAN_BARS)
+
+def _recheck_old(region_name, caches, tops, exchange=None, trace=None):
+    """เช็ค Top 5 ตัวเดิม: อัปเดต State ของแต่ละตัว (ดึงครั้งเดียวต่อ symbol) แล้วให้คะแนนใหม่ทุกโหมด"""
+    old = {mode: [(s['symbol'], exchange or s['exchange'], s.get('state')) for s in cache.get("results", [])] for mode, cache in caches.items()}
+    unique = {}
+    for entries in old.values():
+        for symbol, ex, state in entries: unique.setdefault((symbol, ex), state)
+    if not unique: return tops
+
+    keys = list(unique)
+    futures = [_fetch_pool.submit(_refresh_state, symbol, ex, unique[(symbol, ex)], trace) for symbol, ex in keys]
+    states = dict(zip(keys, [f.result() for f in futures]))
+    if trace is not None: _count_scanned(trace, list(states.values()))
+
+    scored = {mode: [(symbol, ex, score_setup(states[(symbol, ex)].curr, states[(symbol, ex)].prev, mode))
+                     for symbol, ex, _ in entries if states[(symbol, ex)] is not None] for mode, entries in old.items()}
+    bases = _fetch_confirm_bases([(symbol, ex) for rows in scored.values() for symbol, ex, (score, _, _) in rows if score >= 8], trace=trace)
+
+    for mode, rows in scored.items():
+        top = tops[mode]
+        for symbol, ex, result in rows:
+            if len(top) >= 5 or symbol in {x['symbol'] for x in top}: continue
+            st = states[(symbol, ex)]
+            score, reasons, price = _confirm_setup(result, mode, bases.get((symbol, ex)))
+            # ถ้าคะแนนยังผ่านเกณฑ์ 8 คะแนน (Pro Setup) ให้เก็บไว้
+            if score >= 8:
+                top.append(_top_entry(symbol, ex, score, reasons, price, region_name, st))
+    return tops
+
+def _store_top(market_key, mode, cache_dict, current_top, persist=True):
+    """เรียงคะแนน เก็บลง Cache (+ Database และ Global ถ้า persist)"""
     current_top = sorted(current_top, key=lambda x: x["score"], reverse=True)[:5]
     cache_dict["updated_at"] = datetime.now()
     cache_dict["results"] = current_top
-    
+    if not persist: return current_top
+
     # ✅ เซฟลง Database ทันที
-    market_key = region_name.split()[-1] # เอาคำย่อ TH, CN ออกมา
     is_sell = (mode == "SELL")
     save_cache_to_db(market_key, cache_dict, is_sell)
     
@@ -375,75 +688,80 @@ def update_and_fill_market(region_name, scanner_region, cache_dict, mode="BUY",
     if is_sell: GLOBAL_DATA_SELL_STORE[market_key] = current_top
     else: GLOBAL_DATA_STORE[market_key] = current_top
     GLOBAL_LAST_UPDATE["time"] = datetime.now()
-    
-    if callback: callback(1, 1) 
     return current_top
 
+# 🔒 1 ตลาด สแกนได้ทีละรอบ: งานตั้งเวลา (run_scan_*_market), warmup และคำสั่ง /top ใช้ Cache ก้อนเดียวกัน
+# ถ้าสแกนพร้อมกันจะเขียน Top 5 ทับกันและยิง TradingView ซ้ำ ตัวที่มาทีหลังรอให้รอบก่อนจบแล้วค่อย recheck ต่อ
+_market_locks = {}
+_market_locks_guard = threading.Lock()
+
+def _market_lock(market_key):
+    with _market_locks_guard:
+        return _market_locks.setdefault(market_key, threading.Lock())
+
+def _stateful_scan(region_name, caches, get_targets, exchange=None, callback=None):
+    """
+    ระบบสแกนแบบฉลาด: เช็ค Top 5 ตัวเดิมก่อน ถ้ายังสวยเก็บไว้ 
+    ถ้าไม่สวยค่อยสแกนหาตัวใหม่มาเติมให้เต็ม 5 ตัว
+    caches = {mode: cache_dict} สแกนหลายโหมดได้ในรอบเดียว (ดึงกราฟ + คำนวณอินดิเคเตอร์ครั้งเดียว)
+    """
+    market_key = region_name.split()[-1] # เอาคำย่อ TH, CN ออกมา
+    lock = _market_lock(market_key)
+    if not lock.acquire(blocking=False):
+        logger.info(f"⏳ {market_key} scan already running, waiting for it to finish")
+        lock.acquire()
+    try:
+        return _stateful_scan_locked(region_name, market_key, caches, get_targets, exchange, callback)
+    finally:
+        lock.release()
+
+def _stateful_scan_locked(region_name, market_key, caches, get_targets, exchange, callback):
+    tops = {mode: [] for mode in caches}
+
+    # จับเวลาทุกขั้น (recheck / targets / fetch / analyze / select / persist) จบแล้ว log สรุปให้เอง
+    with ScanTrace(market_key, caches) as trace:
+        # --- STEP 1: ตรวจสอบ Top 5 ตัวเดิม (ถ้ามี) ---
+        with trace.span("recheck"):
+            _recheck_old(region_name, caches, tops, exchange, trace=trace)
+
+        # ถ้าระบบเดิมยังแข็งแกร่งครบ 5 ตัว ไม่ต้องสแกนใหม่ให้เสียเวลา
+        full = {mode for mode, top in tops.items() if len(top) >= 5}
+        if len(full) < len(caches):
+            # --- STEP 2: สแกนหาตัวใหม่มาเติมให้เต็ม 5 (ได้ครบแล้วหยุดสแกนทันที) ---
+            with trace.span("targets"):
+                targets, only = get_targets([mode for mode in caches if mode not in full])
+            trace.targets = len(targets)
+            _scan_targets(targets, region_name, tops, callback, only=only, trace=trace)
+
+        with trace.span("persist"):
+            results = {mode: _store_top(market_key, mode, caches[mode], tops[mode], persist=mode not in full) for mode in caches}
+
+    elapsed = trace.summary["elapsed"]
+    SCAN_SECONDS.observe(elapsed, market=market_key, mode="+".join(caches))
+    SCAN_RATE.set(trace.summary["symbols_per_sec"], market=market_key)
+    if callback: callback(1, 1) # บอกบอทว่าเสร็จ 100%
+    return results
+
+def update_and_fill_market(region_name, scanner_region, cache_dict, mode="BUY", limit=500, callback=None):
+    """สแกนหุ้นโหมดเดียว (BUY หรือ SELL)"""
+    return _stateful_scan(region_name, {mode: cache_dict}, lambda modes: prescreen_stock_symbols(scanner_region, limit, modes), callback=callback)[mode]
+
+def update_and_fill_market_both(region_name, scanner_region, buy_cache, sell_cache, limit=500, callback=None):
+    """สแกน BUY + SELL ในรอบเดียว: ดึงกราฟแต่ละตัวครั้งเดียว คืนค่า (buy_top, sell_top)"""
+    res = _stateful_scan(region_name, {"BUY": buy_cache, "SELL": sell_cache}, lambda modes: prescreen_stock_symbols(scanner_region, limit, modes), callback=callback)
+    return res["BUY"], res["SELL"]
+
+def _crypto_targets(limit, modes):
+    return prescreen_crypto_symbols(get_top_usdt_symbols_by_volume(limit=limit), modes)
 
 def _scan_crypto_stateful(cache_dict, mode="BUY", limit=100, callback=None):
     """ระบบสแกน Crypto แบบเดียวกับหุ้น (เช็คของเก่าก่อน)"""
-    tv = TvDatafeed()
-    current_top = []
-    
-    # 1. เช็คของเดิม
-    old_results = cache_dict.get("results", [])
-    if old_results:
-        for s in old_results:
-            try:
-                df = tv.get_hist(symbol=s['symbol'], exchange="BINANCE", interval=Interval.in_1_hour, n_bars=250)
-                score, reasons, price = analyze_chart(df, mode=mode)
-                if score >= 8:
-                    current_top.append({
-                        "symbol": s['symbol'], "exchange": "BINANCE", 
-                        "price": price, "score": score, "reasons": reasons, "region": "CRYPTO"
-                    })
-                time.sleep(0.01)
-            except: continue
-
-    if len(current_top) >= 5:
-        current_top = sorted(current_top, key=lambda x: x["score"], reverse=True)[:5]
-        cache_dict["updated_at"] = datetime.now()
-        cache_dict["results"] = current_top
-        if callback: callback(1, 1)
-        return current_top
-
-    # 2. หาตัวใหม่มาเติม
-    SYMBOLS = get_top_usdt_symbols_by_volume(limit=limit)
-    existing_symbols = [x['symbol'] for x in current_top]
-    SYMBOLS = [s for s in SYMBOLS if s not in existing_symbols]
-    
-    total = len(SYMBOLS)
-    
-    for i, symbol in enumerate(SYMBOLS):
-        if callback: callback(i, total)
-        if len(current_top) >= 5: break # ได้ครบแล้วหยุด
-            
-        try:
-            df = tv.get_hist(symbol=symbol, exchange="BINANCE", interval=Interval.in_1_hour, n_bars=250)
-            score, reasons, price = analyze_chart(df, mode=mode)
-            if score >= 8:
-                current_top.append({
-                    "symbol": symbol, "exchange": "BINANCE", 
-                    "price": price, "score": score, "reasons": reasons, "region": "CRYPTO"
-                })
-            time.sleep(0.01)
-        except: continue
-        
-    current_top = sorted(current_top, key=lambda x: x["score"], reverse=True)[:5]
-    cache_dict["updated_at"] = datetime.now()
-    cache_dict["results"] = current_top
-    
-    # ✅ เซฟ Crypto ลง Database ทันที
-    is_sell = (mode == "SELL")
-    save_cache_to_db("CRYPTO", cache_dict, is_sell)
-    
-    # อัปเดต Global 
-    if is_sell: GLOBAL_DATA_SELL_STORE["CRYPTO"] = current_top
-    else: GLOBAL_DATA_STORE["CRYPTO"] = current_top
-    GLOBAL_LAST_UPDATE["time"] = datetime.now()
-    
-    if callback: callback(1, 1)
-    return current_top
+    return _stateful_scan("CRYPTO", {mode: cache_dict}, lambda modes: _crypto_targets(limit, modes), exchange="BINANCE", callback=callback)[mode]
+
+def _scan_crypto_both(buy_cache, sell_cache, limit=100, callback=None):
+    """สแกน Crypto BUY + SELL ในรอบเดียว คืนค่า (buy_top, sell_top)"""
+    res = _stateful_scan("CRYPTO", {"BUY": buy_cache, "SELL": sell_cache}, lambda modes: _crypto_targets(limit, modes), exchange="BINANCE", callback=callback)
+    return res["BUY"], res["SELL"]
 
 # ==========================================
 # Wrappers (เรียกใช้ระบบ Stateful ใหม่ทั้งหมด)
@@ -463,23 +781,24 @@ def scan_top_crypto_sell_symbols(limit=10000, callback=None): return _scan_crypt
 # =====================
 # 🔨 HEAVY SCAN
 # =====================
+def scan_cn_market_both(limit=10000, callback=None): return update_and_fill_market_both("🇨🇳 CN", "china", TOP_CACHE_CN, TOP_SELL_CACHE_CN, limit, callback)
+def scan_hk_market_both(limit=10000, callback=None): return update_and_fill_market_both("🇭🇰 HK", "hongkong", TOP_CACHE_HK, TOP_SELL_CACHE_HK, limit, callback)
+def scan_th_market_both(limit=10000, callback=None): return update_and_fill_market_both("🇹🇭 TH", "thailand", TOP_CACHE_TH, TOP_SELL_CACHE_TH, limit, callback)
+def scan_us_market_both(limit=10000, callback=None): return update_and_fill_market_both("🇺🇸 US", "america", TOP_CACHE_US_STOCK, TOP_SELL_CACHE_US_STOCK, limit, callback)
+def scan_crypto_market_both(limit=500, callback=None): return _scan_crypto_both(TOP_CACHE_CRYPTO, TOP_SELL_CACHE_CRYPTO, limit, callback)
+
 def run_scan_asia_market():
-    GLOBAL_DATA_STORE["CN"] = scan_top_cn_symbols(limit=10000)
-    GLOBAL_DATA_STORE["HK"] = scan_top_hk_symbols(limit=10000)
-    GLOBAL_DATA_SELL_STORE["CN"] = scan_top_cn_sell_symbols(limit=10000)
-    GLOBAL_DATA_SELL_STORE["HK"] = scan_top_hk_sell_symbols(limit=10000)
+    GLOBAL_DATA_STORE["CN"], GLOBAL_DATA_SELL_STORE["CN"] = scan_cn_market_both(limit=10000)
+    GLOBAL_DATA_STORE["HK"], GLOBAL_DATA_SELL_STORE["HK"] = scan_hk_market_both(limit=10000)
     GLOBAL_LAST_UPDATE["time"] = datetime.now()
 
 def run_scan_th_market():
-    GLOBAL_DATA_STORE["TH"] = scan_top_th_symbols(limit=10000)
-    GLOBAL_DATA_SELL_STORE["TH"] = scan_top_th_sell_symbols(limit=10000)
+    GLOBAL_DATA_STORE["TH"], GLOBAL_DATA_SELL_STORE["TH"] = scan_th_market_both(limit=10000)
     GLOBAL_LAST_UPDATE["time"] = datetime.now()
 
 def run_scan_us_market():
-    GLOBAL_DATA_STORE["US"] = scan_top_us_stock_symbols(limit=10000)
-    GLOBAL_DATA_STORE["CRYPTO"] = scan_top_crypto_symbols(limit=500)
-    GLOBAL_DATA_SELL_STORE["US"] = scan_top_us_stock_sell_symbols(limit=10000)
-    GLOBAL_DATA_SELL_STORE["CRYPTO"] = scan_top_crypto_sell_symbols(limit=500)
+    GLOBAL_DATA_STORE["US"], GLOBAL_DATA_SELL_STORE["US"] = scan_us_market_both(limit=10000)
+    GLOBAL_DATA_STORE["CRYPTO"], GLOBAL_DATA_SELL_STORE["CRYPTO"] = scan_crypto_market_both(limit=500)
     GLOBAL_LAST_UPDATE["time"] = datetime.now()
 
 # =====================
@@ -547,13 +866,122 @@ def get_global_sell_text():
 # =====================
 # 📈 BACKTEST STRATEGY (PRO TRADER & PRO CHART)
 # =====================
-def run_strategy(SYMBOL, EXCHANGE):
+def _resolve_positions(buy_idx, sell_idx):
+    """จับคู่จุดเข้า/ออกตามลำดับเวลา (เข้าได้ทีละไม้ ต้องขายก่อนถึงจะซื้อใหม่ได้)
+    วนตามจำนวนเทรด ไม่ได้วนทุกแท่ง: ใช้ bisect หาสัญญาณถัดไปที่ใช้ได้ (list ธรรมดาเร็วกว่า searchsorted ทีละค่า)"""
+    buys, sells = buy_idx.tolist(), sell_idx.tolist()
+    entries, exits = [], []
+    pos = 0
+    while True:
+        b = bisect.bisect_left(buys, pos)
+        if b >= len(buys): break
+        entry = buys[b]
+        entries.append(entry)
+        s = bisect.bisect_right(sells, entry)
+        if s >= len(sells): break
+        exits.append(sells[s])
+        pos = sells[s] + 1
+    return np.asarray(entries, dtype=np.intp), np.asarray(exits, dtype=np.intp)
+
+def _simulate(open_, close, buy_cond, sell_cond, initial_capital=100000, start=200):
+    """จำลองเทรดจากเงื่อนไขซื้อ/ขาย (Array bool) เข้า/ออกที่ราคาเปิดของแท่งถัดไป
+    คืนค่า (ผลสถิติ, index จุดเข้า, index จุดออก)"""
+    n = len(close)
+    # ต้องมีแท่งถัดไปไว้เข้า/ออกที่ราคาเปิด
+    window = np.zeros(n, dtype=bool); window[start:n - 1] = True
+    entries, exits = _resolve_positions(np.flatnonzero(buy_cond & window), np.flatnonzero(sell_cond & window))
+
+    entry_prices = open_[entries + 1]
+    exit_prices = open_[exits + 1]
+
+    # ทบต้นทีละไม้ (ลำดับการคำนวณเหมือนเดิมเป๊ะ ตัวเลขจะได้ตรงกัน)
+    capital = initial_capital; position = 0
+    for k, entry_price in enumerate(entry_prices):
+        position = capital / entry_price; capital = 0
+        if k < len(exit_prices):
+            capital = position * exit_prices[k]; position = 0
+    final_value = capital + position * close[-1]
+
+    trade_pnls = (exit_prices - entry_prices[:len(exit_prices)]) / entry_prices[:len(exit_prices)] * 100
+    wins = trade_pnls[trade_pnls > 0]
+    losses = trade_pnls[trade_pnls < 0]
+    profit = final_value - initial_capital
+    avg_win = sum(wins.tolist()) / len(wins) if len(wins) else 0
+    avg_loss = abs(sum(losses.tolist()) / len(losses)) if len(losses) else 0
+
+    stats = {
+        "final_value": final_value,
+        "profit": profit,
+        "roi": (profit / initial_capital) * 100,
+        "winrate": (len(wins) / len(trade_pnls) * 100) if len(trade_pnls) else 0,
+        "avg_win": avg_win,
+        "avg_loss": avg_loss,
+        "rrr": avg_win / avg_loss if avg_loss != 0 else 0,
+        "trades": len(entries),
+        "trade_pnls": trade_pnls,
+    }
+    return stats, entries, exits
+
+def _macd_crosses(macd, sig):
+    """MACD ตัดขึ้น/ลงเส้น Signal ของแท่ง i เทียบกับแท่ง i-1 (index 0 ไม่มีแท่งก่อนหน้า)"""
+    cross_up = np.zeros(macd.shape, dtype=bool); cross_down = np.zeros(macd.shape, dtype=bool)
+    cross_up[..., 1:] = (macd[..., :-1] < sig[..., :-1]) & (macd[..., 1:] > sig[..., 1:])
+    cross_down[..., 1:] = (macd[..., :-1] > sig[..., :-1]) & (macd[..., 1:] < sig[..., 1:])
+    return cross_up, cross_down
+
+def _strategy_conditions(ind):
+    """เงื่อนไขซื้อ/ขายของกลยุทธ์หลัก (ind = dict ของ Array: close, ema_50, ema_200, macd, signal_line, rsi)
+    ซื้อ: ขาขึ้น + MACD ตัดขึ้น + RSI < 70 | ขาย: MACD ตัดลง"""
+    cross_up, cross_down = _macd_crosses(ind["macd"], ind["signal_line"])
+    is_uptrend = (ind["close"] > ind["ema_200"]) & (ind["ema_50"] > ind["ema_200"])
+    return is_uptrend & cross_up & (ind["rsi"] < 70), cross_down
+
+def backtest_signals(df, initial_capital=100000, start=200):
+    """Backtest แบบ Vectorized (ผลลัพธ์เท่ากับการวนลูปทีละแท่งแบบเดิม)
+    - สร้างเงื่อนไขซื้อ/ขายทั้งก้อนด้วย NumPy
+    - เติมคอลัมน์ signal / signal_price ลง df ทีเดียว"""
+    close = df["close"].to_numpy(dtype=float)
+    open_ = df["open"].to_numpy(dtype=float)
+    buy_cond, sell_cond = _strategy_conditions({k: df[k].to_numpy(dtype=float) for k in ("close", "ema_50", "ema_200", "macd", "signal_line", "rsi")})
+    n = len(df)
+
+    stats, entries, exits = _simulate(open_, close, buy_cond, sell_cond, initial_capital, start)
+
+    signal = np.zeros(n, dtype=np.int64)
+    signal_price = np.full(n, np.nan)
+    signal[entries] = 1; signal[exits] = -1
+    signal_price[entries] = df["low"].to_numpy(dtype=float)[entries] * 0.995
+    signal_price[exits] = df["high"].to_numpy(dtype=float)[exits] * 1.005
+    df["signal"] = signal; df["signal_price"] = signal_price
+    return stats
+
+def _trend_icon(base, timeframe):
+    """เทรนด์ของ Timeframe ใหญ่สำหรับข้อความ /signal: 🟢 ขาขึ้น 🔴 ขาลง ⚪ ไม่ชัด ❔ ข้อมูลไม่พอ"""
+    if timeframe_trend(base, timeframe, "BUY"): return "🟢"
+    bearish = timeframe_trend(base, timeframe, "SELL")
+    if bearish is None: return "❔"
+    return "🔴" if bearish else "⚪"
+
+# คอลัมน์ที่ต้องใช้ในกราฟ (ส่งข้าม Process เฉพาะเท่านี้)
+PLOT_COLUMNS = ["open", "high", "low", "close", "volume", "ema_200", "ema_50", "hist", "macd", "signal_line", "signal", "signal_price"]
+
+def _chart_file(symbol):
+    return os.path.join("/tmp", "charts", f"{symbol}_adv_candle.png")
+
+def run_strategy(SYMBOL, EXCHANGE, render=True, in_memory=False, timeframe="1H", **chart_options):
+    """in_memory=True: คืนรูปเป็น BytesIO ใน "chart_buffer" แทนไฟล์ใน /tmp/charts
+    timeframe: "1H" / "4H" / "1D" (4H, 1D สร้างจากแท่ง 1H ที่เก็บไว้ ไม่ดึงเพิ่ม)
+    chart_options (fmt, dpi, compression) ส่งต่อให้ render_signal_chart"""
     TIMEFRAME = Interval.in_1_hour
     BARS = 3000
     INITIAL_CAPITAL = 100000
 
     tv = TvDatafeed()
-    df = tv.get_hist(symbol=SYMBOL, exchange=EXCHANGE, interval=TIMEFRAME, n_bars=BARS)
+    # ดึงแท่ง 1H ครั้งเดียวให้ยาวพอทั้ง Timeframe ที่ขอและ Timeframe ใหญ่กว่าที่ใช้ยืนยันเทรนด์ (MTF)
+    confirm = higher_timeframes(timeframe)
+    base_bars = max(min(BARS * bar_store.TIMEFRAMES[timeframe][1], bar_store.MAX_STORED_BARS), confirm_bars(confirm))
+    base = bar_store.get_hist(tv, SYMBOL, EXCHANGE, TIMEFRAME, base_bars)
+    df = None if base is None else bar_store.resample(base, timeframe).iloc[-BARS:]
 
     if df is None or len(df) < 200: return { "text": "❌ Error: No Data or Symbol Invalid", "chart": None }
 
@@ -561,131 +989,51 @@ def run_strategy(SYMBOL, EXCHANGE):
     df["datetime"] = pd.to_datetime(df["datetime"])
     df.set_index("datetime", inplace=True)
 
-    df = calculate_indicators(df)
+    # แท่งล่าสุดยังเป็นแท่งเดิม -> ใช้ผล Backtest/กราฟเดิมได้เลย ไม่ต้องคำนวณใหม่
+    cache_key = SIGNAL_CACHE.make_key(SYMBOL, EXCHANGE, timeframe, df.index[-1])
+    # render=True แต่ใน Cache ไม่มีรูป ➜ คำนวณและวาดใหม่ตามปกติด้านล่าง
+    cached = SIGNAL_CACHE.get(cache_key)
+    if cached is not None and (cached["chart_bytes"] or not render):
+        buffer = io.BytesIO(cached["chart_bytes"]) if in_memory and cached["chart_bytes"] else None
+        chart_path = None
+        if render and not in_memory:
+            # ผู้เรียกขอเป็นไฟล์: เขียนรูปจาก Cache ลง path เดียวกับตอนวาดจริง (ไม่ต้องวาดใหม่)
+            chart_path = _chart_file(SYMBOL)
+            os.makedirs(os.path.dirname(chart_path), exist_ok=True)
+            with open(chart_path, "wb") as f: f.write(cached["chart_bytes"])
+        return {"text": cached["text"], "chart": chart_path, "chart_buffer": buffer, "chart_job": None, "cache_key": cache_key, "cached": cached}
 
-    capital = INITIAL_CAPITAL; position = 0; trades = 0; trade_pnls = []
-    df["signal"] = 0; df["signal_price"] = np.nan
-    
-    for i in range(200, len(df) - 1):
-        curr = df.iloc[i]; prev = df.iloc[i-1]
-        
-        is_uptrend = (curr['close'] > curr['ema_200']) and (curr['ema_50'] > curr['ema_200'])
-        buy_condition = is_uptrend and (prev['macd'] < prev['signal_line']) and (curr['macd'] > curr['signal_line']) and (curr['rsi'] < 70)
+    df = calculate_indicators(df)
 
-        sell_condition = (prev['macd'] > prev['signal_line']) and (curr['macd'] < curr['signal_line'])
+    bt = backtest_signals(df, INITIAL_CAPITAL)
+    final_value = bt["final_value"]; profit = bt["profit"]; roi = bt["roi"]
+    winrate = bt["winrate"]; avg_win = bt["avg_win"]; avg_loss = bt["avg_loss"]
+    rrr = bt["rrr"]; trades = bt["trades"]
 
-        if position == 0 and buy_condition:
-            entry_price = df.iloc[i+1]["open"]
-            position = capital / entry_price; capital = 0; trades += 1
-            df.iloc[i, df.columns.get_loc("signal")] = 1
-            df.iloc[i, df.columns.get_loc("signal_price")] = df.iloc[i]["low"] * 0.995
-            
-        elif position > 0 and sell_condition:
-            exit_price = df.iloc[i+1]["open"]
-            pnl = (exit_price - entry_price) / entry_price * 100
-            trade_pnls.append(pnl)
-            capital = position * exit_price; position = 0
-            df.iloc[i, df.columns.get_loc("signal")] = -1
-            df.iloc[i, df.columns.get_loc("signal_price")] = df.iloc[i]["high"] * 1.005
-    
-    final_value = capital + position * df.iloc[-1]["close"]
-    profit = final_value - INITIAL_CAPITAL
-    roi = (profit / INITIAL_CAPITAL) * 100
-    
-    wins = [p for p in trade_pnls if p > 0]
-    losses = [p for p in trade_pnls if p < 0]
-    winrate = (len(wins) / len(trade_pnls) * 100) if trade_pnls else 0
-    avg_win = sum(wins) / len(wins) if wins else 0
-    avg_loss = abs(sum(losses) / len(losses)) if losses else 0
-    rrr = avg_win / avg_loss if avg_loss != 0 else 0
-    
     # =========================================
     # 🕯️ PLOT CANDLESTICK CHART (PRO CHART + LEGEND)
     # =========================================
-    df_plot = df.iloc[-200:].copy()
-
-    buy_signals = df_plot['signal_price'].where(df_plot['signal'] == 1, np.nan)
-    sell_signals = df_plot['signal_price'].where(df_plot['signal'] == -1, np.nan)
-
-    # 1. Base Indicators
-    apds = [
-        mpf.make_addplot(df_plot['ema_200'], color='purple', width=1.5, panel=0),
-        mpf.make_addplot(df_plot['ema_50'], color='cyan', width=1, panel=0),
-    ]
-
-    # 2. Buy/Sell Signals (Check for NaN to prevent errors)
-    if not buy_signals.isna().all():
-        apds.append(mpf.make_addplot(buy_signals, type='scatter', markersize=120, marker='^', color='lime', panel=0))
-    if not sell_signals.isna().all():
-        apds.append(mpf.make_addplot(sell_signals, type='scatter', markersize=120, marker='v', color='red', panel=0))
-
-    # 3. MACD Histogram (Fix color length issue by ensuring it matches the plotted data)
-    # We create a specific color array for the exact length of the plotted data
-    macd_colors = ['green' if val >= 0 else 'red' for val in df_plot['hist']]
-    
-    apds.extend([
-        mpf.make_addplot(df_plot['hist'], type='bar', width=0.7, panel=1, color=macd_colors, alpha=0.6, ylabel='MACD'),
-        mpf.make_addplot(df_plot['macd'], color='blue', width=1, panel=1),
-        mpf.make_addplot(df_plot['signal_line'], color='orange', width=1, panel=1),
-    ])
-
-    # 4. Styling
-    mc = mpf.make_marketcolors(up='green', down='red', edge='inherit', wick='inherit', volume='in')
-    s  = mpf.make_mpf_style(
-        marketcolors=mc, 
-        gridstyle=':', 
-        y_on_right=True, 
-        facecolor='white',
-        rc={'font.size': 12, 'axes.titlesize': 14, 'axes.labelsize': 10}
-    )
-
-    BASE_DIR = "/tmp"
-    chart_dir = os.path.join(BASE_DIR, "charts")
-    os.makedirs(chart_dir, exist_ok=True)
-    chart_path = os.path.join(chart_dir, f"{SYMBOL}_adv_candle.png")
-
-    # 5. Plot Generation
-    fig, axlist = mpf.plot(
-        df_plot,
-        type='candle',
-        style=s,
-        addplot=apds,
-        volume=True,
-        volume_panel=2,
-        panel_ratios=(6, 2, 2),
-        title=f"\n{SYMBOL} PRO Analysis (WinRate: {winrate:.1f}%)",
-        figsize=(14, 10),
-        scale_padding={'top': 1.5, 'bottom': 1.0, 'left': 0.8, 'right': 1.5},
-        tight_layout=True,
-        returnfig=True 
-    )
-
-    # 6. Legends Configuration
-    ema200_line = mlines.Line2D([], [], color='purple', linewidth=1.5, label='EMA 200 (Major Trend)')
-    ema50_line = mlines.Line2D([], [], color='cyan', linewidth=1, label='EMA 50 (Mid Trend)')
-    buy_marker = mlines.Line2D([], [], color='none', marker='^', markerfacecolor='lime', markeredgecolor='lime', markersize=10, label='BUY Signal')
-    sell_marker = mlines.Line2D([], [], color='none', marker='v', markerfacecolor='red', markeredgecolor='red', markersize=10, label='SELL Signal')
-    
-    # Add legend to the main price chart
-    axlist[0].legend(handles=[ema200_line, ema50_line, buy_marker, sell_marker], loc='upper left', fontsize=10, framealpha=0.9)
-
-    # Add legend to the MACD chart
-    macd_line = mlines.Line2D([], [], color='blue', linewidth=1, label='MACD Line')
-    sig_line = mlines.Line2D([], [], color='orange', linewidth=1, label='Signal Line')
-    try:
-        # axlist[2] is usually the MACD panel if volume is panel 2
-        axlist[2].legend(handles=[macd_line, sig_line], loc='upper left', fontsize=10, framealpha=0.9)
-    except: 
-        pass 
-
-    fig.savefig(chart_path)
-    plt.close(fig) 
+    chart_job = {
+        "df_plot": df.iloc[-200:][PLOT_COLUMNS].copy(),
+        "SYMBOL": SYMBOL if timeframe == "1H" else f"{SYMBOL} {timeframe}",
+        "winrate": winrate,
+        "chart_path": None if in_memory else _chart_file(SYMBOL),
+        **chart_options,
+    }
+    # render=False: ให้ผู้เรียก (bot) ส่ง chart_job ไปวาดใน Process Pool เอง
+    chart = None
+    if render:
+        from chart_renderer import render_signal_chart # matplotlib โหลดตอนวาดกราฟครั้งแรก
+        chart = render_signal_chart(**chart_job)
+    chart_bytes = chart if isinstance(chart, bytes) else None
+    chart_path = chart if isinstance(chart, str) else None
     
     # =========================================
     # STATUS & RETURN
     # =========================================
     last = df.iloc[-1]
     trend_st = "BULLISH 🟢" if (last['close'] > last['ema_200'] and last['ema_50'] > last['ema_200']) else "BEARISH 🔴"
+    mtf = " | ".join(f"{tf} {_trend_icon(base, tf)}" for tf in confirm) or "-"
     
     action = "WAIT ⏸"; entry = tp = sl = "-"
     if (last['close'] > last['ema_200'] and last['ema_50'] > last['ema_200']) and last['macd'] > last['signal_line']:
@@ -699,14 +1047,16 @@ def run_strategy(SYMBOL, EXCHANGE):
         sl = f"SL: {last['close'] + (last['atr']*2):,.2f}"
         tp = f"TP: {last['close'] - (last['atr']*3):,.2f}"
 
-    return {
+    res = {
         "text": f"""
 📊 *PRO MARKET SIGNAL*
 📌 Symbol : {SYMBOL}
 🏢 Market : {EXCHANGE}
+⏱️ TF     : {timeframe}
 💰 Price  : {last['close']:,.2f}
 
 📈 Trend  : {trend_st}
+🧭 MTF    : {mtf}
 📊 RSI    : {last['rsi']:.2f}
 📉 ATR    : {last['atr']:.2f}
 
@@ -728,5 +1078,277 @@ def run_strategy(SYMBOL, EXCHANGE):
 ⚖️ RRR            : {rrr:.2f}
 🔁 Trades          : {trades}
 """,
-        "chart": chart_path
-    }
\ No newline at end of file
+        "chart": chart_path,
+        "chart_buffer": io.BytesIO(chart_bytes) if chart_bytes else None,
+        "chart_job": None if render else chart_job,
+        "cache_key": cache_key,
+        "stats": {k: v for k, v in bt.items() if k != "trade_pnls"},
+    }
+    if chart_path and os.path.exists(chart_path):
+        with open(chart_path, "rb") as p: chart_bytes = p.read()
+    if chart_bytes: SIGNAL_CACHE.put(cache_key, res["text"], chart_bytes, res["stats"])
+    return res
+
+# =====================
+# 🧪 PARAMETER OPTIMIZER (/optimize)
+# =====================
+# ลองพารามิเตอร์หลายชุดกับกราฟเดียว (ดึงข้อมูลครั้งเดียว)
+# EMA ทุกความยาวคำนวณรอบเดียวแล้วใช้ร่วมกัน แต่ละชุดแค่ประกอบเงื่อนไขซื้อ/ขายแล้ว Backtest
+OPTIMIZE_GRID = {
+    "ema_trend": (20, 30, 50, 80, 100),
+    "ema_major": (100, 150, 200, 250),
+    "macd_fast": (8, 12, 16),
+    "macd_slow": (21, 26, 34),
+    "macd_signal": (5, 9, 12),
+    "rsi_max": (60, 65, 70, 75, 80),
+}
+DEFAULT_PARAMS = {"ema_trend": 50, "ema_major": 200, "macd_fast": 12, "macd_slow": 26, "macd_signal": 9, "rsi_max": 70}
+OPTIMIZE_BARS = 3000
+OPTIMIZE_MIN_TRADES = 5 # ชุดที่เทรดน้อยกว่านี้ไม่นับ (ROI สูงเพราะฟลุค)
+OPTIMIZE_RANK_KEYS = ("roi", "winrate", "rrr")
+# Process Pool กลางสำหรับงาน Backtest หนัก ๆ (/optimize, Portfolio Backtest)
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", max(1, min(4, os.cpu_count() or 1))))
+
+_backtest_pool = None
+_backtest_pool_lock = threading.Lock()
+EXECUTOR_QUEUE.set_function(lambda: queue_depth(_backtest_pool), pool="backtest")
+
+def get_backtest_pool():
+    """สร้างตอนใช้ครั้งแรก (มักถูกเรียกจาก Thread ของ Executor) ด้วย forkserver ไม่ fork จาก Process ที่มีหลาย Thread
+    งานที่ส่งไปเป็นฟังก์ชันระดับโมดูล + Array ของ NumPy จึง pickle ข้าม Process ได้"""
+    global _backtest_pool
+    if _backtest_pool is None:
+        with _backtest_pool_lock:
+            if _backtest_pool is None:
+                _backtest_pool = ProcessPoolExecutor(max_workers=BACKTEST_WORKERS, mp_context=process_context())
+    return _backtest_pool
+
+def expand_grid(grid=None):
+    """แตก Grid เป็นรายการชุดพารามิเตอร์ (ตัดชุดที่ไม่สมเหตุสมผล: เส้นเร็วต้องสั้นกว่าเส้นช้า)"""
+    grid = {**OPTIMIZE_GRID, **(grid or {})}
+    keys = list(grid)
+    points = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    return [p for p in points if p["ema_trend"] < p["ema_major"] and p["macd_fast"] < p["macd_slow"]]
+
+def _macd_key(p): return (p["macd_fast"], p["macd_slow"], p["macd_signal"])
+def _trend_key(p): return (p["ema_trend"], p["ema_major"])
+
+def _sweep_indicators(close, points):
+    """อินดิเคเตอร์ที่ทุกชุดใช้ร่วมกัน: EMA ทุกความยาว (รอบเดียว), MACD ต่อ (fast, slow, signal), RSI"""
+    spans = sorted({p[k] for p in points for k in ("ema_trend", "ema_major", "macd_fast", "macd_slow")})
+    emas = dict(zip(spans, ema(np.tile(close, (len(spans), 1)), spans)))
+
+    macd_keys = sorted({_macd_key(p) for p in points})
+    macd = np.vstack([emas[f] - emas[s] for f, s, _ in macd_keys])
+    cross_up, cross_down = _macd_crosses(macd, ema(macd, [k[2] for k in macd_keys]))
+    crosses = {k: (cross_up[i], cross_down[i]) for i, k in enumerate(macd_keys)}
+
+    uptrend = {k: (close > emas[k[1]]) & (emas[k[0]] > emas[k[1]]) for k in {_trend_key(p) for p in points}}
+
+    delta = np.zeros((1, len(close))); delta[0, 1:] = np.diff(close)
+    gain = rolling_mean(np.where(delta > 0, delta, 0.0), 14)[0]
+    loss = rolling_mean(np.where(delta < 0, -delta, 0.0), 14)[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100 - (100 / (1 + gain / loss))
+    return uptrend, crosses, rsi
+
+def _evaluate_points(open_, close, rsi, uptrend, crosses, points, initial_capital, start):
+    """Backtest ทีละชุด (รันใน Process Pool) คืนค่าพารามิเตอร์ + ผลสถิติ"""
+    results = []
+    for p in points:
+        cross_up, cross_down = crosses[_macd_key(p)]
+        buy_cond = uptrend[_trend_key(p)] & cross_up & (rsi < p["rsi_max"])
+        stats, _, _ = _simulate(open_, close, buy_cond, cross_down, initial_capital, start)
+        stats.pop("trade_pnls")
+        results.append({**p, **stats})
+    return results
+
+def _rank(results, min_trades):
+    """เรียงจากดีสุด: ชุดที่เทรดถึง min_trades ขึ้นก่อน แล้วเรียงตาม OPTIMIZE_RANK_KEYS"""
+    return sorted(results, key=lambda r: (r["trades"] >= min_trades, *(r[k] for k in OPTIMIZE_RANK_KEYS)), reverse=True)
+
+def optimize_params(df, grid=None, initial_capital=100000, start=200, min_trades=OPTIMIZE_MIN_TRADES, workers=BACKTEST_WORKERS):
+    """Sweep พารามิเตอร์ของกลยุทธ์บน DataFrame เดียว
+    คืนค่า (ผลทุกชุดเรียงจากดีสุดตาม OPTIMIZE_RANK_KEYS, ผลของค่าตั้งต้น DEFAULT_PARAMS)"""
+    points = expand_grid(grid)
+    if DEFAULT_PARAMS not in points: points.append(dict(DEFAULT_PARAMS))
+
+    close = df["close"].to_numpy(dtype=float)
+    open_ = df["open"].to_numpy(dtype=float)
+    uptrend, crosses, rsi = _sweep_indicators(close, points)
+
+    # แบ่งงานตามชุด MACD ส่งไปแต่ละ Process เฉพาะอินดิเคเตอร์ที่ก้อนนั้นต้องใช้
+    points.sort(key=_macd_key)
+    n_chunks = max(1, min(len(points), workers * 4))
+    chunks = [c for c in np.array_split(np.arange(len(points)), n_chunks) if len(c)]
+    jobs = []
+    for idx in chunks:
+        chunk = [points[i] for i in idx]
+        args = (open_, close, rsi,
+                {k: uptrend[k] for k in {_trend_key(p) for p in chunk}},
+                {k: crosses[k] for k in {_macd_key(p) for p in chunk}},
+                chunk, initial_capital, start)
+        jobs.append(args)
+
+    if workers > 1 and len(jobs) > 1:
+        futures = [get_backtest_pool().submit(_evaluate_points, *args) for args in jobs]
+        results = [r for f in futures for r in f.result()]
+    else:
+        results = [r for args in jobs for r in _evaluate_points(*args)]
+
+    baseline = next(r for r in results if all(r[k] == v for k, v in DEFAULT_PARAMS.items()))
+    return _rank(results, min_trades), baseline
+
+def _format_params(p):
+    return (f"EMA {p['ema_trend']}/{p['ema_major']} | MACD {p['macd_fast']}/{p['macd_slow']}/{p['macd_signal']} "
+            f"| RSI<{p['rsi_max']}")
+
+def optimize_strategy(SYMBOL, EXCHANGE, grid=None, top_n=5, n_bars=OPTIMIZE_BARS, **kwargs):
+    """ดึงกราฟ 1H ครั้งเดียวแล้ว Sweep พารามิเตอร์ (ใช้กับคำสั่ง /optimize)"""
+    t0 = time.time()
+    df = bar_store.get_hist(TvDatafeed(), SYMBOL, EXCHANGE, Interval.in_1_hour, n_bars)
+    if df is None or len(df) < 300: return {"text": "❌ Error: No Data or Symbol Invalid", "results": []}
+
+    results, baseline = optimize_params(df, grid, **kwargs)
+    best = results[:top_n]
+    elapsed = time.time() - t0
+
+    lines = ["🧪 *STRATEGY OPTIMIZER*", f"📌 Symbol : {SYMBOL}", f"🏢 Market : {EXCHANGE}",
+             f"🔬 Tested : {len(results)} sets on {len(df)} bars ({elapsed:.1f}s)", "",
+             "⚙️ *Current Setup*", _format_params(baseline),
+             f"📊 ROI {baseline['roi']:.2f}% | 👑 Win {baseline['winrate']:.1f}% | ⚖️ RRR {baseline['rrr']:.2f} | 🔁 {baseline['trades']}", "",
+             f"🏆 *Top {len(best)} Setups*"]
+    for i, r in enumerate(best, 1):
+        lines.append(f"{i}. {_format_params(r)}")
+        lines.append(f"   📊 ROI {r['roi']:.2f}% | 👑 Win {r['winrate']:.1f}% | ⚖️ RRR {r['rrr']:.2f} | 🔁 {r['trades']}")
+    return {"text": "\n".join(lines), "results": results, "baseline": baseline}
+
+
+# =====================
+# 💼 PORTFOLIO BACKTEST (ทั้งตลาด)
+# =====================
+# รันกลยุทธ์เดียวกับ /signal กับทุกตัวในตลาด (แบ่งเงินเท่า ๆ กันตัวละกอง ทบต้นในกองของตัวเอง)
+# ดึงกราฟผ่าน Bar Store (Thread Pool) แล้วส่ง Backtest ไป Process Pool ทันทีที่ได้ข้อมูลแต่ละตัว
+# (ใช้ get_backtest_pool ตัวเดียวกับ /optimize ที่เปิดด้วย forkserver ไม่มี Pool แบบ fork แยกของตัวเอง)
+PORTFOLIO_BARS = 1000
+MARKET_REGIONS = {"TH": "thailand", "CN": "china", "HK": "hongkong", "US": "america"}
+
+def get_market_universe(market, limit=100):
+    """รายชื่อ (symbol, exchange) ของตลาด: CRYPTO = เหรียญ USDT ที่ Volume สูงสุด, อื่น ๆ = Scanner ของ TradingView"""
+    market = market.upper()
+    if market == "CRYPTO": return [(s, "BINANCE") for s in get_top_usdt_symbols_by_volume(limit=limit)]
+    if market not in MARKET_REGIONS: return []
+    return get_stock_symbols_scanner(MARKET_REGIONS[market], limit)
+
+def _equity_curve(open_, close, entries, exits, initial_capital):
+    """มูลค่ากองรายแท่ง (ทบต้นแบบเดียวกับ _simulate) + แท่งที่ถือของอยู่"""
+    n = len(close)
+    equity = np.full(n, float(initial_capital)); holding = np.zeros(n, dtype=bool)
+    capital = initial_capital
+    for k, e in enumerate(entries):
+        shares = capital / open_[e + 1]
+        end = exits[k] + 1 if k < len(exits) else n
+        equity[e + 1:end] = shares * close[e + 1:end]; holding[e + 1:end] = True
+        if k < len(exits): capital = shares * open_[end]
+        equity[end:] = capital
+    return equity, holding
+
+def _backtest_series(times, bars, initial_capital, start):
+    """Backtest 1 ตัว (รันใน Process Pool) คืนค่ามูลค่ากองรายแท่ง, สถานะถือของ และสถิติ"""
+    ind = calculate_indicators_batch({k: v[None, :] for k, v in bars.items()})
+    buy_cond, sell_cond = _strategy_conditions({k: v[0] for k, v in ind.items()})
+    stats, entries, exits = _simulate(bars["open"], bars["close"], buy_cond, sell_cond, initial_capital, start)
+    equity, holding = _equity_curve(bars["open"], bars["close"], entries, exits, initial_capital)
+    return {"times": times, "equity": equity, "holding": holding, "stats": stats}
+
+def portfolio_backtest(symbols, initial_capital=100000, n_bars=PORTFOLIO_BARS, start=200, callback=None, workers=BACKTEST_WORKERS):
+    """Backtest ทั้งพอร์ต: symbols = [(symbol, exchange), ...] (workers=1 รันใน Thread นี้ ไม่ใช้ Process Pool)
+    คืนค่า Equity Curve รวม, Exposure (สัดส่วนกองที่ถือของ), Contribution ต่อตัว และสถิติรวม"""
+    symbols = list(dict.fromkeys((s[0], s[1]) for s in symbols))
+    if not symbols: return None
+    sleeve = initial_capital / len(symbols)
+    total = len(symbols)
+
+    # 1. ดึงกราฟพร้อมกัน ได้ตัวไหนส่งไป Backtest ใน Process Pool ทันที
+    pool = get_backtest_pool() if workers > 1 else ThreadPoolExecutor(max_workers=1)
+    fetches = {_fetch_pool.submit(_fetch_bars, symbol, exchange, n_bars): (symbol, exchange) for symbol, exchange in symbols}
+    jobs, skipped = {}, []
+    for done, f in enumerate(as_completed(fetches), 1):
+        key = fetches[f]
+        df = f.result()
+        if df is None or len(df) < start + 50: skipped.append(key)
+        else:
+            bars = {c: df[c].to_numpy(dtype=float) for c in ("open", "high", "low", "close")}
+            bars["volume"] = df["volume"].to_numpy(dtype=float) if "volume" in df.columns else np.zeros(len(df))
+            jobs[pool.submit(_backtest_series, df.index.values, bars, sleeve, start)] = key
+        if callback: callback(done, total)
+
+    runs = {}
+    for f in as_completed(jobs):
+        try: runs[jobs[f]] = f.result()
+        except Exception as e:
+            logger.warning(f"Portfolio backtest failed {jobs[f]}: {e}"); skipped.append(jobs[f])
+    if workers <= 1: pool.shutdown()
+    if not runs: return None
+
+    # 2. รวมทุกกองบนแกนเวลาเดียวกัน (ตัวที่ยังไม่มีแท่ง = ถือเงินสด)
+    names = [f"{ex}:{sym}" for sym, ex in runs]
+    equity = pd.concat([pd.Series(r["equity"], index=r["times"]) for r in runs.values()], axis=1, keys=names).sort_index()
+    holding = pd.concat([pd.Series(r["holding"], index=r["times"]) for r in runs.values()], axis=1, keys=names).sort_index()
+    equity = equity.ffill().fillna(sleeve)
+    holding = holding.astype(float).ffill().fillna(0.0)
+
+    # ตัวที่ดึงไม่ได้ = กองเงินสดที่ไม่ได้ใช้ (นับรวมในพอร์ตด้วย ผลจะได้ไม่เกินจริง)
+    curve = equity.sum(axis=1) + sleeve * (total - len(runs))
+    exposure = holding.sum(axis=1) / total
+
+    all_pnls = np.concatenate([r["stats"]["trade_pnls"] for r in runs.values()])
+    final_value = float(curve.iloc[-1])
+    contributions = {name: (r["stats"]["final_value"] - sleeve) / initial_capital * 100 for name, r in zip(names, runs.values())}
+    return {
+        "equity": curve,
+        "exposure": exposure,
+        "contributions": dict(sorted(contributions.items(), key=lambda kv: kv[1], reverse=True)),
+        "symbols": len(runs),
+        "skipped": skipped,
+        "final_value": final_value,
+        "roi": (final_value - initial_capital) / initial_capital * 100,
+        "max_drawdown": float((curve / curve.cummax() - 1).min() * 100),
+        "avg_exposure": float(exposure.mean() * 100),
+        "max_positions": int(holding.sum(axis=1).max()),
+        "trades": int(sum(r["stats"]["trades"] for r in runs.values())),
+        "winrate": float((all_pnls > 0).mean() * 100) if len(all_pnls) else 0.0,
+    }
+
+def run_portfolio_backtest(market="CRYPTO", limit=100, initial_capital=100000, n_bars=PORTFOLIO_BARS, callback=None):
+    """Portfolio Backtest ทั้งตลาด (ใช้กับคำสั่ง /portfolio) คืนค่า {"text", "result"}"""
+    t0 = time.time()
+    res = portfolio_backtest(get_market_universe(market, limit), initial_capital, n_bars, callback=callback)
+    if res is None: return {"text": f"❌ Error: No Data for market {market}", "result": None}
+    elapsed = time.time() - t0
+
+    contributions = list(res["contributions"].items())
+    best = "\n".join(f"🟢 {name} : {pct:+.2f}%" for name, pct in contributions[:5])
+    worst = "\n".join(f"🔴 {name} : {pct:+.2f}%" for name, pct in contributions[-5:][::-1])
+    text = f"""
+💼 *PORTFOLIO BACKTEST*
+🌍 Market  : {market.upper()}
+📦 Symbols : {res['symbols']} (skipped {len(res['skipped'])})
+🕒 Period  : {res['equity'].index[0]:%Y-%m-%d} → {res['equity'].index[-1]:%Y-%m-%d} ({elapsed:.1f}s)
+
+=====================
+💼 Final Portfolio : {res['final_value']:,.2f}
+📊 ROI             : {res['roi']:.2f}%
+📉 Max Drawdown    : {res['max_drawdown']:.2f}%
+⏱️ Avg Exposure    : {res['avg_exposure']:.1f}%
+📚 Max Positions   : {res['max_positions']}
+👑 Winrate         : {res['winrate']:.2f}%
+🔁 Trades          : {res['trades']}
+=====================
+🏆 *Top Contributors*
+{best}
+
+⚠️ *Worst Contributors*
+{worst}
+"""
+    return {"text": text, "result": res}
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+import bar_store
+
+class Interval:
+    name = "in_1_hour"
+
+class FakeTv:
+    """คืนแท่ง 1H ต่อเนื่อง n_bars แท่ง จบที่ end (ราคาปิด = ลำดับชั่วโมง ไว้เช็คว่าต่อกันถูก)"""
+    def __init__(self, end):
+        self.end = end
+
+    def get_hist(self, symbol, exchange, interval, n_bars):
+        index = pd.date_range(end=self.end, periods=n_bars, freq="h", name="datetime")
+        close = (index.asi8 // 3_600_000_000_000).astype(float)
+        return pd.DataFrame({"symbol": f"{exchange}:{symbol}", "open": close, "high": close, "low": close,
+                             "close": close, "volume": 1.0}, index=index)
+
+def test_refresh_older_than_fetch_window_stays_contiguous(tmp_path, monkeypatch):
+    monkeypatch.setattr(bar_store, "BAR_STORE_DIR", str(tmp_path))
+    now = pd.Timestamp.now().floor("h")
+    # ไฟล์ 5000 แท่งที่เก่ากว่าช่วงที่สแกนดึง (250 แท่ง) ไป 400 ชั่วโมง
+    bar_store.get_hist(FakeTv(now - pd.Timedelta(hours=400)), "AAA", "X", Interval, 5000)
+    bar_store.get_hist(FakeTv(now), "AAA", "X", Interval, 250)
+
+    df = bar_store.get_hist(FakeTv(now), "AAA", "X", Interval, 5000)
+    gaps = np.diff(df.index.values.astype("datetime64[s]").astype(np.int64))
+    assert len(df) == 5000
+    assert (gaps == 3600).all()
+    assert df.index[-1] == now
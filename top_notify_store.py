@@ -1,36 +1,15 @@
-import json
-import os
-
-# ดึง URL สำหรับเชื่อมต่อฐานข้อมูลจากตั้งค่าของ Render
-MONGO_URI = os.getenv("MONGO_URI")
+from repository import get_repository
 
 FILE = "/tmp/data/notify_users.json"
-db_collection = None
-
-# ถ้ามีการตั้งค่า MongoDB ระบบจะเชื่อมต่ออัตโนมัติ
-if MONGO_URI:
-    try:
-        from pymongo import MongoClient
-        client = MongoClient(MONGO_URI)
-        db = client["TradingBotDB"] # ชื่อก้อน Database
-        db_collection = db["notify_users"] # ชื่อตารางเก็บข้อมูล
-    except Exception as e:
-        print(f"⚠️ MongoDB Connection Error: {e}")
+USERS_DOC_ID = "users_list"
+# ไฟล์แบบเก่าเป็น list ของ chat_id ล้วนๆ
+repo = get_repository("notify_users", FILE, legacy=lambda ids: {USERS_DOC_ID: {"chat_ids": ids}})
 
 def load_top_notify_users():
     try:
-        # 🌟 โหลดจากฐานข้อมูลออนไลน์ (ข้อมูลไม่มีวันหาย)
-        if db_collection is not None:
-            doc = db_collection.find_one({"_id": "users_list"})
-            users = doc.get("chat_ids", []) if doc else []
-            return [int(x) for x in users] # บังคับเป็น int เสมอ
-        
-        # 📁 โหลดจากไฟล์เครื่อง (สำรองกรณีไม่ได้ต่อเน็ต)
-        else:
-            if not os.path.exists(FILE): return []
-            with open(FILE, "r") as f: 
-                users = json.load(f)
-                return [int(x) for x in users]
+        doc = repo.get(USERS_DOC_ID)
+        users = doc.get("chat_ids", []) if doc else []
+        return [int(x) for x in users] # บังคับเป็น int เสมอ
     except Exception as e:
         print(f"❌ Load Notify Users Error: {e}")
         return []
@@ -39,19 +18,7 @@ def save_top_notify_users(users):
     try:
         # ✅ บังคับให้เป็นตัวเลข (int) และลบข้อมูลที่ซ้ำกันออกให้หมด
         users = list(set([int(x) for x in users]))
-        
-        # 🌟 เซฟลงฐานข้อมูลออนไลน์
-        if db_collection is not None:
-            db_collection.update_one(
-                {"_id": "users_list"},
-                {"$set": {"chat_ids": users}},
-                upsert=True
-            )
-            
-        # 📁 เซฟลงไฟล์เครื่อง
-        else:
-            os.makedirs(os.path.dirname(FILE), exist_ok=True)
-            with open(FILE, "w") as f: json.dump(users, f)
+        repo.set(USERS_DOC_ID, {"chat_ids": users})
     except Exception as e:
         print(f"❌ Save Notify Users Error: {e}")
 
@@ -67,4 +34,20 @@ def remove_top_notify_user(chat_id):
     chat_id = int(chat_id) # บังคับแปลงเป็นตัวเลขก่อนเช็ค
     if chat_id in users:
         users.remove(chat_id)
-        save_top_notify_users(users)
\ No newline at end of file
+        save_top_notify_users(users)
+
+def remove_top_notify_users(chat_ids):
+    """ลบหลายคนในครั้งเดียว (เช่น คนที่บล็อกบอท หลังส่งสรุปตอนเช้า)"""
+    drop = {int(x) for x in chat_ids}
+    if not drop: return
+    users = load_top_notify_users()
+    remaining = [u for u in users if u not in drop]
+    if len(remaining) != len(users): save_top_notify_users(remaining)
+
+def replace_top_notify_users(migrated):
+    """แทน chat_id เก่าด้วยอันใหม่ (กลุ่มที่ถูกย้ายเป็น Supergroup: {เก่า: ใหม่}) รอบหน้าจะได้ส่งตรงไม่ต้องย้ายซ้ำ"""
+    migrated = {int(k): int(v) for k, v in migrated.items()}
+    if not migrated: return
+    users = load_top_notify_users()
+    updated = list(dict.fromkeys(migrated.get(u, u) for u in users))
+    if updated != users: save_top_notify_users(updated)
@@ -1,46 +1,26 @@
-import json
 import os
+import atexit
 import logging
+import threading
+from repository import get_repository
 
 # ✅ สร้างระบบ Logging ให้แสดงผลบน Render ได้ทันที
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# ดึง URL สำหรับเชื่อมต่อฐานข้อมูลจากตั้งค่าของ Render
-MONGO_URI = os.getenv("MONGO_URI")
-
 FILE = "/tmp/data/users.json"
-db_collection = None
-
-logger.info("========================================")
-logger.info(f"🔍 เช็คสถานะ MONGO_URI: {'✅ มีข้อมูล' if MONGO_URI else '❌ ว่างเปล่า (หาไม่เจอ)'}")
+USERS_DOC_ID = "general_users_list"
+# ไฟล์แบบเก่าเป็น list ของ chat_id ล้วนๆ
+repo = get_repository("all_users", FILE, legacy=lambda ids: {USERS_DOC_ID: {"chat_ids": ids}})
 
-# ถ้ามีการตั้งค่า MongoDB ระบบจะเชื่อมต่ออัตโนมัติ
-if MONGO_URI:
-    try:
-        from pymongo import MongoClient
-        client = MongoClient(MONGO_URI)
-        # ทดสอบการเชื่อมต่อ
-        client.admin.command('ping') 
-        db = client["TradingBotDB"]
-        db_collection = db["all_users"]
-        logger.info("✅ MongoDB: เชื่อมต่อฐานข้อมูล 'all_users' สำเร็จแล้ว! ข้อมูลจะไม่หายอีกต่อไป")
-    except Exception as e:
-        logger.error(f"❌ MongoDB Connection Error (เชื่อมต่อล้มเหลว): {e}")
-        db_collection = None
-else:
-    logger.warning("⚠️ ระบบจะใช้การเซฟลงไฟล์ /tmp (ข้อมูลจะหายเมื่ออัปเดตโค้ด)")
-logger.info("========================================")
+def read_users():
+    """รายชื่อ chat_id จากฐานข้อมูล (พังให้ Error ออกไป ไม่แปลงเป็นรายชื่อว่าง)"""
+    doc = repo.get(USERS_DOC_ID)
+    return doc.get("chat_ids", []) if doc else []
 
 def load_users():
     try:
-        if db_collection is not None:
-            doc = db_collection.find_one({"_id": "general_users_list"})
-            return doc.get("chat_ids", []) if doc else []
-        else:
-            if not os.path.exists(FILE): return []
-            with open(FILE, "r") as f: 
-                return json.load(f)
+        return read_users()
     except Exception as e:
         logger.error(f"❌ Load Users Error: {e}")
         return []
@@ -48,27 +28,107 @@ def load_users():
 def save_users(users):
     try:
         users = list(set([int(x) for x in users])) 
-        
-        if db_collection is not None:
-            db_collection.update_one(
-                {"_id": "general_users_list"},
-                {"$set": {"chat_ids": users}},
-                upsert=True
-            )
-        else:
-            os.makedirs(os.path.dirname(FILE), exist_ok=True)
-            with open(FILE, "w") as f: 
-                json.dump(users, f)
+        repo.set(USERS_DOC_ID, {"chat_ids": users})
     except Exception as e:
         logger.error(f"❌ Save Users Error: {e}")
 
+# =====================
+# 👥 USER REGISTRY (ในหน่วยความจำ + เขียนลงฐานข้อมูลทีหลังแบบเป็นก้อน)
+# =====================
+# โหลดรายชื่อครั้งเดียวเป็น set (เช็คผู้ใช้ใหม่ O(1)) ผู้ใช้ใหม่เข้าคิวไว้
+# แล้ว Thread เบื้องหลังส่งเฉพาะ chat_id ที่เพิ่มขึ้นด้วย add_to_set ($addToSet) ทุก USER_FLUSH_INTERVAL วินาที
+# โหลดใน Thread เบื้องหลังเท่านั้น (post_init / Thread flush) Handler บน Event Loop ไม่แตะฐานข้อมูลเลย
+# ยังโหลดไม่เสร็จหรือโหลดไม่สำเร็จ ➜ _users ยังเป็น None ระหว่างนั้นตอบจากคนที่เพิ่งเห็น แล้ว Thread flush ลองโหลดใหม่ทุกรอบ
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", 5))
+
+class UserRegistry:
+    def __init__(self, flush_interval=USER_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._users = None
+        self._unloaded = set() # คนที่เห็นระหว่างที่ยังโหลดรายชื่อไม่สำเร็จ (รวมเข้า _users ตอนโหลดได้)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def load(self):
+        """โหลดรายชื่อจากฐานข้อมูล (สำเร็จครั้งเดียวพอ) ถ้าพังให้ Thread flush ลองใหม่รอบถัดไป
+        อ่านฐานข้อมูลนอก _lock (add() ไม่ต้องรอเน็ต) ถือ lock แค่ตอนใส่ผลลัพธ์"""
+        if self._users is not None: return self
+        try:
+            users = {int(x) for x in read_users()}
+        except Exception as e:
+            logger.error(f"❌ Load Users Error: {e}")
+            self._start_flusher()
+            return self
+        with self._lock:
+            if self._users is None:
+                self._users, self._unloaded = users | self._unloaded, set()
+        return self
+
+    def _known(self):
+        # ไม่โหลดเองเด็ดขาด (ถูกเรียกจาก Event Loop) ยังไม่มีรายชื่อ = ตอบจากคนที่เพิ่งเห็น
+        return self._users if self._users is not None else self._unloaded
+
+    def __contains__(self, chat_id):
+        return int(chat_id) in self._known()
+
+    def __len__(self):
+        return len(self._known())
+
+    def add(self, chat_id):
+        """เพิ่มผู้ใช้ (คืนค่า True ถ้าเป็นคนใหม่) บันทึกจริงทีหลังในรอบ flush"""
+        chat_id = int(chat_id)
+        with self._lock:
+            known = self._users if self._users is not None else self._unloaded
+            if chat_id in known: return False
+            known.add(chat_id)
+            self._pending.add(chat_id)
+        self._start_flusher()
+        return True
+
+    def flush(self):
+        """บันทึกเฉพาะผู้ใช้ที่เพิ่มมาใหม่ ถ้าพังใส่กลับเข้าคิวรอรอบหน้า"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = sorted(self._pending), set()
+            if not batch: return 0
+            try:
+                repo.add_to_set(USERS_DOC_ID, "chat_ids", batch)
+                return len(batch)
+            except Exception as e:
+                logger.error(f"❌ Flush Users Error: {e}")
+                with self._lock: self._pending.update(batch)
+                return 0
+
+    def _start_flusher(self):
+        if self._thread is not None: return
+        with self._lock:
+            if self._thread is not None: return
+            self._thread = threading.Thread(target=self._flush_loop, name="user-flush", daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._users is None: self.load()
+            self.flush()
+
+    def close(self, timeout=10):
+        """ปิดบอท: ปลุก Thread flush ให้เขียนคิวที่ค้างทันทีแล้วหยุด (ไม่ต้องรอครบรอบ)"""
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None: self._thread.join(timeout)
+        self.flush()
+
+USERS = UserRegistry()
+atexit.register(USERS.close) # ปิดบอทปกติ ไม่ให้ผู้ใช้ที่ยังค้างในคิวหาย
+
 def is_new_user(chat_id):
-    users = load_users()
-    return int(chat_id) not in [int(x) for x in users]
+    return chat_id not in USERS
 
 def mark_user_seen(chat_id):
-    users = load_users()
-    chat_id = int(chat_id)
-    if chat_id not in [int(x) for x in users]:
-        users.append(chat_id)
-        save_users(users)
\ No newline at end of file
+    USERS.add(chat_id)